@@ -0,0 +1,85 @@
+#
+#  Copyright 2017 Red Hat, Inc. and/or its affiliates.
+#
+# Licensed to you under the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.  See the files README and
+# LICENSE_GPL_v2 which accompany this distribution.
+#
+
+from __future__ import (absolute_import, division, print_function)
+__metaclass__ = type
+
+DOCUMENTATION = '''
+    callback: quarry
+    type: stdout
+    short_description: Compact line-delimited JSON output for quarry
+    description:
+      - Prints one JSON record per line.  Every task result produces a small
+        timing record and results of quarry_* modules are printed in full so
+        that the quarry server can pick them out without buffering a report
+        of the whole run.
+'''
+
+import json
+import time
+
+from ansible.plugins.callback import CallbackBase
+
+
+class CallbackModule(CallbackBase):
+    CALLBACK_VERSION = 2.0
+    CALLBACK_TYPE = 'stdout'
+    CALLBACK_NAME = 'quarry'
+
+    def __init__(self, display=None):
+        super(CallbackModule, self).__init__(display)
+        self._task_index = -1
+        self._task_start = None
+
+    def _emit(self, record):
+        self._display.display(json.dumps(record, separators=(',', ':'),
+                                         default=str))
+
+    def v2_playbook_on_task_start(self, task, is_conditional):
+        self._task_index += 1
+        self._task_start = time.time()
+
+    def v2_playbook_on_handler_task_start(self, task):
+        self.v2_playbook_on_task_start(task, False)
+
+    def _record(self, result, status):
+        task = result._task
+        record = dict(type='task', index=self._task_index,
+                      task=task.get_name(), action=task.action,
+                      host=result._host.get_name(), status=status,
+                      duration=round(time.time() - self._task_start, 3))
+        self._emit(record)
+        if task.action.startswith('quarry_'):
+            record = dict(type='result', index=self._task_index,
+                          task=task.get_name(),
+                          host=result._host.get_name(), status=status,
+                          result=self._clean(result._result, task.action))
+            self._emit(record)
+
+    def _clean(self, result, action):
+        result = dict(result)
+        self._clean_results(result, action)
+        result.pop('invocation', None)
+        if 'results' in result:
+            # Loop and batch tasks report one result per item
+            result['results'] = [self._clean(r, action)
+                                 for r in result['results']]
+        return result
+
+    def v2_runner_on_ok(self, result):
+        self._record(result, 'ok')
+
+    def v2_runner_on_failed(self, result, ignore_errors=False):
+        self._record(result, 'ignored' if ignore_errors else 'failed')
+
+    def v2_runner_on_unreachable(self, result):
+        self._record(result, 'unreachable')
+
+    def v2_runner_on_skipped(self, result):
+        self._record(result, 'skipped')
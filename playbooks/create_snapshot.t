@@ -9,9 +9,12 @@
 
   tasks:
   - name: Create a snapshot
+    environment:
+      QUARRY_PROFILE: "{{ quarry_profile | default('') }}"
     quarry_snapshot:
       backend: "{{ backend }}"
       config: "{{ backend_config }}"
+      trace: "{{ quarry_trace | default(omit) }}"
       state: present
       id: $snapshot_id
       volume_id: $volume_id
@@ -9,8 +9,11 @@
 
   tasks:
   - name: Delete a snapshot
+    environment:
+      QUARRY_PROFILE: "{{ quarry_profile | default('') }}"
     quarry_snapshot:
       backend: "{{ backend }}"
       config: "{{ backend_config }}"
+      trace: "{{ quarry_trace | default(omit) }}"
       state: absent
       id: $snapshot_id
@@ -9,8 +9,11 @@
 
   tasks:
   - name: Delete a volume
+    environment:
+      QUARRY_PROFILE: "{{ quarry_profile | default('') }}"
     quarry_volume:
       backend: "{{ backend }}"
       config: "{{ backend_config }}"
+      trace: "{{ quarry_trace | default(omit) }}"
       state: absent
       id: $volume_id
@@ -0,0 +1,17 @@
+- hosts: "{{ ansible_host }}"
+  remote_user: "{{ ansible_user }}"
+
+  roles:
+  - quarry
+
+  vars_files:
+  - "{{ backend_vars_file }}"
+
+  tasks:
+  - name: List volumes and snapshots
+    environment:
+      QUARRY_PROFILE: "{{ quarry_profile | default('') }}"
+    quarry_facts:
+      backend: "{{ backend }}"
+      config: "{{backend_config}}"
+      trace: "{{ quarry_trace | default(omit) }}"
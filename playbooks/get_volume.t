@@ -9,9 +9,12 @@
 
   tasks:
   - name: Get a volume
+    environment:
+      QUARRY_PROFILE: "{{ quarry_profile | default('') }}"
     quarry_volume:
       backend: "{{ backend }}"
       config: "{{backend_config}}"
+      trace: "{{ quarry_trace | default(omit) }}"
       state: present
       id: $volume_id
       size: $volume_size
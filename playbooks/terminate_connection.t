@@ -9,9 +9,12 @@
 
   tasks:
   - name: Terminate a volume connection
+    environment:
+      QUARRY_PROFILE: "{{ quarry_profile | default('') }}"
     quarry_connection:
       backend: "{{ backend }}"
       config: "{{ backend_config }}"
+      trace: "{{ quarry_trace | default(omit) }}"
       state: absent
       volume_id: $volume_id
       initiator: $getVar('initiator', 'null')
@@ -0,0 +1,155 @@
+#
+#  Copyright 2017 Red Hat, Inc. and/or its affiliates.
+#
+# Licensed to you under the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.  See the files README and
+# LICENSE_GPL_v2 which accompany this distribution.
+#
+
+from contextlib import contextmanager
+import collections
+import logging
+import threading
+import time
+
+import tracing
+import utils
+
+
+# Latency sensitive operations (VM boots wait on them) which run in the fast
+# lane, ahead of provisioning work that can take minutes.
+FAST_OPERATIONS = ('get_volume', 'get_snapshot', 'initialize_connection',
+                   'terminate_connection')
+
+
+def is_fast(operation):
+    return operation in FAST_OPERATIONS
+
+
+class Gate(object):
+    """
+    Bound the number of operations running against one volume type.
+
+    Up to `limit` operations hold a slot at once (0 means no limit) and the
+    rest wait for one in FIFO order, fast lane operations ahead of slow
+    ones.  `reserved` of the slots are kept for the fast lane so that slow
+    operations can never take all of them.  check() refuses new work with
+    an Overloaded error once `queue_size` operations are already waiting in
+    its lane so that a burst turns into quick rejections instead of a pile
+    of forked playbooks.  Work which queues elsewhere before it asks for a
+    slot (such as background jobs) is counted through check()'s `backlog`.
+    """
+    log = logging.getLogger('Gate')
+
+    def __init__(self, name, limit=0, queue_size=0, reserved=0):
+        self.name = name
+        self.limit = limit
+        self.queue_size = queue_size
+        # Slow operations always get at least one slot
+        self.reserved = max(0, min(reserved, limit - 1))
+        self._cond = threading.Condition(threading.Lock())
+        self._waiters = dict(fast=collections.deque(),
+                             slow=collections.deque())
+        self.running = 0
+        self.running_slow = 0
+        self.waited = 0
+        self.wait_time = 0.0
+        self.max_wait_time = 0.0
+
+    @property
+    def waiting(self):
+        return sum(len(waiters) for waiters in self._waiters.values())
+
+    def check(self, fast=False, backlog=0):
+        """
+        Raise Overloaded if the lane has no room for another operation.
+        `backlog` is the number of operations of the lane already accepted
+        and not finished yet, whether or not they have reached slot().
+        """
+        with self._cond:
+            waiting = len(self._waiters['fast' if fast else 'slow'])
+            if self.limit:
+                # Whatever cannot be running is waiting
+                waiting = max(waiting, backlog - self.limit)
+            if self.queue_size and waiting >= self.queue_size:
+                raise utils.Overloaded(
+                    "Too many operations queued for %s" % self.name,
+                    self._retry_after())
+
+    @contextmanager
+    def slot(self, fast=False):
+        start = time.time()
+        with self._cond:
+            if self.limit:
+                waiters = self._waiters['fast' if fast else 'slow']
+                ticket = object()
+                waiters.append(ticket)
+                try:
+                    while not self._may_run(fast, ticket):
+                        self._cond.wait()
+                finally:
+                    waiters.remove(ticket)
+                    # The next waiter may be able to go now
+                    self._cond.notify_all()
+            self.running += 1
+            if not fast:
+                self.running_slow += 1
+            waited = time.time() - start
+            self.waited += 1
+            self.wait_time += waited
+            self.max_wait_time = max(self.max_wait_time, waited)
+        if self.limit:
+            tracing.record('queue', start, volume_type=self.name, fast=fast)
+        if waited > 1:
+            self.log.debug("Waited %.1fs for a slot on %s", waited, self.name)
+        try:
+            yield
+        finally:
+            with self._cond:
+                self.running -= 1
+                if not fast:
+                    self.running_slow -= 1
+                self._cond.notify_all()
+
+    def stats(self):
+        with self._cond:
+            return dict(running=self.running,
+                        running_slow=self.running_slow,
+                        waiting=self.waiting,
+                        waiting_fast=len(self._waiters['fast']),
+                        waited=self.waited, wait_time=self.wait_time,
+                        max_wait_time=self.max_wait_time)
+
+    def _may_run(self, fast, ticket):
+        if self.running >= self.limit:
+            return False
+        if fast:
+            return self._waiters['fast'][0] is ticket
+        return (not self._waiters['fast'] and
+                self._waiters['slow'][0] is ticket and
+                self.running_slow < self.limit - self.reserved)
+
+    def _retry_after(self):
+        # The average wait so far is the best guess of when a slot frees up
+        if not self.waited:
+            return 1
+        return max(1, int(round(self.wait_time / self.waited)))
+
+
+class GatedCaller(object):
+    """A caller which takes a slot on its volume type's Gate to run."""
+
+    def __init__(self, caller, gate):
+        self.caller = caller
+        self.gate = gate
+        self.volume_type = caller.volume_type
+        self.operation = caller.operation
+        self.params = caller.params
+
+    def run(self):
+        with self.gate.slot(is_fast(self.operation)):
+            return self.caller.run()
+
+    def cancel(self):
+        self.caller.cancel()
@@ -0,0 +1,117 @@
+#
+#  Copyright 2017 Red Hat, Inc. and/or its affiliates.
+#
+# Licensed to you under the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.  See the files README and
+# LICENSE_GPL_v2 which accompany this distribution.
+#
+
+from contextlib import contextmanager
+import copy
+import json
+import logging
+import os
+import signal
+import subprocess
+import sys
+
+from six.moves import queue
+
+import config
+import utils
+
+
+WORKER_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                             'ansible_worker.py')
+
+
+class AnsibleWorker(object):
+    """A single ansible_worker.py process and the pipe used to talk to it."""
+    log = logging.getLogger('AnsibleWorker')
+    script = WORKER_SCRIPT
+
+    def __init__(self):
+        env = config.ansible_env(copy.copy(os.environ))
+        # Requests and responses are JSON lines, so the pipes are text
+        # streams on both Python 2 and 3.
+        self.proc = subprocess.Popen([sys.executable, self.script],
+                                     shell=False, env=env,
+                                     stdin=subprocess.PIPE,
+                                     stdout=subprocess.PIPE,
+                                     universal_newlines=True,
+                                     preexec_fn=os.setsid)
+        self.log.debug("Started ansible worker (pid %i)", self.proc.pid)
+
+    def alive(self):
+        return self.proc.poll() is None
+
+    def call(self, volume_type, playbook=None, playbook_file=None,
+             extra_vars=None):
+        request = dict(volume_type=volume_type, playbook=playbook,
+                       playbook_file=playbook_file,
+                       extra_vars=extra_vars or {})
+        try:
+            self.proc.stdin.write(json.dumps(request) + '\n')
+            self.proc.stdin.flush()
+            line = self.proc.stdout.readline()
+        except IOError as e:
+            self.kill()
+            raise utils.WorkerError("Ansible worker %i failed: %s" %
+                                    (self.proc.pid, e))
+        if not line:
+            # The worker may not have been reaped yet; make sure it is not
+            # handed out again.
+            self.kill()
+            raise utils.WorkerError("Ansible worker %i exited (rc:%s)" %
+                                    (self.proc.pid, self.proc.returncode))
+        response = json.loads(line)
+        if 'error' in response:
+            raise utils.WorkerError(response['error'])
+        return response
+
+    def kill(self):
+        if self.alive():
+            self.log.debug("Killing ansible worker (pid %i)", self.proc.pid)
+            try:
+                os.killpg(self.proc.pid, signal.SIGTERM)
+            except OSError:
+                pass  # Already gone
+        self.proc.wait()
+
+
+class AnsiblePool(object):
+    """
+    Warm Ansible processes shared by all requests.
+
+    Each worker has Ansible imported with its loader, inventory and variable
+    manager already set up, which saves the interpreter and plugin loading
+    cost of a fresh ansible-playbook for every operation.  Requests wait for
+    an idle worker; workers that die or are killed are replaced.
+    """
+
+    def __init__(self, size):
+        self.size = size
+        self._idle = queue.Queue()
+        for i in range(size):
+            self._idle.put(AnsibleWorker())
+
+    @contextmanager
+    def worker(self):
+        worker = self._idle.get()
+        if not worker.alive():
+            worker.kill()
+            worker = AnsibleWorker()
+        try:
+            yield worker
+        finally:
+            if not worker.alive():
+                worker.kill()
+                worker = AnsibleWorker()
+            self._idle.put(worker)
+
+    def stop(self):
+        for i in range(self.size):
+            worker = self._idle.get()
+            worker.proc.stdin.close()
+            worker.proc.wait()
@@ -0,0 +1,141 @@
+#!/usr/bin/env python
+#
+#  Copyright 2017 Red Hat, Inc. and/or its affiliates.
+#
+# Licensed to you under the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.  See the files README and
+# LICENSE_GPL_v2 which accompany this distribution.
+#
+# A long-lived Ansible runner used by ansible_pool.AnsiblePool.  Requests
+# arrive on stdin as one JSON object per line and each response is written
+# back as one JSON line.  Ansible is imported once and its loader, inventory
+# and variable manager are kept for the life of the process.
+#
+
+from collections import namedtuple
+import json
+import os
+import sys
+import traceback
+
+
+class PlayRunner(object):
+
+    def __init__(self):
+        from ansible import constants as C
+        from ansible.executor.task_queue_manager import TaskQueueManager
+        from ansible.inventory.manager import InventoryManager
+        from ansible.parsing.dataloader import DataLoader
+        from ansible.playbook.play import Play
+        from ansible.vars.manager import VariableManager
+
+        self._TaskQueueManager = TaskQueueManager
+        self._Play = Play
+        self.loader = DataLoader()
+        self.inventory = InventoryManager(loader=self.loader,
+                                          sources=C.DEFAULT_HOST_LIST)
+        self.variable_manager = VariableManager(loader=self.loader,
+                                                inventory=self.inventory)
+        Options = namedtuple('Options', ['connection', 'module_path', 'forks',
+                                         'become', 'become_method',
+                                         'become_user', 'check', 'diff'])
+        self.options = Options(connection='smart', module_path=None,
+                               forks=C.DEFAULT_FORKS, become=None,
+                               become_method=None, become_user=None,
+                               check=False, diff=False)
+
+    def run(self, volume_type, playbook=None, playbook_file=None,
+            extra_vars=None):
+        # The quarry role finds its backend configuration through this
+        # variable (see roles/quarry/defaults/main.yml)
+        os.environ['QUARRY_VOLUME_TYPE'] = volume_type
+        self.variable_manager.extra_vars = extra_vars or {}
+        if playbook_file is not None:
+            # The loader caches parsed files so a static playbook is only
+            # read and parsed once per worker.
+            self.loader.set_basedir(os.path.dirname(playbook_file))
+            plays_ds = self.loader.load_from_file(playbook_file)
+        else:
+            plays_ds = self.loader.load(playbook)
+        rc = 0
+        plays = []
+        for play_ds in plays_ds:
+            play = self._Play().load(play_ds,
+                                     variable_manager=self.variable_manager,
+                                     loader=self.loader)
+            collector = _collector()
+            tqm = self._TaskQueueManager(
+                inventory=self.inventory,
+                variable_manager=self.variable_manager,
+                loader=self.loader,
+                options=self.options,
+                passwords=dict(),
+                stdout_callback=collector)
+            try:
+                rc = tqm.run(play) or rc
+            finally:
+                tqm.cleanup()
+            plays.append(dict(tasks=collector.tasks))
+        return dict(rc=rc, plays=plays)
+
+
+def _collector():
+    from ansible.plugins.callback import CallbackBase
+
+    class ResultCollector(CallbackBase):
+        """Record task results in the layout of the json stdout callback."""
+        CALLBACK_VERSION = 2.0
+        CALLBACK_TYPE = 'stdout'
+        CALLBACK_NAME = 'quarry_collector'
+
+        def __init__(self):
+            super(ResultCollector, self).__init__()
+            self.tasks = []
+
+        def v2_playbook_on_task_start(self, task, is_conditional):
+            self.tasks.append(dict(task=dict(name=task.get_name()),
+                                   hosts={}))
+
+        def _record(self, result, **flags):
+            res = dict(result._result)
+            res.update(flags)
+            self.tasks[-1]['hosts'][result._host.get_name()] = res
+
+        def v2_runner_on_ok(self, result):
+            self._record(result)
+
+        def v2_runner_on_failed(self, result, ignore_errors=False):
+            self._record(result, failed=True)
+
+        def v2_runner_on_unreachable(self, result):
+            self._record(result, unreachable=True)
+
+        def v2_runner_on_skipped(self, result):
+            self._record(result, skipped=True)
+
+    return ResultCollector()
+
+
+def main(runner_class=PlayRunner):
+    # Keep a private copy of stdout for responses and send anything Ansible
+    # prints to stderr so that it cannot corrupt the protocol.
+    responses = os.fdopen(os.dup(1), 'w')
+    os.dup2(2, 1)
+
+    runner = runner_class()
+    for line in iter(sys.stdin.readline, ''):
+        request = json.loads(line)
+        try:
+            response = runner.run(request['volume_type'],
+                                  request.get('playbook'),
+                                  request.get('playbook_file'),
+                                  request.get('extra_vars'))
+        except Exception:
+            response = dict(error=traceback.format_exc())
+        responses.write(json.dumps(response, default=str) + '\n')
+        responses.flush()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,159 @@
+#
+#  Copyright 2017 Red Hat, Inc. and/or its affiliates.
+#
+# Licensed to you under the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.  See the files README and
+# LICENSE_GPL_v2 which accompany this distribution.
+#
+
+import logging
+import sys
+import threading
+
+import admission
+import pool
+import utils
+
+
+class _Batch(object):
+
+    def __init__(self):
+        self.entries = []
+        self.timer = None
+
+
+class Batcher(object):
+    """
+    Coalesce concurrent operations of the same kind into batched playbooks.
+
+    The first request for a (volume_type, operation) opens a batch which
+    collects further requests for `window` seconds, or until it holds
+    `max_size` of them, and is then run as a single batch on the worker pool.
+    Each request gets its own Future which completes with its item's result.
+    Batches of fast lane operations run on their own `fast_workers` workers
+    when given.
+    """
+    log = logging.getLogger('Batcher')
+
+    def __init__(self, executor, window, max_size=50, workers=4,
+                 fast_workers=0):
+        self.executor = executor
+        self.window = window
+        self.max_size = max_size
+        self._pool = pool.WorkerPool('batch', workers)
+        self._fast_pool = self._pool
+        if fast_workers > 0:
+            self._fast_pool = pool.WorkerPool('batch-fast', fast_workers)
+        self._lock = threading.Lock()
+        self._pending = {}
+
+    def submit(self, volume_type, operation, params):
+        key = (volume_type, operation)
+        future = pool.Future()
+        with self._lock:
+            batch = self._pending.get(key)
+            if batch is None:
+                batch = self._pending[key] = _Batch()
+                batch.timer = threading.Timer(self.window, self._flush,
+                                              (key, batch))
+                batch.timer.daemon = True
+                batch.timer.start()
+            batch.entries.append((params, future))
+            if len(batch.entries) >= self.max_size:
+                batch.timer.cancel()
+                self._dispatch(key)
+        return future
+
+    def cancel(self, future):
+        """Drop a request whose batch has not started yet."""
+        with self._lock:
+            for batch in self._pending.values():
+                entries = [e for e in batch.entries if e[1] is not future]
+                if len(entries) < len(batch.entries):
+                    batch.entries = entries
+                    break
+            else:
+                return False
+        try:
+            raise utils.Cancelled("Request was cancelled")
+        except utils.Cancelled:
+            future.set_exception(sys.exc_info())
+        return True
+
+    def pools(self):
+        return [self._pool, self._fast_pool]
+
+    def stop(self):
+        # Run whatever is still waiting for its window to close
+        with self._lock:
+            for key, batch in list(self._pending.items()):
+                batch.timer.cancel()
+                self._dispatch(key)
+        self._pool.stop()
+        if self._fast_pool is not self._pool:
+            self._fast_pool.stop()
+
+    def _flush(self, key, batch):
+        with self._lock:
+            # The batch may already have been sent off when it filled up
+            if self._pending.get(key) is batch:
+                self._dispatch(key)
+
+    def _dispatch(self, key):
+        batch = self._pending.pop(key)
+        if batch.entries:
+            workers = (self._fast_pool if admission.is_fast(key[1]) else
+                       self._pool)
+            workers.submit(self._run, key, batch.entries)
+
+    def _run(self, key, entries):
+        volume_type, operation = key
+        self.log.debug("Running %s on %s for %i items", operation,
+                       volume_type, len(entries))
+        try:
+            # The requests were admitted when they joined the batch
+            results = self.executor.run_batch(volume_type, operation,
+                                              [params for params, f in
+                                               entries], admit=False)
+        except Exception:
+            exc_info = sys.exc_info()
+            for params, future in entries:
+                future.set_exception(exc_info)
+            return
+        for (params, future), result in zip(entries, results):
+            if isinstance(result, Exception):
+                future.set_exception((type(result), result, None))
+            else:
+                future.set_result(result)
+
+
+class BatchedCaller(object):
+    """A caller whose operation is run as part of a Batcher batch."""
+
+    def __init__(self, volume_type, operation, params, batcher):
+        self.volume_type = volume_type
+        self.operation = operation
+        self.params = params
+        self.batcher = batcher
+        self._lock = threading.Lock()
+        self._future = None
+        self._cancelled = False
+
+    def run(self):
+        with self._lock:
+            if self._cancelled:
+                raise utils.Cancelled("%s on %s was cancelled" %
+                                      (self.operation, self.volume_type))
+            self._future = self.batcher.submit(self.volume_type,
+                                               self.operation, self.params)
+        return self._future.result()
+
+    def cancel(self):
+        # Once its batch is running a request cannot be withdrawn since the
+        # playbook is shared with the other requests.
+        with self._lock:
+            self._cancelled = True
+            future = self._future
+        if future is not None:
+            self.batcher.cancel(future)
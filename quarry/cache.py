@@ -0,0 +1,63 @@
+#
+#  Copyright 2017 Red Hat, Inc. and/or its affiliates.
+#
+# Licensed to you under the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.  See the files README and
+# LICENSE_GPL_v2 which accompany this distribution.
+#
+
+from collections import OrderedDict
+import threading
+import time
+
+
+class TTLCache(object):
+    """
+    A bounded LRU cache whose entries expire after a time to live.
+
+    The ttl of an entry is chosen when it is stored: `ttls` maps a ttl_key
+    (ie. a volume type) to its own ttl and anything else gets the default
+    `ttl`.  Entries with a ttl of 0 are not cached at all.  Once the cache
+    holds `max_size` entries the least recently used one is dropped.
+    """
+
+    def __init__(self, max_size=1024, ttl=5, ttls=None):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.ttls = ttls or {}
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is None or entry[0] <= time.time():
+                self.misses += 1
+                return None
+            self._entries[key] = entry  # Now the most recently used
+            self.hits += 1
+            return entry[1]
+
+    def put(self, key, value, ttl_key=None):
+        ttl = self.ttls.get(ttl_key, self.ttl)
+        with self._lock:
+            self._entries.pop(key, None)
+            if ttl <= 0:
+                return
+            self._entries[key] = (time.time() + ttl, value)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def stats(self):
+        with self._lock:
+            return dict(size=len(self._entries), hits=self.hits,
+                        misses=self.misses, evictions=self.evictions)
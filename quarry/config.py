@@ -8,9 +8,64 @@
 #
 
 import os
+import yaml
+
+import utils
 
 template_path = os.path.join(os.path.dirname(__file__),
                              '..', 'playbooks')
 
 roles_path = os.path.join(os.path.dirname(__file__),
                              '..', 'roles')
+
+module_utils_path = os.path.join(roles_path, 'quarry', 'module_utils')
+
+library_path = os.path.join(roles_path, 'quarry', 'library')
+
+callback_plugins_path = os.path.join(os.path.dirname(__file__),
+                                     '..', 'callback_plugins')
+
+configs_dir = (os.environ.get('QUARRY_CONFIG_DIR') or
+               '/etc/quarry/config')
+
+
+def backend_vars_file(volume_type):
+    return os.path.join(configs_dir, '%s.yml' % volume_type)
+
+
+def backend_vars(volume_type):
+    with open(backend_vars_file(volume_type)) as f:
+        return yaml.safe_load(f)
+
+
+def validate_backend_vars(volume_type):
+    """
+    Check a volume type's backend configuration up front.  This covers the
+    same variables as roles/quarry/tasks/check_vars.yml for playbooks which
+    do not run that role.
+    """
+    try:
+        values = backend_vars(volume_type) or {}
+    except (IOError, yaml.YAMLError) as e:
+        raise utils.ConfigurationError("Cannot load configuration for volume "
+                                       "type %s: %s" % (volume_type, e))
+    for name in ('ansible_host', 'ansible_user', 'backend', 'backend_config'):
+        if not values.get(name):
+            raise utils.ConfigurationError("Variable %s is not defined for "
+                                           "volume type %s" %
+                                           (name, volume_type))
+
+
+def ansible_env(env):
+    """
+    Point Ansible at the quarry role, modules and callback plugin.
+
+    The module paths are prepended so that playbooks which do not include
+    the quarry role (see playbooks/fast) can still find the quarry modules.
+    """
+    env['ANSIBLE_ROLES_PATH'] = roles_path
+    env['ANSIBLE_CALLBACK_PLUGINS'] = callback_plugins_path
+    for name, path in (('ANSIBLE_LIBRARY', library_path),
+                       ('ANSIBLE_MODULE_UTILS', module_utils_path)):
+        env[name] = os.pathsep.join(p for p in (path, env.get(name)) if p)
+    return env
@@ -0,0 +1,137 @@
+#
+#  Copyright 2017 Red Hat, Inc. and/or its affiliates.
+#
+# Licensed to you under the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.  See the files README and
+# LICENSE_GPL_v2 which accompany this distribution.
+#
+
+import logging
+import threading
+
+import config
+import profiling
+import tracing
+import utils
+
+
+def _int(value):
+    return int(value) if value is not None else None
+
+
+# How each playbook template maps onto the quarry module logic: the
+# quarry_ops function to call, the module parameters built from the request
+# params and whether the task runs in check mode.
+OPERATIONS = {
+    'get_volume': ('volume', True, lambda p: dict(
+        state='present', id=p['volume_id'],
+        size=_int(p.get('volume_size')))),
+    'create_volume': ('volume', False, lambda p: dict(
+        state='present', id=p['volume_id'],
+        size=_int(p.get('volume_size')))),
+    'delete_volume': ('volume', False, lambda p: dict(
+        state='absent', id=p['volume_id'])),
+    'get_snapshot': ('snapshot', True, lambda p: dict(
+        state='present', id=p['snapshot_id'], volume_id=p.get('volume_id'))),
+    'create_snapshot': ('snapshot', False, lambda p: dict(
+        state='present', id=p['snapshot_id'], volume_id=p.get('volume_id'))),
+    'delete_snapshot': ('snapshot', False, lambda p: dict(
+        state='absent', id=p['snapshot_id'])),
+    'initialize_connection': ('connection', False, lambda p: dict(
+        state='present', volume_id=p['volume_id'],
+        initiator=p.get('initiator'))),
+    'terminate_connection': ('connection', False, lambda p: dict(
+        state='absent', volume_id=p['volume_id'],
+        initiator=p.get('initiator'))),
+    'get_inventory': ('facts', False, lambda p: dict()),
+}
+
+_modules = None
+_modules_lock = threading.Lock()
+
+
+def _load_modules():
+    """
+    Import the quarry module_utils the same way the Ansible modules do.
+
+    The backends import each other as ansible.module_utils.<name> so the role
+    directory is added to that package's search path rather than to sys.path.
+    """
+    global _modules
+    with _modules_lock:
+        if _modules is None:
+            import ansible.module_utils
+            if config.module_utils_path not in ansible.module_utils.__path__:
+                ansible.module_utils.__path__.append(config.module_utils_path)
+            from ansible.module_utils import (quarry_backends, quarry_ops,
+                                              quarry_trace)
+            _modules = (quarry_backends.backends, quarry_ops, quarry_trace)
+        return _modules
+
+
+class DirectCaller(object):
+    """
+    Run a quarry operation by calling the backend driver in-process.
+
+    This is a drop-in replacement for PlayCaller for volume types whose
+    backend can be reached from the quarry host itself.  The work runs on the
+    given worker pool and returns the same result the quarry module would
+    have reported through Ansible.
+    """
+    log = logging.getLogger('DirectCaller')
+
+    def __init__(self, volume_type, operation, params, workers):
+        self.volume_type = volume_type
+        self.operation = operation
+        self.params = params
+        self.workers = workers
+        self._future = None
+        self._cancelled = False
+
+    def run(self):
+        if self._cancelled:
+            raise utils.Cancelled("%s on %s was cancelled" %
+                                  (self.operation, self.volume_type))
+        self._future = self.workers.submit(self._call)
+        return self._future.result()
+
+    def cancel(self):
+        # A driver call cannot be interrupted safely so only calls which have
+        # not started yet are cancelled.
+        self._cancelled = True
+
+    def _call(self):
+        if self._cancelled:
+            raise utils.Cancelled("%s on %s was cancelled" %
+                                  (self.operation, self.volume_type))
+        backends, quarry_ops, quarry_trace = _load_modules()
+        func_name, check_mode, make_params = OPERATIONS[self.operation]
+        backend_vars = config.backend_vars(self.volume_type)
+        driver_config = backend_vars.get('backend_config') or {}
+        params = make_params(self.params)
+        self.log.debug("Calling %s driver %s(%s) for %s",
+                       backend_vars['backend'], func_name, params,
+                       self.volume_type)
+        # Driver spans are recorded just as the quarry modules record them
+        quarry_trace.start(tracing.context(), 'direct %s' % func_name)
+        error = None
+        request_id = profiling.for_operation(self.volume_type)
+        try:
+            with profiling.profile(request_id, '%s.%s' % (self.operation,
+                                                          self.volume_type)):
+                driver = backends[backend_vars['backend']](driver_config)
+                with quarry_trace.span('driver.do_setup'):
+                    driver.do_setup(None)
+                driver = quarry_trace.traced(driver)
+                func = getattr(quarry_ops, func_name)
+                if check_mode:
+                    return func(driver, params, check_mode=True)
+                return func(driver, params)
+        except Exception as e:
+            error = e
+            self.log.exception("Driver call %s on %s failed", self.operation,
+                               self.volume_type)
+            raise utils.DriverError(self.volume_type, self.operation, e)
+        finally:
+            tracing.export(quarry_trace.finish({}, error).get('quarry_spans'))
@@ -0,0 +1,269 @@
+#
+#  Copyright 2017 Red Hat, Inc. and/or its affiliates.
+#
+# Licensed to you under the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.  See the files README and
+# LICENSE_GPL_v2 which accompany this distribution.
+#
+
+import logging
+import socket
+import threading
+
+import admission
+import ansible_pool
+import batching
+import config
+import direct
+import metrics
+import playcaller
+import pool
+import tracing
+import utils
+
+
+LOCAL_HOSTS = ('localhost', '127.0.0.1', '::1')
+
+# Read-only operations which concurrent identical requests may share
+SHARED_OPERATIONS = ('get_volume', 'get_snapshot', 'get_inventory')
+
+
+class Executor(object):
+    """
+    Choose how each quarry operation is carried out.
+
+    Operations go through ansible-playbook by default, or through a pool of
+    warm Ansible worker processes when ansible_workers is set.  When direct
+    execution is enabled, volume types whose ansible_host is the quarry host
+    itself (or which set `direct: true` in their backend configuration) are
+    driven in-process by a DirectCaller instead.
+
+    With a batch window set, volume and snapshot operations of the same
+    kind that arrive within the window share a batched playbook.  Identical
+    lookups that run at the same time share a single execution.
+
+    Each volume type runs at most `concurrency` operations at once (or its
+    entry in `concurrency_limits`) and the rest wait their turn.  Requests
+    made on behalf of a client are refused with Overloaded once `queue_size`
+    operations are already waiting; background work passes admit=False and
+    always waits.
+
+    Lookups and attach/detach calls (see admission.FAST_OPERATIONS) run in
+    a fast lane: fast_workers direct, warm Ansible and batch workers serve
+    only them, and fast_slots of each volume type's slots are kept for them,
+    so that a backlog of slow creations and deletions does not hold up a
+    booting VM.
+    """
+    log = logging.getLogger('Executor')
+
+    def __init__(self, direct_execution=False, direct_workers=8,
+                 ansible_workers=0, stream_playbooks=False,
+                 static_playbooks=False, fast_playbooks=False,
+                 batch_window=0, batch_size=50, batch_workers=4,
+                 single_flight=True, concurrency=0, concurrency_limits=None,
+                 queue_size=0, fast_workers=0, fast_slots=0):
+        self.direct_execution = direct_execution
+        self.stream_playbooks = stream_playbooks
+        self.static_playbooks = static_playbooks
+        self.fast_playbooks = fast_playbooks
+        self._direct_pool = self._fast_direct_pool = None
+        if direct_execution:
+            self._direct_pool = pool.WorkerPool('direct', direct_workers)
+            self._fast_direct_pool = self._direct_pool
+            if fast_workers > 0:
+                self._fast_direct_pool = pool.WorkerPool('direct-fast',
+                                                         fast_workers)
+        self._ansible_pool = self._fast_ansible_pool = None
+        if ansible_workers > 0:
+            self._ansible_pool = ansible_pool.AnsiblePool(ansible_workers)
+            self._fast_ansible_pool = self._ansible_pool
+            if fast_workers > 0:
+                self._fast_ansible_pool = ansible_pool.AnsiblePool(
+                    fast_workers)
+        self._batcher = None
+        if batch_window > 0:
+            self._batcher = batching.Batcher(self, batch_window, batch_size,
+                                             batch_workers, fast_workers)
+        self._flight = pool.SingleFlight() if single_flight else None
+        self.concurrency = concurrency
+        self.concurrency_limits = concurrency_limits or {}
+        self.queue_size = queue_size
+        self.fast_slots = fast_slots
+        self._lock = threading.Lock()
+        self._direct_types = {}
+        self._gates = {}
+
+    def caller(self, volume_type, operation, params, admit=True):
+        if admit:
+            self.admit(volume_type, operation)
+        caller = self._caller(volume_type, operation, params)
+        if not isinstance(caller, batching.BatchedCaller):
+            # Batches take their slot when the whole batch runs
+            caller = admission.GatedCaller(caller, self.gate(volume_type))
+        if self._flight is not None and operation in SHARED_OPERATIONS:
+            caller = SharedCaller(caller, self._flight)
+        return tracing.TracedCaller(metrics.TimedCaller(caller))
+
+    def _caller(self, volume_type, operation, params):
+        fast = admission.is_fast(operation)
+        if self.is_direct(volume_type):
+            return direct.DirectCaller(volume_type, operation, params,
+                                       self._fast_direct_pool if fast else
+                                       self._direct_pool)
+        if (self._batcher is not None and
+                operation in playcaller.BATCH_OPERATIONS):
+            return batching.BatchedCaller(volume_type, operation, params,
+                                          self._batcher)
+        if self._ansible_pool is not None:
+            return playcaller.WarmPlayCaller(volume_type, operation, params,
+                                             self._fast_ansible_pool if fast
+                                             else self._ansible_pool,
+                                             static=self.static_playbooks,
+                                             fast=self.fast_playbooks)
+        return playcaller.PlayCaller(volume_type, operation, params,
+                                     stream=self.stream_playbooks,
+                                     static=self.static_playbooks,
+                                     fast=self.fast_playbooks)
+
+    def run(self, volume_type, operation, params, admit=True):
+        return self.caller(volume_type, operation, params, admit).run()
+
+    def admit(self, volume_type, operation=None, backlog=0):
+        """
+        Raise Overloaded if the volume type cannot queue more work in the
+        operation's lane (creations and deletions when not given).  backlog
+        counts accepted work still queued elsewhere (see Gate.check).
+        """
+        fast = admission.is_fast(operation)
+        try:
+            self.gate(volume_type).check(fast, backlog)
+        except utils.Overloaded:
+            metrics.inc('quarry_rejected_total', volume_type=volume_type,
+                        lane='fast' if fast else 'slow')
+            raise
+
+    def gate(self, volume_type):
+        with self._lock:
+            gate = self._gates.get(volume_type)
+            if gate is None:
+                limit = self.concurrency_limits.get(volume_type,
+                                                    self.concurrency)
+                gate = self._gates[volume_type] = admission.Gate(
+                    volume_type, limit, self.queue_size, self.fast_slots)
+            return gate
+
+    def admission_stats(self):
+        with self._lock:
+            gates = list(self._gates.values())
+        return dict((gate.name, gate.stats()) for gate in gates)
+
+    def batch_caller(self, volume_type, operation, items):
+        if self._ansible_pool is not None:
+            return playcaller.WarmBatchPlayCaller(
+                volume_type, operation, items,
+                self._fast_ansible_pool if admission.is_fast(operation) else
+                self._ansible_pool)
+        return playcaller.BatchPlayCaller(volume_type, operation, items)
+
+    def run_batch(self, volume_type, operation, items, admit=True):
+        """
+        Run an operation for a list of items (each a params dict) of one
+        volume type and return a result or QuarryError for each of them.
+        """
+        if admit:
+            self.admit(volume_type, operation)
+        if (self.is_direct(volume_type) or
+                operation not in playcaller.BATCH_OPERATIONS):
+            # Direct calls have no startup cost to amortize and there are
+            # no batch playbooks for connections.
+            results = []
+            for params in items:
+                try:
+                    results.append(self.run(volume_type, operation, params,
+                                            admit=False))
+                except utils.QuarryError as e:
+                    results.append(e)
+            return results
+        with self.gate(volume_type).slot(admission.is_fast(operation)):
+            with tracing.span('batch ' + operation, volume_type=volume_type,
+                              items=len(items)):
+                with metrics.timed('quarry_batch_duration_seconds',
+                                   volume_type=volume_type,
+                                   operation=operation):
+                    return self.batch_caller(volume_type, operation,
+                                             items).run()
+
+    def queue_depths(self):
+        """Return the number of calls waiting for each worker pool."""
+        pools = [self._direct_pool, self._fast_direct_pool]
+        if self._batcher is not None:
+            pools += self._batcher.pools()
+        return dict((p.name, p.qsize()) for p in pools if p is not None)
+
+    def is_direct(self, volume_type):
+        if not self.direct_execution:
+            return False
+        with self._lock:
+            if volume_type not in self._direct_types:
+                backend_vars = config.backend_vars(volume_type)
+                is_direct = bool(backend_vars.get('direct') or
+                                 _is_local(backend_vars.get('ansible_host')))
+                self.log.info("Volume type %s uses %s execution", volume_type,
+                              'direct' if is_direct else 'ansible')
+                self._direct_types[volume_type] = is_direct
+            return self._direct_types[volume_type]
+
+    def stop(self):
+        if self._batcher is not None:
+            self._batcher.stop()
+        if self._direct_pool is not None:
+            self._direct_pool.stop()
+            if self._fast_direct_pool is not self._direct_pool:
+                self._fast_direct_pool.stop()
+        if self._ansible_pool is not None:
+            self._ansible_pool.stop()
+            if self._fast_ansible_pool is not self._ansible_pool:
+                self._fast_ansible_pool.stop()
+
+
+class SharedCaller(object):
+    """
+    Run a caller through a SingleFlight so that identical concurrent calls
+    share the first one's execution.
+    """
+
+    def __init__(self, caller, flight):
+        self.caller = caller
+        self.flight = flight
+        self.volume_type = caller.volume_type
+        self.operation = caller.operation
+        self.params = caller.params
+        self._cancelled = False
+
+    def run(self):
+        key = (self.volume_type, self.operation,
+               tuple(sorted(self.caller.params.items())))
+        while True:
+            ran = []
+
+            def run():
+                ran.append(True)
+                return self.caller.run()
+
+            try:
+                return self.flight.do(key, run)
+            except utils.Cancelled:
+                # When we were only waiting on another caller and that one
+                # was cancelled, try again (most likely running it ourselves).
+                if ran or self._cancelled:
+                    raise
+
+    def cancel(self):
+        # Only stops the execution if this caller is the one running it
+        self._cancelled = True
+        self.caller.cancel()
+
+
+def _is_local(host):
+    return host in LOCAL_HOSTS + (socket.gethostname(), socket.getfqdn())
@@ -0,0 +1,104 @@
+#
+#  Copyright 2017 Red Hat, Inc. and/or its affiliates.
+#
+# Licensed to you under the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.  See the files README and
+# LICENSE_GPL_v2 which accompany this distribution.
+#
+
+import logging
+import threading
+import time
+
+import pool
+
+
+class _Entry(object):
+
+    def __init__(self, volumes, snapshots):
+        self.volumes = volumes
+        self.snapshots = snapshots
+        self.updated = time.time()
+
+
+class Inventory(object):
+    """
+    A cached listing of the volumes and snapshots of each volume type.
+
+    The listing of a volume type comes from a single get_inventory call.
+    Requests are only ever served what is already cached: once a listing is
+    missing or max_age seconds old, get() starts a refresh in the background
+    and returns the listing it has (None if there is none yet).  Only one
+    refresh of a volume type runs at a time and a failed one is retried
+    after retry_interval seconds while the previous listing keeps being
+    served.
+    """
+    log = logging.getLogger('Inventory')
+
+    def __init__(self, executor, max_age=60, retry_interval=10, workers=2):
+        self.executor = executor
+        self.max_age = max_age
+        self.retry_interval = retry_interval
+        self._pool = pool.WorkerPool('inventory', workers)
+        self._lock = threading.Lock()
+        self._entries = {}
+        self._refresh_locks = {}
+        self._pending = set()
+        self._attempts = {}
+
+    def get(self, volume_type):
+        """Return the cached listing, refreshing it in the background."""
+        with self._lock:
+            entry = self._entries.get(volume_type)
+            if (volume_type not in self._pending and
+                    (entry is None or self._stale(entry)) and
+                    time.time() - self._attempts.get(volume_type, 0) >=
+                    self.retry_interval):
+                self._pending.add(volume_type)
+                self._pool.submit(self._background_refresh, volume_type)
+        return entry
+
+    def cached(self, volume_type):
+        """Return the current listing, however old, without refreshing."""
+        with self._lock:
+            return self._entries.get(volume_type)
+
+    def refresh(self, volume_type):
+        with self._lock:
+            refresh_lock = self._refresh_locks.setdefault(volume_type,
+                                                          threading.Lock())
+        with refresh_lock:
+            return self._refresh(volume_type)
+
+    def stop(self):
+        self._pool.stop()
+
+    def _background_refresh(self, volume_type):
+        try:
+            self.refresh(volume_type)
+        except Exception:
+            self.log.exception("Failed to refresh the inventory of %s",
+                               volume_type)
+        finally:
+            with self._lock:
+                self._pending.discard(volume_type)
+
+    def _refresh(self, volume_type):
+        self.log.debug("Refreshing inventory of %s", volume_type)
+        with self._lock:
+            self._attempts[volume_type] = time.time()
+        ret = self.executor.run(volume_type, 'get_inventory', {},
+                                admit=False)
+        facts = ret['ansible_facts']
+        volumes = dict((v['id'], v) for v in facts['quarry_volumes'])
+        snapshots = dict((s['id'], s) for s in facts['quarry_snapshots'])
+        entry = _Entry(volumes, snapshots)
+        with self._lock:
+            self._entries[volume_type] = entry
+        self.log.debug("Volume type %s has %i volumes and %i snapshots",
+                       volume_type, len(volumes), len(snapshots))
+        return entry
+
+    def _stale(self, entry):
+        return time.time() - entry.updated >= self.max_age
@@ -0,0 +1,140 @@
+#
+#  Copyright 2017 Red Hat, Inc. and/or its affiliates.
+#
+# Licensed to you under the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.  See the files README and
+# LICENSE_GPL_v2 which accompany this distribution.
+#
+
+import logging
+import threading
+import time
+
+import pool
+
+
+class Job(object):
+
+    def __init__(self, kind, resource_id, status, info):
+        self.kind = kind
+        self.id = resource_id
+        self.status = status
+        self.info = info
+        self.error = None
+        self.future = None
+        self.updated = time.time()
+
+    def in_progress(self):
+        return self.future is not None and not self.future.done()
+
+
+class JobManager(object):
+    """
+    Run long playbooks in the background and track resource status.
+
+    Each job is keyed by (kind, resource_id) and moves from its pending status
+    (ie. 'creating') to either its done status (ie. 'available') or its error
+    status once the work completes.  Finished jobs are remembered for
+    `retention` seconds so that clients polling the resource see the outcome.
+    """
+    log = logging.getLogger('JobManager')
+
+    def __init__(self, workers=4, retention=3600):
+        self.retention = retention
+        self._pool = pool.WorkerPool('jobs', workers)
+        self._lock = threading.Lock()
+        self._jobs = {}
+
+    def submit(self, kind, resource_id, status, done_status, error_status,
+               func, *args, **kwargs):
+        job = Job(kind, resource_id, status, kwargs.pop('info', {}))
+        with self._lock:
+            self._prune()
+            self._jobs[(kind, resource_id)] = job
+            job.future = self._pool.submit(self._run, job, done_status,
+                                           error_status, func, *args)
+        return job
+
+    def submit_batch(self, kind, resource_ids, status, done_status,
+                     error_status, func, *args, **kwargs):
+        """
+        Like submit() for a group of resources handled by a single call.
+
+        func must return one result per resource, in order, where an
+        exception instance marks that resource as failed.  `info` is a list
+        holding the info of each job.
+        """
+        infos = kwargs.pop('info', None) or [{}] * len(resource_ids)
+        jobs = [Job(kind, resource_id, status, info)
+                for resource_id, info in zip(resource_ids, infos)]
+        with self._lock:
+            self._prune()
+            for job in jobs:
+                self._jobs[(kind, job.id)] = job
+            future = self._pool.submit(self._run_batch, jobs, done_status,
+                                       error_status, func, *args)
+            for job in jobs:
+                job.future = future
+        return jobs
+
+    def qsize(self):
+        return self._pool.qsize()
+
+    def backlog(self, volume_type):
+        """
+        Return the number of unfinished submissions, queued or running, for
+        a volume type.  A batch counts once as it runs as one operation.
+        """
+        with self._lock:
+            return len(set(job.future for job in self._jobs.values()
+                           if job.in_progress() and
+                           job.info.get('volume_type') == volume_type))
+
+    def get(self, kind, resource_id):
+        with self._lock:
+            self._prune()
+            return self._jobs.get((kind, resource_id))
+
+    def list(self, kind):
+        with self._lock:
+            self._prune()
+            return [job for key, job in self._jobs.items() if key[0] == kind]
+
+    def stop(self):
+        self._pool.stop()
+
+    def _run(self, job, done_status, error_status, func, *args):
+        self.log.debug("Running job %s %s (%s)", job.kind, job.id, job.status)
+        try:
+            func(*args)
+        except Exception as e:
+            self.log.exception("Job %s %s failed", job.kind, job.id)
+            job.error = str(e)
+            job.status = error_status
+        else:
+            job.status = done_status
+        job.updated = time.time()
+        self.log.debug("Job %s %s is %s", job.kind, job.id, job.status)
+
+    def _run_batch(self, jobs, done_status, error_status, func, *args):
+        self.log.debug("Running batch of %i %s jobs", len(jobs), jobs[0].kind)
+        try:
+            results = func(*args)
+        except Exception as e:
+            self.log.exception("Batch of %s jobs failed", jobs[0].kind)
+            results = [e] * len(jobs)
+        for job, result in zip(jobs, results):
+            if isinstance(result, Exception):
+                job.error = str(result)
+                job.status = error_status
+            else:
+                job.status = done_status
+            job.updated = time.time()
+            self.log.debug("Job %s %s is %s", job.kind, job.id, job.status)
+
+    def _prune(self):
+        expired = time.time() - self.retention
+        for key, job in list(self._jobs.items()):
+            if not job.in_progress() and job.updated < expired:
+                del self._jobs[key]
@@ -0,0 +1,151 @@
+#
+#  Copyright 2017 Red Hat, Inc. and/or its affiliates.
+#
+# Licensed to you under the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.  See the files README and
+# LICENSE_GPL_v2 which accompany this distribution.
+#
+
+import errno
+import json
+import logging
+import os
+import threading
+
+
+DEFAULT_PATH = '/var/lib/quarry/locations.json'
+
+
+class LocationIndex(object):
+    """
+    Remember which volume type holds each volume and snapshot.
+
+    Entries are written whenever this server creates a resource and removed
+    when it deletes one so that lookups can go straight to the right backend
+    instead of probing every configured volume type.  The index is only a
+    hint: callers must be prepared for an entry to be stale.
+    """
+    log = logging.getLogger('LocationIndex')
+
+    def __init__(self, path=DEFAULT_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+        self._volumes = {}
+        self._snapshots = {}
+        self._load()
+
+    def get_volume(self, volume_id):
+        with self._lock:
+            entry = self._volumes.get(volume_id)
+            return dict(entry) if entry is not None else None
+
+    def add_volume(self, volume_id, volume_type, size=None):
+        entry = dict(id=volume_id, volume_type=volume_type, size=size)
+        with self._lock:
+            if self._volumes.get(volume_id) == entry:
+                return
+            self._volumes[volume_id] = entry
+            self._save()
+
+    def remove_volume(self, volume_id):
+        with self._lock:
+            if self._volumes.pop(volume_id, None) is not None:
+                self._save()
+
+    def get_snapshot(self, snapshot_id):
+        with self._lock:
+            entry = self._snapshots.get(snapshot_id)
+            return dict(entry) if entry is not None else None
+
+    def add_snapshot(self, snapshot_id, volume_type, volume_id=None):
+        entry = dict(id=snapshot_id, volume_type=volume_type,
+                     volume_id=volume_id)
+        with self._lock:
+            if self._snapshots.get(snapshot_id) == entry:
+                return
+            self._snapshots[snapshot_id] = entry
+            self._save()
+
+    def remove_snapshot(self, snapshot_id):
+        with self._lock:
+            if self._snapshots.pop(snapshot_id, None) is not None:
+                self._save()
+
+    def volumes(self, volume_type):
+        """Return the entries of the volumes of a volume type by id."""
+        with self._lock:
+            return dict((volume_id, dict(entry))
+                        for volume_id, entry in self._volumes.items()
+                        if entry['volume_type'] == volume_type)
+
+    def snapshots(self, volume_type):
+        """Return the entries of the snapshots of a volume type by id."""
+        with self._lock:
+            return dict((snapshot_id, dict(entry))
+                        for snapshot_id, entry in self._snapshots.items()
+                        if entry['volume_type'] == volume_type)
+
+    def update(self, add_volumes=(), remove_volumes=(), add_snapshots=(),
+               remove_snapshots=(), expected=None):
+        """
+        Add (or replace) and remove many entries and save the index once.
+        Added entries are dicts like those returned by get_volume() and
+        get_snapshot().
+
+        `expected` is a (volumes, snapshots) pair of the entries, by id, the
+        changes were worked out from.  Ids whose entry is no longer the
+        expected one (None for ids that were not indexed) were changed in
+        the meantime and are left alone.
+        """
+        expected_volumes, expected_snapshots = expected or (None, None)
+        with self._lock:
+            old = (dict(self._volumes), dict(self._snapshots))
+            _apply(self._volumes, add_volumes, remove_volumes,
+                   expected_volumes)
+            _apply(self._snapshots, add_snapshots, remove_snapshots,
+                   expected_snapshots)
+            if (self._volumes, self._snapshots) != old:
+                self._save()
+
+    def _load(self):
+        try:
+            with open(self.path) as f:
+                data = json.load(f)
+        except IOError as e:
+            if e.errno != errno.ENOENT:
+                raise
+            self.log.info("Starting with an empty index at %s", self.path)
+            return
+        except ValueError:
+            self.log.warning("Ignoring corrupt index at %s", self.path)
+            return
+        self._volumes = data.get('volumes', {})
+        self._snapshots = data.get('snapshots', {})
+        self.log.debug("Loaded %i volumes and %i snapshots from %s",
+                       len(self._volumes), len(self._snapshots), self.path)
+
+    def _save(self):
+        # Write to a new file and rename it into place so that a crash never
+        # leaves a truncated index behind.
+        dirname = os.path.dirname(self.path)
+        if dirname and not os.path.isdir(dirname):
+            os.makedirs(dirname)
+        tmp = '%s.tmp' % self.path
+        with open(tmp, 'w') as f:
+            json.dump(dict(volumes=self._volumes, snapshots=self._snapshots),
+                      f)
+        os.rename(tmp, self.path)
+
+
+def _apply(entries, add, remove, expected):
+    def unchanged(resource_id):
+        return (expected is None or
+                entries.get(resource_id) == expected.get(resource_id))
+
+    for entry in add:
+        if unchanged(entry['id']):
+            entries[entry['id']] = dict(entry)
+    for resource_id in remove:
+        if unchanged(resource_id):
+            entries.pop(resource_id, None)
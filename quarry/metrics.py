@@ -0,0 +1,166 @@
+#
+#  Copyright 2017 Red Hat, Inc. and/or its affiliates.
+#
+# Licensed to you under the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.  See the files README and
+# LICENSE_GPL_v2 which accompany this distribution.
+#
+
+# Process wide counters, gauges and histograms, rendered in the Prometheus
+# text exposition format by the /metrics endpoint.  Values which already live
+# elsewhere (queue depths, cache statistics) are not copied in here; a
+# collector registered with add_collector() reports them on render().
+
+from contextlib import contextmanager
+import threading
+import time
+
+import utils
+
+
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60,
+           120, 300, 600)
+
+METRICS = {
+    'quarry_operations_total': (
+        'counter', "Operations run per volume type, operation and outcome"),
+    'quarry_operation_duration_seconds': (
+        'histogram', "Time taken by operations, including queueing"),
+    'quarry_batch_duration_seconds': (
+        'histogram', "Time taken by batched playbook runs"),
+    'quarry_playbook_phase_seconds': (
+        'histogram', "Time spent in each phase of running a playbook"),
+    'quarry_ansible_processes': (
+        'gauge', "ansible-playbook processes currently running"),
+    'quarry_rejected_total': (
+        'counter', "Requests refused because a volume type was overloaded"),
+}
+
+_lock = threading.Lock()
+_values = {}
+_histograms = {}
+_collectors = []
+
+
+def inc(name, value=1, **labels):
+    """Add to a counter or gauge."""
+    key = (name, _labels(labels))
+    with _lock:
+        _values[key] = _values.get(key, 0) + value
+
+
+def observe(name, value, **labels):
+    key = (name, _labels(labels))
+    with _lock:
+        hist = _histograms.get(key)
+        if hist is None:
+            hist = _histograms[key] = [[0] * len(BUCKETS), 0, 0.0]
+        for i, bound in enumerate(BUCKETS):
+            if value <= bound:
+                hist[0][i] += 1
+        hist[1] += 1
+        hist[2] += value
+
+
+@contextmanager
+def timed(name, **labels):
+    start = time.time()
+    try:
+        yield
+    finally:
+        observe(name, time.time() - start, **labels)
+
+
+def add_collector(collector):
+    """
+    Register a function returning (name, type, description, samples)
+    tuples, where samples is a list of (labels dict, value).
+    """
+    _collectors.append(collector)
+
+
+def render():
+    with _lock:
+        values = dict(_values)
+        histograms = dict((k, (list(v[0]), v[1], v[2]))
+                          for k, v in _histograms.items())
+    families = {}
+    for (name, labels), value in values.items():
+        families.setdefault(name, []).append((name, labels, value))
+    for (name, labels), (buckets, count, total) in histograms.items():
+        samples = families.setdefault(name, [])
+        for bound, bucket in zip(BUCKETS, buckets):
+            samples.append((name + '_bucket',
+                            labels + (('le', _number(bound)),), bucket))
+        samples.append((name + '_bucket', labels + (('le', '+Inf'),), count))
+        samples.append((name + '_count', labels, count))
+        samples.append((name + '_sum', labels, total))
+    types = dict(METRICS)
+    for collector in _collectors:
+        for name, kind, description, samples in collector():
+            types[name] = (kind, description)
+            families.setdefault(name, []).extend(
+                (name, _labels(labels), value) for labels, value in samples)
+    lines = []
+    for name in sorted(families):
+        kind, description = types[name]
+        lines.append('# HELP %s %s' % (name, description))
+        lines.append('# TYPE %s %s' % (name, kind))
+        for sample, labels, value in families[name]:
+            lines.append('%s%s %s' % (sample, _format_labels(labels),
+                                      _number(value)))
+    return '\n'.join(lines) + '\n'
+
+
+def record(volume_type, operation, outcome, duration):
+    inc('quarry_operations_total', volume_type=volume_type,
+        operation=operation, outcome=outcome)
+    observe('quarry_operation_duration_seconds', duration,
+            volume_type=volume_type, operation=operation, outcome=outcome)
+
+
+class TimedCaller(object):
+    """A caller whose runs are counted and timed by outcome."""
+
+    def __init__(self, caller):
+        self.caller = caller
+        self.volume_type = caller.volume_type
+        self.operation = caller.operation
+        self.params = caller.params
+
+    def run(self):
+        start = time.time()
+        outcome = 'error'
+        try:
+            result = self.caller.run()
+            outcome = 'success'
+            return result
+        except utils.Cancelled:
+            outcome = 'cancelled'
+            raise
+        finally:
+            record(self.volume_type, self.operation, outcome,
+                   time.time() - start)
+
+    def cancel(self):
+        self.caller.cancel()
+
+
+def _labels(labels):
+    return tuple(sorted(labels.items()))
+
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    return '{%s}' % ','.join(
+        '%s="%s"' % (k, str(v).replace('\\', r'\\').replace('"', r'\"')
+                     .replace('\n', r'\n'))
+        for k, v in labels)
+
+
+def _number(value):
+    if isinstance(value, float):
+        return repr(value)
+    return str(value)
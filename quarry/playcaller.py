@@ -7,64 +7,382 @@
 # LICENSE_GPL_v2 which accompany this distribution.
 #
 
-from Cheetah.Template import Template
 from contextlib import contextmanager
 import copy
 import json
 import logging
 import os
+import signal
 import subprocess
+import threading
+import time
 
 import config
+import direct
+import metrics
+import profiling
+import tracing
 import utils
 
 
 class PlayCaller(object):
     log = logging.getLogger('PlayCaller')
 
-    def __init__(self, volume_type, operation, params):
+    # Compiled Cheetah template classes keyed by template file, along with the
+    # file mtime they were compiled from.
+    _templates = {}
+    _templates_lock = threading.Lock()
+
+    def __init__(self, volume_type, operation, params, stream=False,
+                 static=False, fast=False):
         self.volume_type = volume_type
         self.operation = operation
         self.params = params
+        self.stream = stream
+        self.static = static or fast
+        self.fast = fast
+        self._lock = threading.Lock()
+        self._proc = None
+        self._cancelled = False
 
     def run(self):
+        if self.static:
+            # The same playbook file serves every request and the request
+            # parameters are passed in as extra vars.
+            with self._phase('render'):
+                extra_vars = self._extra_vars()
+            return self._run_ansible(self._static_playbook(),
+                                     extra_vars=extra_vars)
+        if self.stream:
+            # Feed the playbook to ansible through a pipe on its stdin so that
+            # nothing touches the filesystem.  ansible-playbook accepts a FIFO
+            # in place of a playbook file.
+            with self._phase('render'):
+                data = self._render()
+            return self._run_ansible('/dev/stdin', data)
         with self._playbook() as playbook:
-            cmd = ['ansible-playbook', playbook]
-            env = copy.copy(os.environ)
-            env['QUARRY_VOLUME_TYPE'] = self.volume_type
-            env['ANSIBLE_ROLES_PATH'] = config.roles_path
-            env['ANSIBLE_STDOUT_CALLBACK'] = 'json'
+            return self._run_ansible(playbook)
+
+    def _run_ansible(self, playbook, stdin_data=None, extra_vars=None):
+        cmd = ['ansible-playbook', playbook]
+        extra_vars = self._request_vars(extra_vars)
+        if extra_vars:
+            cmd += ['--extra-vars', json.dumps(extra_vars)]
+        env = config.ansible_env(copy.copy(os.environ))
+        env['QUARRY_VOLUME_TYPE'] = self.volume_type
+        if 'quarry_profile' in extra_vars:
+            env['QUARRY_PROFILE'] = extra_vars['quarry_profile']
+        env['ANSIBLE_STDOUT_CALLBACK'] = 'quarry'
+        with self._lock:
+            if self._cancelled:
+                raise utils.Cancelled("%s on %s was cancelled" %
+                                      (self.operation, self.volume_type))
             self.log.debug("Running ansible: %s", cmd)
-            p = subprocess.Popen(cmd, shell=False, env=env,
-                                 stdout=subprocess.PIPE,
-                                 stderr=subprocess.PIPE)
-            out, err = p.communicate()
-            rc = p.returncode
-            if rc != 0:
-                raise utils.AnsibleError(rc, out, err)
-
-            # This makes some assumptions:
-            # 1. The ansible command is running only one play
-            # 2. We always return the result of the last task
-            result = json.loads(out)['plays'][0]['tasks'][-1]['hosts']
-            hosts = result.keys()
-            if len(hosts) != 1:
-                raise RuntimeError("Expecting exactly one host in report, got "
-                                   "%s" % hosts)
-            return result[hosts[0]]
+            # Run ansible in its own process group so that cancel() can
+            # take down the forked workers along with it.
+            # The playbook and the callback records are text on Python 2
+            # and 3.
+            stdin = subprocess.PIPE if stdin_data is not None else None
+            with self._phase('spawn'):
+                p = self._proc = subprocess.Popen(cmd, shell=False, env=env,
+                                                  stdin=stdin,
+                                                  stdout=subprocess.PIPE,
+                                                  stderr=subprocess.PIPE,
+                                                  universal_newlines=True,
+                                                  preexec_fn=os.setsid)
+        metrics.inc('quarry_ansible_processes')
+        try:
+            with self._phase('run'):
+                out, err = p.communicate(stdin_data)
+        finally:
+            metrics.inc('quarry_ansible_processes', -1)
+        rc = p.returncode
+        if self._cancelled:
+            raise utils.Cancelled("%s on %s was cancelled" %
+                                  (self.operation, self.volume_type))
+        if rc != 0:
+            # The spans and profile of a failed module are the ones most
+            # worth having.
+            for record in self._records(out):
+                if record['type'] == 'result':
+                    self._module_extras(record['result'])
+            raise utils.AnsibleError(rc, out, err)
+        with self._phase('parse'):
+            return self._result_from_records(self._records(out))
+
+    def cancel(self):
+        with self._lock:
+            self._cancelled = True
+            if self._proc is not None and self._proc.poll() is None:
+                self.log.debug("Cancelling %s on %s (pid %i)", self.operation,
+                               self.volume_type, self._proc.pid)
+                try:
+                    os.killpg(self._proc.pid, signal.SIGTERM)
+                except OSError:
+                    pass  # Already gone
+
+    @contextmanager
+    def _phase(self, phase):
+        with tracing.span(phase):
+            with metrics.timed('quarry_playbook_phase_seconds',
+                               volume_type=self.volume_type,
+                               operation=self.operation, phase=phase):
+                yield
+
+    def _request_vars(self, extra_vars):
+        # The quarry modules add their own spans (and those of the driver
+        # calls) to the trace and hand them back in their result.  The
+        # playbooks put quarry_profile in the module's environment as
+        # QUARRY_PROFILE, which makes it profile its driver calls.
+        extra_vars = dict(extra_vars or {})
+        trace = tracing.context()
+        if trace is not None:
+            extra_vars['quarry_trace'] = trace
+        request_id = profiling.for_operation(self.volume_type)
+        if request_id is not None:
+            extra_vars['quarry_profile'] = request_id
+        return extra_vars
+
+    def _module_extras(self, result):
+        tracing.export(result.pop('quarry_spans', None))
+        profile = result.pop('quarry_profile', None)
+        if profile is not None:
+            profiling.save(profile['request_id'], '%s.%s' % (
+                self.operation, self.volume_type), profile['pstats'])
+        return result
+
+    def _records(self, out):
+        # The quarry stdout callback prints one JSON record per line: a short
+        # timing record for every task result plus the full result of each
+        # quarry module task.
+        records = []
+        for line in out.splitlines():
+            try:
+                record = json.loads(line)
+            except ValueError:
+                record = None
+            if not isinstance(record, dict) or 'type' not in record:
+                # Anything else printed by ansible or by a module
+                self.log.debug("Ignoring ansible output: %s", line)
+                continue
+            if record['type'] == 'task':
+                self.log.debug("Task '%s' on %s %s in %.3fs", record['task'],
+                               record['host'], record['status'],
+                               record['duration'])
+            records.append(record)
+        return records
+
+    def _result_from_records(self, records):
+        # Like _result, return the result of the last quarry task and expect
+        # exactly one host to have run it.
+        results = [r for r in records if r['type'] == 'result']
+        if not results:
+            raise RuntimeError("No quarry task result in ansible output")
+        last = [r for r in results if r['index'] == results[-1]['index']]
+        hosts = [r['host'] for r in last]
+        if len(hosts) != 1:
+            raise RuntimeError("Expecting exactly one host in report, got "
+                               "%s" % hosts)
+        return self._module_extras(last[0]['result'])
+
+    def _result(self, report):
+        # This makes some assumptions:
+        # 1. The ansible command is running only one play
+        # 2. We always return the result of the last task
+        result = report['plays'][0]['tasks'][-1]['hosts']
+        hosts = list(result.keys())
+        if len(hosts) != 1:
+            raise RuntimeError("Expecting exactly one host in report, got "
+                               "%s" % hosts)
+        return self._module_extras(result[hosts[0]])
 
     def _template_name(self):
         return '%s.t' % self.operation
 
-    @contextmanager
-    def _playbook(self):
+    def _static_playbook(self):
+        if self.fast:
+            return os.path.join(config.template_path, 'fast',
+                                '%s.yml' % self.operation)
+        return os.path.join(config.template_path, '%s.yml' % self.operation)
+
+    def _extra_vars(self):
+        # Unset parameters are left out so that the playbooks can fall back
+        # to their defaults (or omit the module option entirely).
+        extra_vars = dict((k, v) for k, v in self.params.items()
+                          if v is not None)
+        if self.fast:
+            # The fast playbooks skip the quarry role, which is what normally
+            # works out where the backend configuration lives.
+            extra_vars['backend_vars_file'] = config.backend_vars_file(
+                self.volume_type)
+        return extra_vars
+
+    def _template_class(self):
         template_file = os.path.join(config.template_path,
                                      self._template_name())
+        mtime = os.stat(template_file).st_mtime
+        with self._templates_lock:
+            cached = self._templates.get(template_file)
+        if cached is not None and cached[0] == mtime:
+            return cached[1]
+
+        # Cheetah is only needed when rendering templates so it is not
+        # imported at all when static playbooks are in use.
+        from Cheetah.Template import Template
+
+        self.log.debug("Compiling template %s", template_file)
         with open(template_file) as f:
-            template = f.read()
-            data = str(Template(template, searchList=[self.params]))
-            self.log.debug("Playbook content:\n%s", data)
-            with utils.temp_file() as path:
+            template_class = Template.compile(source=f.read())
+        with self._templates_lock:
+            self._templates[template_file] = (mtime, template_class)
+        return template_class
+
+    def _render(self):
+        template_class = self._template_class()
+        data = str(template_class(searchList=[self.params]))
+        self.log.debug("Playbook content:\n%s", data)
+        return data
+
+    @contextmanager
+    def _playbook(self):
+        with utils.temp_file() as path:
+            with self._phase('render'):
+                data = self._render()
                 with open(path, 'w') as f:
                     f.write(data)
-                yield path
+            yield path
+
+
+class WarmPlayCaller(PlayCaller):
+    """
+    A PlayCaller which runs its playbook on an already running Ansible worker
+    from an AnsiblePool instead of starting a new ansible-playbook.
+    """
+
+    def __init__(self, volume_type, operation, params, workers,
+                 static=False, fast=False):
+        super(WarmPlayCaller, self).__init__(volume_type, operation, params,
+                                             static=static, fast=fast)
+        self.workers = workers
+        self._worker = None
+
+    def run(self):
+        with self._phase('render'):
+            if self.static:
+                request = dict(playbook_file=self._static_playbook(),
+                               extra_vars=self._request_vars(
+                                   self._extra_vars()))
+            else:
+                request = dict(playbook=self._render(),
+                               extra_vars=self._request_vars(None))
+        # Waiting for (or replacing) a worker stands in for spawning
+        # ansible-playbook.
+        start = time.time()
+        with self.workers.worker() as worker:
+            metrics.observe('quarry_playbook_phase_seconds',
+                            time.time() - start, volume_type=self.volume_type,
+                            operation=self.operation, phase='spawn')
+            tracing.record('spawn', start)
+            with self._lock:
+                if self._cancelled:
+                    raise utils.Cancelled("%s on %s was cancelled" %
+                                          (self.operation, self.volume_type))
+                self._worker = worker
+            self.log.debug("Running %s on ansible worker %i", self.operation,
+                           worker.proc.pid)
+            try:
+                with self._phase('run'):
+                    report = worker.call(self.volume_type, **request)
+            except utils.WorkerError:
+                if self._cancelled:
+                    raise utils.Cancelled("%s on %s was cancelled" %
+                                          (self.operation, self.volume_type))
+                raise
+            finally:
+                with self._lock:
+                    self._worker = None
+        if report['rc'] != 0:
+            for play in report.get('plays', []):
+                for task in play['tasks']:
+                    for result in task['hosts'].values():
+                        self._module_extras(result)
+            raise utils.AnsibleError(report['rc'], json.dumps(report), '')
+        with self._phase('parse'):
+            return self._result(report)
+
+    def cancel(self):
+        # The worker is killed along with the play it is running and the pool
+        # replaces it with a fresh one.
+        with self._lock:
+            self._cancelled = True
+            if self._worker is not None:
+                self._worker.kill()
+
+
+# Operations with a playbooks/batch counterpart
+BATCH_OPERATIONS = ('get_volume', 'create_volume', 'delete_volume',
+                    'get_snapshot', 'create_snapshot', 'delete_snapshot')
+
+
+class BatchPlayCaller(PlayCaller):
+    """
+    Run one operation for many volumes or snapshots of a volume type with a
+    single playbook.
+
+    The playbooks in playbooks/batch hand the whole list to the quarry module
+    in the quarry_items extra var so that one module run and one driver
+    serve every item.  run() returns one entry per item, in order:
+    either the module result or a BatchItemError for an item that failed.
+    Failures of the play as a whole are raised as for a single operation.
+    """
+
+    def __init__(self, volume_type, operation, items):
+        super(BatchPlayCaller, self).__init__(volume_type, operation, items,
+                                              static=True)
+
+    def _static_playbook(self):
+        return os.path.join(config.template_path, 'batch',
+                            '%s.yml' % self.operation)
+
+    def _extra_vars(self):
+        # Items are passed as module options, built as for direct execution
+        make_params = direct.OPERATIONS[self.operation][2]
+        items = [dict((k, v) for k, v in make_params(params).items()
+                      if v is not None)
+                 for params in self.params]
+        return dict(quarry_items=items)
+
+    def _result_from_records(self, records):
+        return self._split(
+            super(BatchPlayCaller, self)._result_from_records(records))
+
+    def _result(self, report):
+        return self._split(super(BatchPlayCaller, self)._result(report))
+
+    def _split(self, result):
+        if 'results' not in result and result.get('failed'):
+            # The module failed before getting to the items (ie. the driver
+            # could not be set up) so every item failed with it.
+            result = dict(results=[result] * len(self.params))
+        item_results = result.get('results', [])
+        if len(item_results) != len(self.params):
+            raise RuntimeError("Expecting %i item results, got %i" %
+                               (len(self.params), len(item_results)))
+        results = []
+        for item, res in zip(self.params, item_results):
+            res = dict(res)
+            res.pop('item', None)
+            if res.get('failed'):
+                item_id = item.get('snapshot_id') or item.get('volume_id')
+                res = utils.BatchItemError(self.volume_type, self.operation,
+                                           item_id, res.get('msg'))
+            results.append(res)
+        return results
+
+
+class WarmBatchPlayCaller(BatchPlayCaller, WarmPlayCaller):
+    """A BatchPlayCaller which runs on a worker from an AnsiblePool."""
+
+    def __init__(self, volume_type, operation, items, workers):
+        WarmPlayCaller.__init__(self, volume_type, operation, items, workers,
+                                static=True)
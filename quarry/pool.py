@@ -0,0 +1,156 @@
+#
+#  Copyright 2017 Red Hat, Inc. and/or its affiliates.
+#
+# Licensed to you under the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.  See the files README and
+# LICENSE_GPL_v2 which accompany this distribution.
+#
+
+import logging
+import sys
+import threading
+
+import six
+from six.moves import queue
+
+import profiling
+import tracing
+import utils
+
+
+class Future(object):
+    """The eventual result of a call handed to a WorkerPool."""
+
+    def __init__(self):
+        self._done = threading.Event()
+        self._lock = threading.Lock()
+        self._result = None
+        self._exc_info = None
+        self._callbacks = []
+
+    def done(self):
+        return self._done.is_set()
+
+    def result(self, timeout=None):
+        if not self._done.wait(timeout):
+            raise utils.Timeout("Timed out waiting for result")
+        if self._exc_info is not None:
+            six.reraise(*self._exc_info)
+        return self._result
+
+    def exception(self, timeout=None):
+        if not self._done.wait(timeout):
+            raise utils.Timeout("Timed out waiting for result")
+        return self._exc_info[1] if self._exc_info is not None else None
+
+    def set_result(self, result):
+        self._result = result
+        self._finish()
+
+    def set_exception(self, exc_info):
+        self._exc_info = exc_info
+        self._finish()
+
+    def add_done_callback(self, fn):
+        with self._lock:
+            if not self._done.is_set():
+                self._callbacks.append(fn)
+                return
+        fn(self)
+
+    def _finish(self):
+        with self._lock:
+            self._done.set()
+            callbacks, self._callbacks = self._callbacks, []
+        for fn in callbacks:
+            try:
+                fn(self)
+            except Exception:
+                logging.exception("Future callback %s failed", fn)
+
+
+class WorkerPool(object):
+    """
+    A fixed set of daemon threads running submitted calls in FIFO order.
+    Calls run under the tracing span and profiled request that were current
+    when they were submitted.
+    """
+
+    def __init__(self, name, size):
+        self.name = name
+        self.size = size
+        self._queue = queue.Queue()
+        self._threads = []
+        for i in range(size):
+            t = threading.Thread(target=self._worker,
+                                 name='%s-%i' % (name, i))
+            t.daemon = True
+            t.start()
+            self._threads.append(t)
+
+    def submit(self, fn, *args, **kwargs):
+        future = Future()
+        self._queue.put((future, tracing.current(), profiling.current(), fn,
+                         args, kwargs))
+        return future
+
+    def qsize(self):
+        return self._queue.qsize()
+
+    def stop(self):
+        for t in self._threads:
+            self._queue.put(None)
+        for t in self._threads:
+            t.join()
+        self._threads = []
+
+    def _worker(self):
+        while True:
+            work = self._queue.get()
+            if work is None:
+                return
+            future, span, request_id, fn, args, kwargs = work
+            try:
+                with tracing.attach(span), profiling.attach(request_id):
+                    result = fn(*args, **kwargs)
+            except Exception:
+                future.set_exception(sys.exc_info())
+            else:
+                future.set_result(result)
+
+
+class SingleFlight(object):
+    """
+    Let concurrent identical calls share one execution.
+
+    The first caller for a key runs the call and any caller asking for the
+    same key while it is in flight waits for and gets the same result (or
+    exception) instead of running it again.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+
+    def do(self, key, fn, *args, **kwargs):
+        with self._lock:
+            future = self._calls.get(key)
+            leader = future is None
+            if leader:
+                future = self._calls[key] = Future()
+        if leader:
+            try:
+                result = fn(*args, **kwargs)
+            except Exception:
+                exc_info = sys.exc_info()
+            else:
+                exc_info = None
+            # Callers arriving from now on start a new call
+            with self._lock:
+                del self._calls[key]
+            if exc_info is not None:
+                future.set_exception(exc_info)
+            else:
+                future.set_result(result)
+        return future.result()
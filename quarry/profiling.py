@@ -0,0 +1,171 @@
+#
+#  Copyright 2017 Red Hat, Inc. and/or its affiliates.
+#
+# Licensed to you under the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.  See the files README and
+# LICENSE_GPL_v2 which accompany this distribution.
+#
+
+# Opt-in cProfile runs of API requests and of the quarry operations they
+# lead to.  The id of the request being profiled is kept per thread (and
+# carried over by WorkerPool) and every profile is written to the configured
+# directory as <request id>.<label>.<run>.pstats, where run numbers the
+# profiles written by this process so that a request running the same
+# operation more than once keeps all of them.  Nothing is profiled until
+# configure() is given a directory.
+
+from contextlib import contextmanager
+import base64
+import cProfile
+import itertools
+import logging
+import os
+import threading
+import uuid
+
+log = logging.getLogger('profiling')
+
+_directory = None
+_lock = threading.Lock()
+_armed_requests = 0
+_armed_types = {}
+_runs = itertools.count(1)
+_local = threading.local()
+
+
+def configure(directory):
+    global _directory
+    _directory = directory or None
+    if _directory is not None and not os.path.isdir(_directory):
+        os.makedirs(_directory)
+
+
+def enabled():
+    return _directory is not None
+
+
+def arm(count, volume_type=None):
+    """
+    Profile the next `count` API requests or, given a volume type, the next
+    `count` operations run on it.
+    """
+    global _armed_requests
+    with _lock:
+        if volume_type is None:
+            _armed_requests = count
+        elif count > 0:
+            _armed_types[volume_type] = count
+        else:
+            _armed_types.pop(volume_type, None)
+
+
+def armed():
+    with _lock:
+        return dict(requests=_armed_requests, volume_types=dict(_armed_types))
+
+
+def take_request():
+    """Return True if the request starting now should be profiled."""
+    global _armed_requests
+    with _lock:
+        if _directory is None or _armed_requests <= 0:
+            return False
+        _armed_requests -= 1
+        return True
+
+
+def current():
+    return getattr(_local, 'request_id', None)
+
+
+def for_operation(volume_type):
+    """
+    Return the request id an operation on `volume_type` is profiled under,
+    if any.
+    """
+    request_id = current()
+    if request_id is not None or _directory is None:
+        return request_id
+    with _lock:
+        count = _armed_types.get(volume_type, 0)
+        if count <= 0:
+            return None
+        if count == 1:
+            del _armed_types[volume_type]
+        else:
+            _armed_types[volume_type] = count - 1
+    return new_id()
+
+
+def new_id():
+    return uuid.uuid4().hex
+
+
+@contextmanager
+def attach(request_id):
+    """Run the enclosed code as part of profiled request `request_id`."""
+    saved = current()
+    _local.request_id = request_id
+    try:
+        yield
+    finally:
+        _local.request_id = saved
+
+
+def begin(request_id):
+    """Start profiling this thread as part of request `request_id`."""
+    _local.request_id = request_id
+    profiler = cProfile.Profile()
+    profiler.enable()
+    return profiler
+
+
+def end(request_id, profiler, label):
+    profiler.disable()
+    _local.request_id = None
+    _dump(profiler, request_id, label)
+
+
+@contextmanager
+def profile(request_id, label):
+    """Profile the enclosed code in this thread if request_id is set."""
+    if request_id is None or _directory is None:
+        yield
+        return
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        yield
+    finally:
+        profiler.disable()
+        _dump(profiler, request_id, label)
+
+
+def save(request_id, label, pstats):
+    """Write base64 encoded pstats data returned by a quarry module."""
+    path = _path(request_id, label)
+    try:
+        with open(path, 'wb') as f:
+            f.write(base64.b64decode(pstats))
+    except (IOError, OSError):
+        log.exception("Failed to write profile %s", path)
+    else:
+        log.info("Wrote profile %s", path)
+
+
+def _dump(profiler, request_id, label):
+    path = _path(request_id, label)
+    try:
+        profiler.dump_stats(path)
+    except (IOError, OSError):
+        log.exception("Failed to write profile %s", path)
+    else:
+        log.info("Wrote profile %s", path)
+
+
+def _path(request_id, label):
+    with _lock:
+        run = next(_runs)
+    name = '%s.%s.%i.pstats' % (request_id, label, run)
+    return os.path.join(_directory, name)
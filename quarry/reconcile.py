@@ -0,0 +1,114 @@
+#
+#  Copyright 2017 Red Hat, Inc. and/or its affiliates.
+#
+# Licensed to you under the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.  See the files README and
+# LICENSE_GPL_v2 which accompany this distribution.
+#
+
+import logging
+import random
+import threading
+import time
+
+
+class Reconciler(object):
+    """
+    Keep the inventory and the location index in step with the backends.
+
+    A background thread refreshes the inventory of each volume type every
+    `interval` seconds (or its entry in `intervals`), give or take `jitter`
+    of the interval so that the volume types do not all hit their backends
+    at once.  Volumes and snapshots found on a backend are added to the
+    location index and entries for that volume type which the backend no
+    longer has are removed, which picks up changes made behind quarry's back.
+    `invalidate(kind, resource_id)`, if given, is called for every volume
+    and snapshot found or found gone so that cached lookups of them are
+    dropped.
+    """
+    log = logging.getLogger('Reconciler')
+
+    def __init__(self, inventory, location_index, volume_types, interval=300,
+                 intervals=None, jitter=0.1, invalidate=None):
+        self.inventory = inventory
+        self.location_index = location_index
+        self.volume_types = volume_types
+        self.interval = interval
+        self.intervals = intervals or {}
+        self.jitter = jitter
+        self.invalidate = invalidate
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._stopped.clear()
+        self._thread = threading.Thread(target=self._run, name='reconciler')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def reconcile(self, volume_type):
+        # Entries this server changes while the backend is being listed are
+        # newer than the listing, so the index is only updated where it still
+        # holds what it did before the listing was taken.
+        known_volumes = self.location_index.volumes(volume_type)
+        known_snapshots = self.location_index.snapshots(volume_type)
+        entry = self.inventory.refresh(volume_type)
+        add_volumes = [dict(id=v['id'], volume_type=volume_type,
+                            size=v['size'])
+                       for v in entry.volumes.values()]
+        add_snapshots = [dict(id=s['id'], volume_type=volume_type,
+                              volume_id=s['volume_id'])
+                         for s in entry.snapshots.values()]
+        remove_volumes = set(known_volumes) - set(entry.volumes)
+        remove_snapshots = set(known_snapshots) - set(entry.snapshots)
+        if remove_volumes or remove_snapshots:
+            self.log.info("Volume type %s no longer has volumes %s and "
+                          "snapshots %s", volume_type,
+                          sorted(remove_volumes), sorted(remove_snapshots))
+        self.location_index.update(add_volumes, remove_volumes,
+                                   add_snapshots, remove_snapshots,
+                                   expected=(known_volumes, known_snapshots))
+        if self.invalidate is not None:
+            # Only lookups of resources which appeared, went away or moved
+            # can be out of date.
+            for volume_id in remove_volumes | _changed(add_volumes,
+                                                       known_volumes):
+                self.invalidate('volume', volume_id)
+            for snapshot_id in remove_snapshots | _changed(add_snapshots,
+                                                           known_snapshots):
+                self.invalidate('snapshot', snapshot_id)
+
+    def _run(self):
+        if not self.volume_types:
+            return
+        # Spread the first round over the jitter window as well
+        now = time.time()
+        due = dict((volume_type, now + random.uniform(0, self._jitter(
+                    volume_type)))
+                   for volume_type in self.volume_types)
+        while not self._stopped.is_set():
+            volume_type = min(due, key=due.get)
+            if self._stopped.wait(max(0, due[volume_type] - time.time())):
+                break
+            try:
+                self.reconcile(volume_type)
+            except Exception:
+                self.log.exception("Failed to reconcile %s", volume_type)
+            interval = self.intervals.get(volume_type, self.interval)
+            due[volume_type] = time.time() + interval + random.uniform(
+                -self._jitter(volume_type), self._jitter(volume_type))
+
+    def _jitter(self, volume_type):
+        return self.intervals.get(volume_type, self.interval) * self.jitter
+
+
+def _changed(entries, known):
+    """Return the ids of the entries which differ from the known ones."""
+    return set(e['id'] for e in entries if known.get(e['id']) != e)
@@ -11,15 +11,41 @@ import argparse
 import cherrypy
 import json
 import logging
+import six
+import sys
 import uuid
-from collections import namedtuple
+from collections import namedtuple, OrderedDict
+from six.moves import queue
+from six.moves.urllib.parse import parse_qsl, urlencode
 
-import playcaller
+import cache
+import config
+import execution
+import inventory
+import jobs
+import locations
+import metrics
+import pool
+import profiling
+import reconcile
+import tracing
 import utils
 
 
 DiscoveredResource = namedtuple('DiscoveredVolume', 'type,info')
 
+# Seconds a list request is told to wait for the first listing of a volume
+# type
+LISTING_RETRY_AFTER = 2
+
+location_index = None
+lookup_cache = None
+negative_cache = None
+inventory_cache = None
+job_manager = None
+search_pool = None
+executor = None
+
 
 def volume_types():
     return cherrypy.request.app.config['global']['volume_types']
@@ -50,34 +76,83 @@ class LimitsController(object):
 
     def index(self, api_ver, tenant_id):
         cherrypy.response.headers['Content-Type'] = 'application/json'
+        # Usage comes from whatever inventory is already cached; these
+        # requests never wait for a backend.
+        volumes = snapshots = gigabytes = 0
+        for volume_type in volume_types():
+            entry = inventory_cache.cached(volume_type)
+            if entry is not None:
+                volumes += len(entry.volumes)
+                snapshots += len(entry.snapshots)
+                gigabytes += sum(v['size'] or 0
+                                 for v in entry.volumes.values())
         return json.dumps({
             "limits": {
                 "rate": [],
                 "absolute": {
-                    "totalSnapshotsUsed": 0,
+                    "totalSnapshotsUsed": snapshots,
                     "maxTotalBackups": 10,
                     "maxTotalVolumeGigabytes": 1000,
                     "maxTotalSnapshots": 10,
                     "maxTotalBackupGigabytes": 1000,
                     "totalBackupGigabytesUsed": 0,
                     "maxTotalVolumes": 10,
-                    "totalVolumesUsed": 0,
+                    "totalVolumesUsed": volumes,
                     "totalBackupsUsed": 0,
-                    "totalGigabytesUsed": 0
+                    "totalGigabytesUsed": gigabytes
                 }
             }
         })
 
 
+class MetricsController(object):
+
+    def index(self):
+        cherrypy.response.headers['Content-Type'] = ('text/plain; '
+                                                     'version=0.0.4')
+        return metrics.render()
+
+
+class ProfileController(object):
+
+    @cherrypy.tools.json_in()
+    def index(self):
+        cherrypy.response.headers['Content-Type'] = 'application/json'
+        if not profiling.enabled():
+            raise cherrypy.HTTPError(404, "Profiling is not enabled")
+        if cherrypy.request.method.upper() == 'POST':
+            req = getattr(cherrypy.request, 'json', None) or {}
+            try:
+                count = int(req.get('count', 1))
+            except (TypeError, ValueError):
+                raise cherrypy.HTTPError(400, "Invalid count")
+            volume_type = req.get('volume_type')
+            if volume_type is not None and volume_type not in volume_types():
+                raise cherrypy.HTTPError(400, "Invalid volume_type")
+            profiling.arm(count, volume_type)
+        elif cherrypy.request.method.upper() != 'GET':
+            raise cherrypy.HTTPError(400, "Method not supported")
+        return json.dumps(profiling.armed())
+
+
 class VolumeController(object):
 
     @cherrypy.tools.json_in()
-    def collection(self, api_ver, tenant_id):
+    def collection(self, api_ver, tenant_id, **kwargs):
         if cherrypy.request.method.upper() == 'POST':
+            if 'volumes' in _json_body():
+                return self._create_volumes()
             return self._create_volume()
+        elif cherrypy.request.method.upper() == 'GET':
+            return self._list_volumes(False, **kwargs)
         else:
             raise cherrypy.HTTPError(400, "Method not supported")
 
+    def detail(self, api_ver, tenant_id, **kwargs):
+        if cherrypy.request.method.upper() != 'GET':
+            raise cherrypy.HTTPError(400, "GET method expected")
+        return self._list_volumes(True, **kwargs)
+
     @cherrypy.tools.json_in()
     def resource(self, api_ver, tenant_id, volume_id):
         if cherrypy.request.method.upper() == 'DELETE':
@@ -103,93 +178,157 @@ class VolumeController(object):
             return self._terminate_connection(volume_id, initiator)
         raise cherrypy.HTTPError(400, "Action Not implemented")
 
+    @cherrypy.tools.json_in()
+    def bulk_action(self, api_ver, tenant_id):
+        cherrypy.response.headers['Content-Type'] = 'application/json'
+        if cherrypy.request.method.upper() != 'POST':
+            raise cherrypy.HTTPError(400, "POST method expected")
+        req = _json_body()
+        if 'os-delete' in req:
+            return self._delete_volumes(_entries(req['os-delete'],
+                                                 'volume_ids'))
+        raise cherrypy.HTTPError(400, "Action Not implemented")
+
+    def _list_volumes(self, detail, limit=None, marker=None,
+                      volume_type=None, **kwargs):
+        cherrypy.response.headers['Content-Type'] = 'application/json'
+        volumes = _listing('volume', volume_type)
+        for job in job_manager.list('volume'):
+            if job.in_progress() and job.id not in volumes:
+                volumes[job.id] = dict(id=job.id, size=job.info['size'],
+                                       volume_type=job.info['volume_type'],
+                                       status=job.status)
+        page, links = _paginate('volumes', volumes, limit, marker)
+        if detail:
+            page = [_volume_dict(v['id'], v['volume_type'], v['size'],
+                                 v['status']) for v in page]
+        else:
+            page = [dict(id=v['id'], name="volume-%s" % v['id'], links=[])
+                    for v in page]
+        result = dict(volumes=page)
+        if links:
+            result['volumes_links'] = links
+        return json.dumps(result)
+
     def _get_volume(self, volume_id):
         cherrypy.response.headers['Content-Type'] = 'application/json'
+        job = job_manager.get('volume', volume_id)
+        if job is not None and job.status != 'available':
+            if job.status == 'deleted':
+                raise cherrypy.HTTPError(404, "Volume not found")
+            return _volume_view(volume_id, job.info['volume_type'],
+                                job.info['size'], job.status)
         res = find_volume(volume_id)
-        return json.dumps(dict(volume=dict(
-            status="available",
-            attachments=[],
-            links=[],
-            availability_zone="nova",
-            bootable=True,
-            description="",
-            name="volume-%s" % volume_id,
-            volume_type=res.type,
-            id=volume_id,
-            size=res.info['size'],
-            metadata={},
-        )))
+        return _volume_view(volume_id, res.type, res.info['size'],
+                            'available')
 
     def _create_volume(self):
         cherrypy.response.headers['Content-Type'] = 'application/json'
-        volume_id = str(uuid.uuid4())
-        volume_type = cherrypy.request.json['volume']['volume_type']
-        volume_size = cherrypy.request.json['volume']['size']
-        source_volid = cherrypy.request.json['volume'].get('source_volid')
-        snapshot_id = cherrypy.request.json['volume'].get('snapshot_id')
-
-        if volume_type not in volume_types():
-            raise cherrypy.HTTPError(400, "Unsupported volume type")
-
-        params = dict(
-            volume_id=volume_id,
-            volume_size=volume_size,
-            source_volid=source_volid,
-            snapshot_id=snapshot_id,
-        )
-
-        if source_volid and snapshot_id:
-            raise cherrypy.HTTPError(401, "Only one of source_volid and "
-                                     "snapshot_id is allowed")
+        volume_type, params = _new_volume(
+            cherrypy.request.json.get('volume'))
+        _admit([volume_type])
+        job_manager.submit('volume', params['volume_id'], 'creating',
+                           'available', 'error', create_volume, volume_type,
+                           params,
+                           info=dict(volume_type=volume_type,
+                                     size=params['volume_size']))
+        cherrypy.response.status = 202  # Accepted
+        return json.dumps(dict(volume=_creating_volume(volume_type, params)))
 
-        playcaller.PlayCaller(volume_type, 'create_volume', params).run()
+    def _create_volumes(self):
+        cherrypy.response.headers['Content-Type'] = 'application/json'
+        # Validate the whole request before starting any of it
+        requests = [_new_volume(entry)
+                    for entry in _entries(cherrypy.request.json, 'volumes')]
+        groups = _group_by_type(requests)
+        _admit(groups)
+        for volume_type, group in groups.items():
+            job_manager.submit_batch(
+                'volume', [params['volume_id'] for params in group],
+                'creating', 'available', 'error', create_volumes,
+                volume_type, group,
+                info=[dict(volume_type=volume_type,
+                           size=params['volume_size']) for params in group])
         cherrypy.response.status = 202  # Accepted
-        return json.dumps(dict(volume=dict(
-            status="creating",
-            id=volume_id,
-            size=params['volume_size'],
-            volume_type=volume_type,
-            source_volid=source_volid,
-            snapshot_id=snapshot_id,
-        )))
+        return json.dumps(dict(volumes=[
+            _creating_volume(volume_type, params)
+            for volume_type, params in requests]))
 
     def _delete_volume(self, volume_id):
         cherrypy.response.headers['Content-Type'] = 'application/json'
-        res = find_volume(volume_id)
+        _check_not_busy('volume', volume_id)
+        res = find_volume(volume_id, verify=False)
         params = dict(volume_id=volume_id)
-        playcaller.PlayCaller(res.type, 'delete_volume', params).run()
+        _admit([res.type])
+        job_manager.submit('volume', volume_id, 'deleting', 'deleted',
+                           'error_deleting', delete_volume, res.type, params,
+                           info=dict(volume_type=res.type,
+                                     size=res.info.get('size')))
         cherrypy.response.status = 202  # Accepted
 
+    def _delete_volumes(self, volume_ids):
+        _check_ids('volume', volume_ids)
+        requests = []
+        for volume_id in volume_ids:
+            _check_not_busy('volume', volume_id)
+            res = find_volume(volume_id, verify=False)
+            requests.append((res.type, dict(volume_id=volume_id,
+                                            size=res.info.get('size'))))
+        groups = _group_by_type(requests)
+        _admit(groups)
+        for volume_type, group in groups.items():
+            job_manager.submit_batch(
+                'volume', [params['volume_id'] for params in group],
+                'deleting', 'deleted', 'error_deleting', delete_volumes,
+                volume_type,
+                [dict(volume_id=params['volume_id']) for params in group],
+                info=[dict(volume_type=volume_type, size=params['size'])
+                      for params in group])
+        cherrypy.response.status = 202  # Accepted
+        return json.dumps(dict(volumes=[
+            dict(id=volume_id, status='deleting')
+            for volume_id in volume_ids]))
+
     def _initialize_connection(self, volume_id, initiator):
         cherrypy.response.headers['Content-Type'] = 'application/json'
-        res = find_volume(volume_id)
+        res = find_volume(volume_id, verify=False)
         params = dict(
             volume_id=volume_id,
             initiator=initiator
         )
-        ret = playcaller.PlayCaller(
-            res.type, 'initialize_connection', params).run()
+        ret = executor.run(res.type, 'initialize_connection', params)
+        _invalidate('volume', volume_id)
         return json.dumps(dict(connection_info=ret['connection_info']))
 
     def _terminate_connection(self, volume_id, initiator):
         cherrypy.response.headers['Content-Type'] = 'application/json'
-        res = find_volume(volume_id)
+        res = find_volume(volume_id, verify=False)
         params = dict(
             volume_id=volume_id,
             initiator=initiator
         )
-        playcaller.PlayCaller(res.type, 'terminate_connection', params).run()
+        executor.run(res.type, 'terminate_connection', params)
+        _invalidate('volume', volume_id)
 
 
 class SnapshotController(object):
 
     @cherrypy.tools.json_in()
-    def collection(self, api_ver, tenant_id):
+    def collection(self, api_ver, tenant_id, **kwargs):
         if cherrypy.request.method.upper() == 'POST':
+            if 'snapshots' in _json_body():
+                return self._create_snapshots()
             return self._create_snapshot()
+        elif cherrypy.request.method.upper() == 'GET':
+            return self._list_snapshots(False, **kwargs)
         else:
             raise cherrypy.HTTPError(400, "Method not supported")
 
+    def detail(self, api_ver, tenant_id, **kwargs):
+        if cherrypy.request.method.upper() != 'GET':
+            raise cherrypy.HTTPError(400, "GET method expected")
+        return self._list_snapshots(True, **kwargs)
+
     @cherrypy.tools.json_in()
     def resource(self, api_ver, tenant_id, snapshot_id):
         if cherrypy.request.method.upper() == 'DELETE':
@@ -199,69 +338,629 @@ class SnapshotController(object):
         else:
             raise cherrypy.HTTPError(400, "Method not supported")
 
+    @cherrypy.tools.json_in()
+    def bulk_action(self, api_ver, tenant_id):
+        cherrypy.response.headers['Content-Type'] = 'application/json'
+        if cherrypy.request.method.upper() != 'POST':
+            raise cherrypy.HTTPError(400, "POST method expected")
+        req = _json_body()
+        if 'os-delete' in req:
+            return self._delete_snapshots(_entries(req['os-delete'],
+                                                   'snapshot_ids'))
+        raise cherrypy.HTTPError(400, "Action Not implemented")
+
+    def _list_snapshots(self, detail, limit=None, marker=None,
+                        volume_type=None, **kwargs):
+        cherrypy.response.headers['Content-Type'] = 'application/json'
+        snapshots = _listing('snapshot', volume_type)
+        for job in job_manager.list('snapshot'):
+            if job.in_progress() and job.id not in snapshots:
+                snapshots[job.id] = dict(id=job.id,
+                                         volume_id=job.info['volume_id'],
+                                         volume_type=job.info['volume_type'],
+                                         status=job.status)
+        page, links = _paginate('snapshots', snapshots, limit, marker)
+        if detail:
+            page = [_snapshot_dict(s['id'], s['volume_id'], s['status'])
+                    for s in page]
+        else:
+            page = [dict(id=s['id'], links=[]) for s in page]
+        result = dict(snapshots=page)
+        if links:
+            result['snapshots_links'] = links
+        return json.dumps(result)
+
     def _get_snapshot(self, snapshot_id):
         cherrypy.response.headers['Content-Type'] = 'application/json'
+        job = job_manager.get('snapshot', snapshot_id)
+        if job is not None and job.status != 'available':
+            if job.status == 'deleted':
+                raise cherrypy.HTTPError(404, "Snapshot not found")
+            return _snapshot_view(snapshot_id, job.info['volume_id'],
+                                  job.status)
         res = find_snapshot(snapshot_id)
-        return json.dumps(dict(snapshot=dict(
-            status="available",
-            id=snapshot_id,
-            volume_id=res.info['volume_id'],
-        )))
+        return _snapshot_view(snapshot_id, res.info['volume_id'], 'available')
 
     def _create_snapshot(self):
         cherrypy.response.headers['Content-Type'] = 'application/json'
-        snapshot_id = str(uuid.uuid4())
-        volume_id = cherrypy.request.json['snapshot']['volume_id']
-        res = find_volume(volume_id)
-        params = dict(
-            volume_id=volume_id,
-            snapshot_id=snapshot_id
-        )
+        volume_type, params = _new_snapshot(
+            cherrypy.request.json.get('snapshot'))
+        _admit([volume_type])
+        job_manager.submit('snapshot', params['snapshot_id'], 'creating',
+                           'available', 'error', create_snapshot, volume_type,
+                           params,
+                           info=dict(volume_type=volume_type,
+                                     volume_id=params['volume_id']))
+        cherrypy.response.status = 202  # Accepted
+        return json.dumps(dict(snapshot=_creating_snapshot(params)))
 
-        playcaller.PlayCaller(res.type, 'create_snapshot', params).run()
+    def _create_snapshots(self):
+        cherrypy.response.headers['Content-Type'] = 'application/json'
+        requests = [_new_snapshot(entry) for entry in
+                    _entries(cherrypy.request.json, 'snapshots')]
+        groups = _group_by_type(requests)
+        _admit(groups)
+        for volume_type, group in groups.items():
+            job_manager.submit_batch(
+                'snapshot', [params['snapshot_id'] for params in group],
+                'creating', 'available', 'error', create_snapshots,
+                volume_type, group,
+                info=[dict(volume_type=volume_type,
+                           volume_id=params['volume_id']) for params in group])
         cherrypy.response.status = 202  # Accepted
-        return json.dumps(dict(snapshot=dict(
-            status="creating",
-            id=snapshot_id,
-            volume_id=volume_id,
-        )))
+        return json.dumps(dict(snapshots=[
+            _creating_snapshot(params) for volume_type, params in requests]))
 
     def _delete_snapshot(self, snapshot_id):
         cherrypy.response.headers['Content-Type'] = 'application/json'
-        res = find_snapshot(snapshot_id)
+        _check_not_busy('snapshot', snapshot_id)
+        res = find_snapshot(snapshot_id, verify=False)
         params = dict(snapshot_id=snapshot_id)
-        playcaller.PlayCaller(res.type, 'delete_snapshot', params).run()
+        _admit([res.type])
+        job_manager.submit('snapshot', snapshot_id, 'deleting', 'deleted',
+                           'error_deleting', delete_snapshot, res.type,
+                           params,
+                           info=dict(volume_type=res.type,
+                                     volume_id=res.info.get('volume_id')))
         cherrypy.response.status = 202  # Accepted
 
+    def _delete_snapshots(self, snapshot_ids):
+        _check_ids('snapshot', snapshot_ids)
+        requests = []
+        for snapshot_id in snapshot_ids:
+            _check_not_busy('snapshot', snapshot_id)
+            res = find_snapshot(snapshot_id, verify=False)
+            requests.append((res.type, dict(
+                snapshot_id=snapshot_id,
+                volume_id=res.info.get('volume_id'))))
+        groups = _group_by_type(requests)
+        _admit(groups)
+        for volume_type, group in groups.items():
+            job_manager.submit_batch(
+                'snapshot', [params['snapshot_id'] for params in group],
+                'deleting', 'deleted', 'error_deleting', delete_snapshots,
+                volume_type,
+                [dict(snapshot_id=params['snapshot_id']) for params in group],
+                info=[dict(volume_type=volume_type,
+                           volume_id=params['volume_id']) for params in group])
+        cherrypy.response.status = 202  # Accepted
+        return json.dumps(dict(snapshots=[
+            dict(id=snapshot_id, status='deleting')
+            for snapshot_id in snapshot_ids]))
 
-def find_volume(volume_id):
-    for volume_type in volume_types():
-        params = dict(
-            volume_id=volume_id,
-            volume_size=0,
-        )
-        cherrypy.log("Searching backend %s for volume %s" % (volume_type,
-                                                             volume_id))
-        ret = playcaller.PlayCaller(volume_type, 'get_volume', params).run()
+
+def _json_body():
+    req = getattr(cherrypy.request, 'json', None)
+    if not isinstance(req, dict):
+        raise cherrypy.HTTPError(400, "Invalid request body")
+    return req
+
+
+def _entries(req, key):
+    entries = req.get(key) if isinstance(req, dict) else None
+    if not isinstance(entries, list) or not entries:
+        raise cherrypy.HTTPError(400, "%s must be a non-empty list" % key)
+    return entries
+
+
+def _new_volume(entry):
+    if not isinstance(entry, dict):
+        raise cherrypy.HTTPError(400, "Invalid volume")
+    volume_type = entry.get('volume_type')
+    if volume_type not in volume_types():
+        raise cherrypy.HTTPError(400, "Unsupported volume type")
+    try:
+        size = int(entry['size'])
+    except (KeyError, TypeError, ValueError):
+        raise cherrypy.HTTPError(400, "Invalid volume size")
+    if size <= 0:
+        raise cherrypy.HTTPError(400, "Invalid volume size")
+    params = dict(
+        volume_id=str(uuid.uuid4()),
+        volume_size=size,
+        source_volid=entry.get('source_volid'),
+        snapshot_id=entry.get('snapshot_id'),
+    )
+    if params['source_volid'] and params['snapshot_id']:
+        raise cherrypy.HTTPError(401, "Only one of source_volid and "
+                                 "snapshot_id is allowed")
+    return volume_type, params
+
+
+def _creating_volume(volume_type, params):
+    return dict(
+        status="creating",
+        id=params['volume_id'],
+        size=params['volume_size'],
+        volume_type=volume_type,
+        source_volid=params['source_volid'],
+        snapshot_id=params['snapshot_id'],
+    )
+
+
+def _new_snapshot(entry):
+    if (not isinstance(entry, dict) or
+            not isinstance(entry.get('volume_id'), six.string_types) or
+            not entry['volume_id']):
+        raise cherrypy.HTTPError(400, "Invalid snapshot")
+    res = find_volume(entry['volume_id'], verify=False)
+    params = dict(
+        volume_id=entry['volume_id'],
+        snapshot_id=str(uuid.uuid4()),
+    )
+    return res.type, params
+
+
+def _creating_snapshot(params):
+    return dict(
+        status="creating",
+        id=params['snapshot_id'],
+        volume_id=params['volume_id'],
+    )
+
+
+def _group_by_type(requests):
+    groups = OrderedDict()
+    for volume_type, params in requests:
+        groups.setdefault(volume_type, []).append(params)
+    return groups
+
+
+def _volume_view(volume_id, volume_type, size, status):
+    return json.dumps(dict(volume=_volume_dict(volume_id, volume_type, size,
+                                               status)))
+
+
+def _volume_dict(volume_id, volume_type, size, status):
+    return dict(
+        status=status,
+        attachments=[],
+        links=[],
+        availability_zone="nova",
+        bootable=True,
+        description="",
+        name="volume-%s" % volume_id,
+        volume_type=volume_type,
+        id=volume_id,
+        size=size,
+        metadata={},
+    )
+
+
+def _snapshot_view(snapshot_id, volume_id, status):
+    return json.dumps(dict(snapshot=_snapshot_dict(snapshot_id, volume_id,
+                                                   status)))
+
+
+def _snapshot_dict(snapshot_id, volume_id, status):
+    return dict(
+        status=status,
+        id=snapshot_id,
+        volume_id=volume_id,
+    )
+
+
+def _listing(kind, volume_type=None):
+    """
+    Gather the cached inventory of every (or the given) volume type into a
+    dict of resources by id, each tagged with its volume type and status.
+    Until every volume type asked for has been listed once the request is
+    refused with Overloaded rather than answered with a partial listing.
+    """
+    if volume_type is not None and volume_type not in volume_types():
+        raise cherrypy.HTTPError(400, "Unsupported volume type")
+    # Getting every listing first starts all the missing ones together
+    listings = OrderedDict((vol_type, inventory_cache.get(vol_type))
+                           for vol_type in volume_types()
+                           if volume_type in (None, vol_type))
+    missing = [vol_type for vol_type, listing in listings.items()
+               if listing is None]
+    if missing:
+        raise utils.Overloaded("Inventory of %s is not ready yet" %
+                               ', '.join(missing), LISTING_RETRY_AFTER)
+    jobs_by_id = dict((job.id, job) for job in job_manager.list(kind))
+    resources = {}
+    for vol_type, listing in listings.items():
+        for resource_id, entry in getattr(listing, kind + 's').items():
+            resource = dict(entry, volume_type=vol_type, status='available')
+            job = jobs_by_id.get(resource_id)
+            if job is not None:
+                if job.status == 'deleted':
+                    continue
+                resource['status'] = job.status
+            resources[resource_id] = resource
+    return resources
+
+
+def _paginate(collection, resources, limit=None, marker=None):
+    """
+    Return a page of resources, ordered by id, starting after the marker
+    along with the links to the next page if there is one.
+    """
+    ids = sorted(resources)
+    if marker is not None:
+        if marker not in resources:
+            raise cherrypy.HTTPError(400, "Marker %s not found" % marker)
+        ids = ids[ids.index(marker) + 1:]
+    links = []
+    if limit is not None:
+        try:
+            limit = int(limit)
+            if limit < 1:
+                raise ValueError(limit)
+        except ValueError:
+            raise cherrypy.HTTPError(400, "Invalid limit %s" % limit)
+        if len(ids) > limit:
+            ids = ids[:limit]
+            # Route variables are part of request.params too, so only the
+            # query string is carried over.
+            params = [(k, v) for k, v in
+                      parse_qsl(cherrypy.request.query_string)
+                      if k not in ('limit', 'marker')]
+            params += [('limit', limit), ('marker', ids[-1])]
+            links.append(dict(rel='next', href=cherrypy.url(
+                qs=urlencode(params))))
+    return [resources[i] for i in ids], links
+
+
+def _admit(volume_types):
+    # Refuse the whole request before any of it is started.  Jobs wait in
+    # the job manager's queue before they reach the volume type's gate, so
+    # those count as well.
+    for volume_type in volume_types:
+        executor.admit(volume_type, backlog=job_manager.backlog(volume_type))
+
+
+def _check_not_busy(kind, resource_id):
+    job = job_manager.get(kind, resource_id)
+    if job is not None and job.in_progress():
+        raise cherrypy.HTTPError(400, "Invalid %s: status must be available "
+                                 "or error, not %s" % (kind, job.status))
+
+
+def _check_ids(kind, resource_ids):
+    for resource_id in resource_ids:
+        if not isinstance(resource_id, six.string_types) or not resource_id:
+            raise cherrypy.HTTPError(400, "Invalid %s id" % kind)
+    if len(set(resource_ids)) != len(resource_ids):
+        raise cherrypy.HTTPError(400, "Duplicate %s ids" % kind)
+
+
+def create_volume(volume_type, params):
+    executor.run(volume_type, 'create_volume', params, admit=False)
+    _invalidate('volume', params['volume_id'])
+    location_index.add_volume(params['volume_id'], volume_type,
+                              params['volume_size'])
+
+
+def delete_volume(volume_type, params):
+    executor.run(volume_type, 'delete_volume', params, admit=False)
+    _invalidate('volume', params['volume_id'])
+    location_index.remove_volume(params['volume_id'])
+
+
+def create_snapshot(volume_type, params):
+    executor.run(volume_type, 'create_snapshot', params, admit=False)
+    _invalidate('snapshot', params['snapshot_id'])
+    location_index.add_snapshot(params['snapshot_id'], volume_type,
+                                params['volume_id'])
+
+
+def delete_snapshot(volume_type, params):
+    executor.run(volume_type, 'delete_snapshot', params, admit=False)
+    _invalidate('snapshot', params['snapshot_id'])
+    location_index.remove_snapshot(params['snapshot_id'])
+
+
+def create_volumes(volume_type, items):
+    results = executor.run_batch(volume_type, 'create_volume', items,
+                                 admit=False)
+    for params, result in zip(items, results):
+        _invalidate('volume', params['volume_id'])
+        if not isinstance(result, Exception):
+            location_index.add_volume(params['volume_id'], volume_type,
+                                      params['volume_size'])
+    return results
+
+
+def delete_volumes(volume_type, items):
+    results = executor.run_batch(volume_type, 'delete_volume', items,
+                                 admit=False)
+    for params, result in zip(items, results):
+        _invalidate('volume', params['volume_id'])
+        if not isinstance(result, Exception):
+            location_index.remove_volume(params['volume_id'])
+    return results
+
+
+def create_snapshots(volume_type, items):
+    results = executor.run_batch(volume_type, 'create_snapshot', items,
+                                 admit=False)
+    for params, result in zip(items, results):
+        _invalidate('snapshot', params['snapshot_id'])
+        if not isinstance(result, Exception):
+            location_index.add_snapshot(params['snapshot_id'], volume_type,
+                                        params['volume_id'])
+    return results
+
+
+def delete_snapshots(volume_type, items):
+    results = executor.run_batch(volume_type, 'delete_snapshot', items,
+                                 admit=False)
+    for params, result in zip(items, results):
+        _invalidate('snapshot', params['snapshot_id'])
+        if not isinstance(result, Exception):
+            location_index.remove_snapshot(params['snapshot_id'])
+    return results
+
+
+def _volume_probe(volume_type, volume_id):
+    params = dict(
+        volume_id=volume_id,
+        volume_size=0,
+    )
+    cherrypy.log("Searching backend %s for volume %s" % (volume_type,
+                                                         volume_id))
+    return executor.caller(volume_type, 'get_volume', params)
+
+
+def _snapshot_probe(volume_type, snapshot_id):
+    params = dict(
+        snapshot_id=snapshot_id,
+        volume_id=None,  # Will be looked up
+    )
+    cherrypy.log("Searching backend %s for snapshot %s" % (volume_type,
+                                                           snapshot_id))
+    return executor.caller(volume_type, 'get_snapshot', params)
+
+
+def _search(probes):
+    """
+    Run the given probes and return the first one reporting 'present'.
+
+    Probes run one after the other unless parallel_search is enabled, in
+    which case they all start at once on the search pool and the stragglers
+    are cancelled as soon as one of them finds the resource.  Returns a
+    DiscoveredResource or None; a failed probe is only raised when no other
+    one finds the resource.
+    """
+    if search_pool is None or len(probes) < 2:
+        error = None
+        for probe in probes:
+            try:
+                ret = probe.run()
+            except Exception as e:
+                # Another volume type may still have it
+                if error is None:
+                    error = e
+                continue
+            if ret['state'] == 'present':
+                return DiscoveredResource(probe.volume_type, ret)
+        if error is not None:
+            raise error
+        return None
+
+    done = queue.Queue()
+    for probe in probes:
+        future = search_pool.submit(probe.run)
+        future.add_done_callback(lambda f, probe=probe: done.put((probe, f)))
+
+    found = None
+    error = None
+    try:
+        for i in range(len(probes)):
+            probe, future = done.get()
+            exc = future.exception()
+            if exc is None:
+                ret = future.result()
+                if ret['state'] == 'present':
+                    found = DiscoveredResource(probe.volume_type, ret)
+                    break
+            elif error is None and not isinstance(exc, utils.Cancelled):
+                error = exc
+    finally:
+        for probe in probes:
+            probe.cancel()
+    if found is None and error is not None:
+        raise error
+    return found
+
+
+def find_volume(volume_id, verify=True):
+    """
+    Locate the volume type holding a volume.
+
+    The location index is consulted first.  When verify is False a hit is
+    trusted as-is, which is enough for operations that only need to know
+    where to send the next playbook.  Otherwise the indexed backend is probed
+    once to refresh the volume info and only on a miss (or stale entry) are
+    the remaining volume types searched.
+
+    Verified results are kept in the lookup cache for a few seconds so that
+    clients polling a volume do not run a playbook every time.  Likewise a
+    volume that could not be found anywhere is remembered in the negative
+    cache so that repeated requests for it do not search every volume type.
+    """
+    if verify:
+        res = lookup_cache.get(('volume', volume_id))
+        if res is not None:
+            return res
+    entry = location_index.get_volume(volume_id)
+    if entry is None and negative_cache.get(('volume', volume_id)):
+        raise cherrypy.HTTPError(404, "Volume not found")
+    if entry is not None:
+        if not verify:
+            return DiscoveredResource(entry['volume_type'], entry)
+        ret = _volume_probe(entry['volume_type'], volume_id).run()
         if ret['state'] == 'present':
-            return DiscoveredResource(volume_type, ret)
-    else:
+            location_index.add_volume(volume_id, entry['volume_type'],
+                                      ret['size'])
+            return _cache('volume', volume_id, DiscoveredResource(
+                entry['volume_type'], ret))
+        location_index.remove_volume(volume_id)
+
+    res = _search([_volume_probe(volume_type, volume_id)
+                   for volume_type in volume_types()
+                   if entry is None or volume_type != entry['volume_type']])
+    if res is None:
+        negative_cache.put(('volume', volume_id), True)
         raise cherrypy.HTTPError(404, "Volume not found")
+    location_index.add_volume(volume_id, res.type, res.info['size'])
+    return _cache('volume', volume_id, res)
 
 
-def find_snapshot(snapshot_id):
-    for volume_type in volume_types():
-        params = dict(
-            snapshot_id=snapshot_id,
-            volume_id=None,  # Will be looked up
-        )
-        cherrypy.log("Searching backend %s for snapshot %s" % (volume_type,
-                                                               snapshot_id))
-        ret = playcaller.PlayCaller(volume_type, 'get_snapshot', params).run()
-        if ret["state"] == 'present':
-            return DiscoveredResource(volume_type, ret)
-    else:
+def find_snapshot(snapshot_id, verify=True):
+    if verify:
+        res = lookup_cache.get(('snapshot', snapshot_id))
+        if res is not None:
+            return res
+    entry = location_index.get_snapshot(snapshot_id)
+    if entry is None and negative_cache.get(('snapshot', snapshot_id)):
+        raise cherrypy.HTTPError(404, "Snapshot not found")
+    if entry is not None:
+        if not verify:
+            return DiscoveredResource(entry['volume_type'], entry)
+        ret = _snapshot_probe(entry['volume_type'], snapshot_id).run()
+        if ret['state'] == 'present':
+            location_index.add_snapshot(snapshot_id, entry['volume_type'],
+                                        ret['volume_id'])
+            return _cache('snapshot', snapshot_id, DiscoveredResource(
+                entry['volume_type'], ret))
+        location_index.remove_snapshot(snapshot_id)
+
+    res = _search([_snapshot_probe(volume_type, snapshot_id)
+                   for volume_type in volume_types()
+                   if entry is None or volume_type != entry['volume_type']])
+    if res is None:
+        negative_cache.put(('snapshot', snapshot_id), True)
         raise cherrypy.HTTPError(404, "Snapshot not found")
+    location_index.add_snapshot(snapshot_id, res.type, res.info['volume_id'])
+    return _cache('snapshot', snapshot_id, res)
+
+
+def _cache(kind, resource_id, res):
+    lookup_cache.put((kind, resource_id), res, res.type)
+    return res
+
+
+def _invalidate(kind, resource_id):
+    lookup_cache.invalidate((kind, resource_id))
+    negative_cache.invalidate((kind, resource_id))
+
+
+def _collect_metrics():
+    gates = executor.admission_stats()
+    yield ('quarry_backend_operations_running', 'gauge',
+           "Operations holding a slot on each volume type",
+           [(dict(volume_type=vt), s['running']) for vt, s in gates.items()])
+    yield ('quarry_backend_queue_depth', 'gauge',
+           "Operations waiting for a slot on each volume type",
+           [(dict(volume_type=vt, lane='fast'), s['waiting_fast'])
+            for vt, s in gates.items()] +
+           [(dict(volume_type=vt, lane='slow'),
+             s['waiting'] - s['waiting_fast']) for vt, s in gates.items()])
+    yield ('quarry_backend_wait_seconds_total', 'counter',
+           "Time operations spent waiting for a slot",
+           [(dict(volume_type=vt), s['wait_time'])
+            for vt, s in gates.items()])
+    yield ('quarry_backend_slots_taken_total', 'counter',
+           "Slots taken on each volume type",
+           [(dict(volume_type=vt), s['waited']) for vt, s in gates.items()])
+    depths = executor.queue_depths()
+    depths['jobs'] = job_manager.qsize()
+    if search_pool is not None:
+        depths[search_pool.name] = search_pool.qsize()
+    yield ('quarry_worker_queue_depth', 'gauge',
+           "Calls waiting for a worker in each pool",
+           [(dict(pool=name), depth) for name, depth in depths.items()])
+    caches = dict(lookup=lookup_cache.stats(),
+                  negative=negative_cache.stats())
+    for stat, kind in (('hits', 'counter'), ('misses', 'counter'),
+                       ('evictions', 'counter'), ('size', 'gauge')):
+        name = 'quarry_cache_%s' % stat
+        if kind == 'counter':
+            name += '_total'
+        yield (name, kind, "Lookup cache %s" % stat,
+               [(dict(cache=c), s[stat]) for c, s in caches.items()])
+
+
+def _start_request_trace():
+    # Clients may pass in the trace to join as a 32 hex digit X-Trace-Id
+    request = cherrypy.request
+    span = tracing.begin('%s %s' % (request.method, request.path_info),
+                         trace_id=request.headers.get('X-Trace-Id',
+                                                      '').lower(),
+                         kind=tracing.KIND_SERVER)
+    if span is None:
+        return
+    cherrypy.response.headers['X-Trace-Id'] = span.trace_id
+    request.hooks.attach('on_end_request', _end_request_trace, span=span)
+
+
+def _end_request_trace(span):
+    status = str(cherrypy.response.status).split()[0]
+    span.attributes['http.status_code'] = status
+    tracing.end(span, status if status.startswith('5') else None)
+
+
+cherrypy.tools.quarry_trace = cherrypy.Tool('on_start_resource',
+                                            _start_request_trace)
+
+
+# Polling these must not use up the profiles armed for API requests
+UNPROFILED_PATHS = ('/metrics', '/admin/')
+
+
+def _start_request_profile():
+    if not profiling.enabled():
+        return
+    request = cherrypy.request
+    if (request.headers.get('X-Quarry-Profile', '').lower() not in
+            ('1', 'true', 'yes') and
+            (request.path_info.startswith(UNPROFILED_PATHS) or
+             not profiling.take_request())):
+        return
+    request_id = profiling.new_id()
+    cherrypy.response.headers['X-Quarry-Profile-Id'] = request_id
+    profiler = profiling.begin(request_id)
+    request.hooks.attach('on_end_request', profiling.end,
+                         request_id=request_id, profiler=profiler,
+                         label='server')
+
+
+# After tracing so that its work is not part of the profile
+cherrypy.tools.quarry_profile = cherrypy.Tool('on_start_resource',
+                                              _start_request_profile,
+                                              priority=60)
+
+
+def _error_response():
+    exc = sys.exc_info()[1]
+    if isinstance(exc, utils.Overloaded):
+        cherrypy.HTTPError(503, str(exc)).set_response()
+        cherrypy.response.headers['Retry-After'] = str(exc.retry_after)
+    else:
+        cherrypy.HTTPError(500).set_response()
 
 
 dispatcher = None
@@ -270,18 +969,30 @@ dispatcher = None
 def setup_routes():
     d = cherrypy.dispatch.RoutesDispatcher()
     d.connect('api', '/v2/', controller=V2Controller(), action='index')
+    d.connect('metrics', '/metrics', controller=MetricsController(),
+              action='index')
+    d.connect('profile', '/admin/profile', controller=ProfileController(),
+              action='index')
     d.connect('volume_types', '/:api_ver/:tenant_id/types',
               controller=VolumeTypesController(), action='index')
     d.connect('limits', '/:api_ver/:tenant_id/limits',
               controller=LimitsController(), action='index')
     d.connect('volume_collection', '/:api_ver/:tenant_id/volumes',
               controller=VolumeController(), action='collection')
+    d.connect('volume_detail', '/:api_ver/:tenant_id/volumes/detail',
+              controller=VolumeController(), action='detail')
+    d.connect('volume_bulk_action', '/:api_ver/:tenant_id/volumes/action',
+              controller=VolumeController(), action='bulk_action')
     d.connect('volume_resource', '/:api_ver/:tenant_id/volumes/:volume_id',
               controller=VolumeController(), action='resource')
     d.connect('volume_action', '/:api_ver/:tenant_id/volumes/:volume_id/action',
               controller=VolumeController(), action='action')
     d.connect('snap_collection', '/:api_ver/:tenant_id/snapshots',
               controller=SnapshotController(), action='collection')
+    d.connect('snap_detail', '/:api_ver/:tenant_id/snapshots/detail',
+              controller=SnapshotController(), action='detail')
+    d.connect('snap_bulk_action', '/:api_ver/:tenant_id/snapshots/action',
+              controller=SnapshotController(), action='bulk_action')
     d.connect('snap_resource', '/:api_ver/:tenant_id/snapshots/:snapshot_id',
               controller=SnapshotController(), action='resource')
     dispatcher = d
@@ -291,10 +1002,65 @@ def setup_routes():
 dispatcher_conf = {
     '/': {
         'request.dispatch': setup_routes(),
+        'request.error_response': _error_response,
+        'tools.quarry_trace.on': True,
+        'tools.quarry_profile.on': True,
     }
 }
 
 
+def setup(conf):
+    global location_index, lookup_cache, negative_cache, inventory_cache
+    global job_manager, search_pool, executor
+    tracing.configure(conf.get('trace_file'))
+    profiling.configure(conf.get('profile_dir'))
+    executor = execution.Executor(
+        direct_execution=conf.get('direct_execution', False),
+        direct_workers=conf.get('direct_workers', 8),
+        ansible_workers=conf.get('ansible_workers', 0),
+        stream_playbooks=conf.get('stream_playbooks', False),
+        static_playbooks=conf.get('static_playbooks', False),
+        fast_playbooks=conf.get('fast_playbooks', False),
+        batch_window=conf.get('batch_window_ms', 0) / 1000.0,
+        batch_size=conf.get('batch_size', 50),
+        batch_workers=conf.get('batch_workers', 4),
+        single_flight=conf.get('single_flight', True),
+        concurrency=conf.get('backend_concurrency', 0),
+        concurrency_limits=conf.get('backend_concurrency_limits'),
+        queue_size=conf.get('backend_queue_size', 0),
+        fast_workers=conf.get('fast_lane_workers', 0),
+        fast_slots=conf.get('fast_lane_slots', 0))
+    if executor.fast_playbooks:
+        for volume_type in conf['volume_types']:
+            config.validate_backend_vars(volume_type)
+    # Stop the executor after the pools that feed it work
+    cherrypy.engine.subscribe('stop', executor.stop, priority=60)
+    location_index = locations.LocationIndex(
+        conf.get('location_index', locations.DEFAULT_PATH))
+    lookup_cache = cache.TTLCache(conf.get('lookup_cache_size', 1024),
+                                  conf.get('lookup_cache_ttl', 5),
+                                  conf.get('lookup_cache_ttls'))
+    negative_cache = cache.TTLCache(conf.get('negative_cache_size', 4096),
+                                    conf.get('negative_cache_ttl', 5))
+    inventory_cache = inventory.Inventory(executor,
+                                          conf.get('inventory_max_age', 60))
+    cherrypy.engine.subscribe('stop', inventory_cache.stop)
+    job_manager = jobs.JobManager(conf.get('job_workers', 4),
+                                  conf.get('job_retention', 3600))
+    cherrypy.engine.subscribe('stop', job_manager.stop)
+    if conf.get('reconcile_interval', 0) > 0:
+        reconciler = reconcile.Reconciler(
+            inventory_cache, location_index, conf['volume_types'],
+            conf['reconcile_interval'], conf.get('reconcile_intervals'),
+            conf.get('reconcile_jitter', 0.1), _invalidate)
+        cherrypy.engine.subscribe('start', reconciler.start)
+        cherrypy.engine.subscribe('stop', reconciler.stop)
+    if conf.get('parallel_search', False):
+        search_pool = pool.WorkerPool('search', conf.get('search_workers', 8))
+        cherrypy.engine.subscribe('stop', search_pool.stop)
+    metrics.add_collector(_collect_metrics)
+
+
 def start():
     logging.basicConfig(level=logging.DEBUG)
     parser = argparse.ArgumentParser()
@@ -304,6 +1070,7 @@ def start():
     cherrypy.config.update(args.config)
     app = cherrypy.tree.mount(None, config=args.config)
     app.config.update(dispatcher_conf)
+    setup(app.config['global'])
     cherrypy.quickstart(app)
 
 
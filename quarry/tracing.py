@@ -0,0 +1,203 @@
+#
+#  Copyright 2017 Red Hat, Inc. and/or its affiliates.
+#
+# Licensed to you under the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.  See the files README and
+# LICENSE_GPL_v2 which accompany this distribution.
+#
+
+# Timed spans of the work done for each request, appended to a local trace
+# file as OTLP JSON (one ExportTraceServiceRequest per line).  The current
+# span is kept per thread and WorkerPool carries it over to its workers, so
+# spans started anywhere below a request end up in that request's trace.
+# Nothing is recorded until configure() is given a trace file.
+
+from contextlib import contextmanager
+import binascii
+import json
+import logging
+import os
+import re
+import threading
+import time
+
+SERVICE_NAME = 'quarry'
+
+# OTLP span kinds and status codes
+KIND_INTERNAL = 1
+KIND_SERVER = 2
+STATUS_ERROR = 2
+
+log = logging.getLogger('tracing')
+
+_path = None
+_write_lock = threading.Lock()
+_local = threading.local()
+
+
+class Span(object):
+
+    def __init__(self, name, trace_id, parent_id=None, kind=KIND_INTERNAL,
+                 attributes=None, start=None):
+        self.name = name
+        self.trace_id = trace_id
+        self.span_id = _new_id(8)
+        self.parent_id = parent_id
+        self.kind = kind
+        self.attributes = attributes or {}
+        self.start = time.time() if start is None else start
+        self.end = None
+        self.error = None
+
+    def to_dict(self):
+        span = dict(traceId=self.trace_id, spanId=self.span_id,
+                    name=self.name, kind=self.kind,
+                    startTimeUnixNano=str(int(self.start * 1e9)),
+                    endTimeUnixNano=str(int(self.end * 1e9)),
+                    attributes=_attributes(self.attributes))
+        if self.parent_id:
+            span['parentSpanId'] = self.parent_id
+        if self.error is not None:
+            span['status'] = dict(code=STATUS_ERROR, message=self.error)
+        return span
+
+
+def configure(path):
+    global _path
+    _path = path or None
+
+
+def enabled():
+    return _path is not None
+
+
+def current():
+    stack = getattr(_local, 'stack', None)
+    return stack[-1] if stack else None
+
+
+def context():
+    """Return what a child process needs to join the current trace."""
+    span = current()
+    if span is None:
+        return None
+    return dict(trace_id=span.trace_id, span_id=span.span_id)
+
+
+def begin(name, trace_id=None, kind=KIND_INTERNAL, **attrs):
+    """
+    Start a span as a child of the current one, or as the root of a new
+    trace (`trace_id` if it is a valid one), and make it the current span.
+    """
+    if _path is None:
+        return None
+    parent = current()
+    if parent is not None:
+        span = Span(name, parent.trace_id, parent.span_id, kind, attrs)
+    else:
+        if not trace_id or not re.match('^[0-9a-f]{32}$', trace_id):
+            trace_id = _new_id(16)
+        span = Span(name, trace_id, kind=kind, attributes=attrs)
+    _local.stack = getattr(_local, 'stack', []) + [span]
+    return span
+
+
+def end(span, error=None):
+    if span is None:
+        return
+    span.end = time.time()
+    if error is not None:
+        span.error = str(error)
+    stack = getattr(_local, 'stack', [])
+    if span in stack:
+        _local.stack = stack[:stack.index(span)]
+    export([span.to_dict()])
+
+
+@contextmanager
+def span(name, **attrs):
+    s = begin(name, **attrs)
+    try:
+        yield s
+    except Exception as e:
+        end(s, e)
+        raise
+    else:
+        end(s)
+
+
+def record(name, start, **attrs):
+    """Add a span which started at `start` and ends now."""
+    parent = current()
+    if parent is None:
+        return
+    s = Span(name, parent.trace_id, parent.span_id, attributes=attrs,
+             start=start)
+    s.end = time.time()
+    export([s.to_dict()])
+
+
+@contextmanager
+def attach(span):
+    """Make `span` (from another thread) the current span."""
+    saved = getattr(_local, 'stack', [])
+    _local.stack = [span] if span is not None else []
+    try:
+        yield
+    finally:
+        _local.stack = saved
+
+
+def export(spans):
+    if _path is None or not spans:
+        return
+    request = dict(resourceSpans=[dict(
+        resource=dict(attributes=_attributes({'service.name':
+                                              SERVICE_NAME})),
+        scopeSpans=[dict(scope=dict(name=SERVICE_NAME), spans=spans)])])
+    line = json.dumps(request, separators=(',', ':')) + '\n'
+    try:
+        with _write_lock:
+            with open(_path, 'a') as f:
+                f.write(line)
+    except IOError:
+        log.exception("Failed to write spans to %s", _path)
+
+
+def _attributes(attrs):
+    result = []
+    for key, value in sorted(attrs.items()):
+        if value is None:
+            continue
+        if isinstance(value, bool):
+            value = dict(boolValue=value)
+        elif isinstance(value, int):
+            value = dict(intValue=str(value))
+        elif isinstance(value, float):
+            value = dict(doubleValue=value)
+        else:
+            value = dict(stringValue=str(value))
+        result.append(dict(key=key, value=value))
+    return result
+
+
+class TracedCaller(object):
+    """A caller whose runs are recorded as spans."""
+
+    def __init__(self, caller):
+        self.caller = caller
+        self.volume_type = caller.volume_type
+        self.operation = caller.operation
+        self.params = caller.params
+
+    def run(self):
+        with span(self.operation, volume_type=self.volume_type):
+            return self.caller.run()
+
+    def cancel(self):
+        self.caller.cancel()
+
+
+def _new_id(size):
+    return binascii.hexlify(os.urandom(size)).decode('ascii')
@@ -29,10 +29,42 @@ class AnsibleError(QuarryError):
                                            (rc, out, err))
 
 
+class DriverError(QuarryError):
+    def __init__(self, volume_type, operation, error):
+        super(DriverError, self).__init__("Driver %s on %s failed: %s" %
+                                          (operation, volume_type, error))
+
+
+class BatchItemError(QuarryError):
+    def __init__(self, volume_type, operation, item, msg):
+        super(BatchItemError, self).__init__("%s of %s on %s failed: %s" %
+                                             (operation, item, volume_type,
+                                              msg))
+        self.item = item
+
+
 class ConfigurationError(QuarryError):
     pass
 
 
+class Timeout(QuarryError):
+    pass
+
+
+class Cancelled(QuarryError):
+    pass
+
+
+class WorkerError(QuarryError):
+    pass
+
+
+class Overloaded(QuarryError):
+    def __init__(self, msg, retry_after):
+        super(Overloaded, self).__init__(msg)
+        self.retry_after = retry_after
+
+
 @contextmanager
 def temp_file():
     fd, src = tempfile.mkstemp()
@@ -25,6 +25,12 @@ options:
       - A dictionary of backend-specific configuration parameters.  See the
         backend documentation for more information.
     required: false
+  trace:
+    description:
+      - The trace_id and span_id of the quarry server request this task is
+        run for.  When set, the time spent in the module and in backend calls
+        is returned as trace spans in quarry_spans.
+    required: false
 '''
 
 EXAMPLES = '''
@@ -34,22 +40,16 @@ EXAMPLES = '''
 import logging
 
 from ansible.module_utils.basic import AnsibleModule
-from ansible.module_utils import quarry_common
+from ansible.module_utils import quarry_ops, quarry_profile, quarry_trace
 from ansible.module_utils.quarry_backends import backends
 
 
-def _get_connector(mod):
-    connector = dict()
-    for param in ('initiator',):
-        if param in mod.params:
-            connector[param] = mod.params[param]
-    return connector
-
 def main():
     mod = AnsibleModule(
         argument_spec=dict(
             backend=dict(required=True, choices=backends.keys()),
             config=dict(required=False, type='dict', default={}),
+            trace=dict(required=False, type='dict'),
             state=dict(required=False, choices=['present', 'absent'],
                        default='present'),
             volume_id=dict(required=True, type='str'),
@@ -60,20 +60,17 @@ def main():
     file = config.get('log', '/dev/null')
     logging.basicConfig(filename=file, level=logging.DEBUG)
 
-    volume = quarry_common.Volume(mod.params['volume_id'])
-    result = dict(changed=True, volume_id=mod.params['volume_id'])
-
-    backend_type = backends[mod.params['backend']]
-    driver = backend_type(config)
-    driver.do_setup(None)
+    quarry_trace.start(mod.params['trace'], 'module quarry_connection')
+    profiler = quarry_profile.Profiler()
+    with profiler:
+        backend_type = backends[mod.params['backend']]
+        driver = backend_type(config)
+        with quarry_trace.span('driver.do_setup'):
+            driver.do_setup(None)
+        driver = quarry_trace.traced(driver)
 
-    connector = _get_connector(mod)
-    if mod.params['state'] == 'present':
-        ret = driver.initialize_connection(volume, connector)
-        result['connection_info'] = ret
-    elif mod.params['state'] == 'absent':
-        driver.terminate_connection(volume, connector)
-    mod.exit_json(**result)
+        result = quarry_ops.connection(driver, mod.params)
+    mod.exit_json(**profiler.finish(quarry_trace.finish(result)))
 
 
 if __name__ == '__main__':
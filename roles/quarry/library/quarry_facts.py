@@ -0,0 +1,81 @@
+#!/usr/bin/python
+#
+#  Copyright 2017 Red Hat, Inc. and/or its affiliates.
+#
+# Licensed to you under the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.  See the files README and
+# LICENSE_GPL_v2 which accompany this distribution.
+#
+
+
+DOCUMENTATION = '''
+---
+module: quarry_facts
+author: "Adam Litke (@aglitke)"
+version_added: "2.0"
+short_description: Quarry Backend Inventory
+options:
+  backend:
+    description:
+      - The backend storage driver to use for the requested operation
+    required: true
+  config:
+    description:
+      - A dictionary of backend-specific configuration parameters.  See the
+        backend documentation for more information.
+    required: false
+  trace:
+    description:
+      - The trace_id and span_id of the quarry server request this task is
+        run for.  When set, the time spent in the module and in backend calls
+        is returned as trace spans in quarry_spans.
+    required: false
+  gather:
+    description:
+      - What to list: volumes, snapshots or both.  Volumes are reported in
+        the quarry_volumes fact (id, size and parent) and snapshots in
+        quarry_snapshots (id and volume_id).
+    required: false
+'''
+
+EXAMPLES = '''
+
+'''
+
+import logging
+
+from ansible.module_utils.basic import AnsibleModule
+from ansible.module_utils import quarry_ops, quarry_profile, quarry_trace
+from ansible.module_utils.quarry_backends import backends
+
+
+def main():
+    mod = AnsibleModule(
+        argument_spec=dict(
+            backend=dict(required=True, choices=backends.keys()),
+            config=dict(required=False, type='dict', default={}),
+            trace=dict(required=False, type='dict'),
+            gather=dict(required=False, type='list',
+                        default=['volumes', 'snapshots'])),
+        supports_check_mode=True)
+
+    config = mod.params['config']
+    file = config.get('log', '/dev/null')
+    logging.basicConfig(filename=file, level=logging.DEBUG)
+
+    quarry_trace.start(mod.params['trace'], 'module quarry_facts')
+    profiler = quarry_profile.Profiler()
+    with profiler:
+        backend_type = backends[mod.params['backend']]
+        driver = backend_type(config)
+        with quarry_trace.span('driver.do_setup'):
+            driver.do_setup(None)
+        driver = quarry_trace.traced(driver)
+
+        result = quarry_ops.facts(driver, mod.params)
+    mod.exit_json(**profiler.finish(quarry_trace.finish(result)))
+
+
+if __name__ == '__main__':
+    main()
@@ -25,6 +25,17 @@ options:
       - A dictionary of backend-specific configuration parameters.  See the
         backend documentation for more information.
     required: false
+  trace:
+    description:
+      - The trace_id and span_id of the quarry server request this task is
+        run for.  When set, the time spent in the module and in backend calls
+        is returned as trace spans in quarry_spans.
+    required: false
+  items:
+    description:
+      - A list of volumes to process in one go instead of a single id.  Each
+        item takes the same id, size and state options as the module.
+    required: false
 '''
 
 EXAMPLES = '''
@@ -34,7 +45,7 @@ EXAMPLES = '''
 import logging
 
 from ansible.module_utils.basic import AnsibleModule
-from ansible.module_utils import quarry_common
+from ansible.module_utils import quarry_ops, quarry_profile, quarry_trace
 from ansible.module_utils.quarry_backends import backends
 
 
@@ -43,39 +54,49 @@ def main():
         argument_spec=dict(
             backend=dict(required=True, choices=backends.keys()),
             config=dict(required=False, type='dict', default={}),
+            trace=dict(required=False, type='dict'),
             state=dict(required=False, choices=['present', 'absent'],
                        default='present'),
-            id=dict(required=True, type='str'),
+            id=dict(required=False, type='str'),
+            items=dict(required=False, type='list'),
             size=dict(required=False, type='int')),
+        required_one_of=[['id', 'items']],
+        mutually_exclusive=[['id', 'items']],
         supports_check_mode=True)
 
     config = mod.params['config']
     file = config.get('log', '/dev/null')
     logging.basicConfig(filename=file, level=logging.DEBUG)
 
-    volume = quarry_common.Volume(mod.params['id'], mod.params.get('size'))
-    result = dict(changed=False, id=volume.id, size=None)
-
-    backend_type = backends[mod.params['backend']]
-    driver = backend_type(config)
-    driver.do_setup(None)
-    found_volume = driver.get_volume(volume)
-    state = result['state'] = 'present' if found_volume else 'absent'
-    if mod.check_mode:
-        if found_volume:
-            result['size'] = found_volume.size
-        mod.exit_json(**result)
-
-    logging.debug("Volume %s is %s", volume.id, state)
-
-    target_state = mod.params['state']
-    if state == 'absent' and target_state == 'present':
-        driver.create_volume(volume)
-        result.update(dict(changed=True, size=volume.size, state='present'))
-    elif state == 'present' and target_state == 'absent':
-        driver.delete_volume(volume)
-        result.update(dict(changed=True, state='absent'))
-
+    quarry_trace.start(mod.params['trace'], 'module quarry_volume')
+    profiler = quarry_profile.Profiler()
+    with profiler:
+        backend_type = backends[mod.params['backend']]
+        driver = backend_type(config)
+        with quarry_trace.span('driver.do_setup'):
+            driver.do_setup(None)
+        driver = quarry_trace.traced(driver)
+
+        if mod.params['items'] is None:
+            result = quarry_ops.volume(driver, mod.params, mod.check_mode)
+        else:
+            # The driver (and its connection to the backend) is shared by
+            # all items
+            items = []
+            for item in mod.params['items']:
+                items.append(dict(state=mod.params['state']))
+                items[-1].update(item)
+            results = quarry_ops.batch(quarry_ops.volume, driver, items,
+                                       mod.check_mode)
+            result = dict(changed=any(r['changed'] for r in results),
+                          results=results)
+    result = profiler.finish(quarry_trace.finish(result))
+
+    failed = [str(r['id']) for r in result.get('results', [])
+              if r.get('failed')]
+    if failed:
+        mod.fail_json(msg="Failed to process volumes %s" % ', '.join(failed),
+                      **result)
     mod.exit_json(**result)
 
 
@@ -8,6 +8,7 @@
 #
 # Copyright 2013 OpenStack Foundation
 
+import contextlib
 import functools
 import logging
 import random
@@ -29,6 +30,14 @@ class Driver(object):
     def do_setup(self, context):
         pass
 
+    @contextlib.contextmanager
+    def session(self):
+        """
+        Keep the connection to the backend open for the calls made in this
+        context.  Drivers which connect on every call override this.
+        """
+        yield
+
     def get_volume(self, volume):
         raise OperationNotSupported()
 
@@ -53,6 +62,14 @@ class Driver(object):
     def terminate_connection(self, volume, connector):
         raise OperationNotSupported()
 
+    def list_volumes(self):
+        """Return a Volume (with size and parent set) for every volume."""
+        raise OperationNotSupported()
+
+    def list_snapshots(self):
+        """Return a Snapshot for every snapshot."""
+        raise OperationNotSupported()
+
 
 class DictIface(object):
     def __getitem__(self, item):
@@ -69,10 +86,12 @@ class DictIface(object):
 
 
 class Volume(DictIface):
-    def __init__(self, id, size=None):
+    def __init__(self, id, size=None, parent=None):
         self.id = id
         self.name = 'volume-%s' % id
         self.size = size
+        # The id of the volume or snapshot this volume was cloned from
+        self.parent = parent
         self.volume_type = None  # TODO: Implement
         self.encryption_key_id = None
 
@@ -90,6 +109,16 @@ class Snapshot(DictIface):
             self.volume_id = volume_name.split('volume-')[1]
 
 
+def id_from_name(name, prefix):
+    """
+    Return the id from a backend object name such as volume-<id>, or None if
+    the name does not belong to a quarry object of that kind.
+    """
+    if name.startswith(prefix) and len(name) > len(prefix):
+        return name[len(prefix):]
+    return None
+
+
 class OperationNotSupported(Exception):
     pass
 
@@ -42,6 +42,21 @@ class Driver(quarry_common.Driver):
                 return quarry_common.Volume(volume.id, size=size)
         return None
 
+    def list_volumes(self):
+        volumes = []
+        for v in self._driver.volumes(self.vserver, self.pool):
+            volume_id = quarry_common.id_from_name(v['blockdevice_id'],
+                                                   'volume-')
+            if volume_id is None:
+                continue
+            size = int(math.ceil(float(v['size']) / quarry_common.GB))
+            volumes.append(quarry_common.Volume(volume_id, size=size))
+        return volumes
+
+    def list_snapshots(self):
+        # Snapshots are not supported so there are never any
+        return []
+
     def create_volume(self, volume):
         size = volume.size * quarry_common.GB
         self._driver.create_volume(self.pool, volume.name, size)
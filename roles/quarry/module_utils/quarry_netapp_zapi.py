@@ -27,6 +27,7 @@ import six
 from six.moves import urllib
 
 from ansible.module_utils import quarry_netapp_zapi_errors as ZapiError
+from ansible.module_utils import quarry_trace
 from ansible.module_utils.quarry_netapp_exceptions import NetAppLibException
 from ansible.module_utils.quarry_netapp_i18n import _
 
@@ -222,17 +223,20 @@ class NaServer(object):
         if not hasattr(self, '_opener') or not self._opener \
                 or self._refresh_conn:
             self._build_opener()
-        try:
-            if hasattr(self, '_timeout'):
-                response = self._opener.open(request, timeout=self._timeout)
-            else:
-                response = self._opener.open(request)
-        except urllib.error.HTTPError as e:
-            raise NaApiError(e.code, e.msg)
-        except Exception as e:
-            raise NaApiError('Unexpected error', e.message)
+        with quarry_trace.span('netapp.invoke_elem',
+                               api=na_element.get_name()):
+            try:
+                if hasattr(self, '_timeout'):
+                    response = self._opener.open(request,
+                                                 timeout=self._timeout)
+                else:
+                    response = self._opener.open(request)
+            except urllib.error.HTTPError as e:
+                raise NaApiError(e.code, e.msg)
+            except Exception as e:
+                raise NaApiError('Unexpected error', e.message)
 
-        response_xml = response.read()
+            response_xml = response.read()
         response_element = self._get_result(response_xml)
 
         if self._trace:
@@ -59,6 +59,22 @@ class Driver(quarry_common.Driver):
         with self.mounted():
             os.unlink(vol_file)
 
+    def list_volumes(self):
+        volumes = []
+        with self.mounted():
+            for name in os.listdir(self.mountpoint):
+                volume_id = quarry_common.id_from_name(name, 'volume-')
+                if volume_id is None:
+                    continue
+                size = (os.stat(os.path.join(self.mountpoint, name)).st_size /
+                        quarry_common.GB)
+                volumes.append(quarry_common.Volume(volume_id, size))
+        return volumes
+
+    def list_snapshots(self):
+        # Snapshots are not supported so there are never any
+        return []
+
     def get_snapshot(self, snapshot):
         raise quarry_common.OperationNotSupported()
 
@@ -0,0 +1,121 @@
+#
+#  Copyright 2017 Red Hat, Inc. and/or its affiliates.
+#
+# Licensed to you under the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.  See the files README and
+# LICENSE_GPL_v2 which accompany this distribution.
+#
+# The logic behind the quarry modules.  It is kept separate from the
+# AnsibleModule plumbing so that the quarry server can drive a backend
+# directly and get back exactly what the module would have returned.
+#
+
+import logging
+
+from ansible.module_utils import quarry_common
+
+
+def volume(driver, params, check_mode=False):
+    volume = quarry_common.Volume(params['id'], params.get('size'))
+    result = dict(changed=False, id=volume.id, size=None)
+
+    found_volume = driver.get_volume(volume)
+    state = result['state'] = 'present' if found_volume else 'absent'
+    if check_mode:
+        if found_volume:
+            result['size'] = found_volume.size
+        return result
+
+    logging.debug("Volume %s is %s", volume.id, state)
+
+    target_state = params.get('state', 'present')
+    if state == 'absent' and target_state == 'present':
+        driver.create_volume(volume)
+        result.update(dict(changed=True, size=volume.size, state='present'))
+    elif state == 'present' and target_state == 'absent':
+        driver.delete_volume(volume)
+        result.update(dict(changed=True, state='absent'))
+    return result
+
+
+def snapshot(driver, params, check_mode=False):
+    snapshot = quarry_common.Snapshot(params['id'],
+                                      volume_id=params.get('volume_id'))
+    result = dict(changed=False, id=snapshot.id)
+
+    # The driver will look up the associated volume
+    found_snapshot = driver.get_snapshot(snapshot)
+    state = result['state'] = 'present' if found_snapshot else 'absent'
+    logging.debug("Snapshot %s is %s", snapshot.id, state)
+    if check_mode:
+        if found_snapshot:
+            result['volume_id'] = found_snapshot.volume_id
+        return result
+
+    target_state = params.get('state', 'present')
+    if state == 'absent' and target_state == 'present':
+        driver.create_snapshot(snapshot)
+        result.update(dict(changed=True, id=snapshot.id,
+                           volume_id=snapshot.volume_id,
+                           state='present'))
+    elif state == 'present' and target_state == 'absent':
+        # We use found_snapshot because the driver needs the volume_id
+        driver.delete_snapshot(found_snapshot)
+        result.update(dict(changed=True, state='absent'))
+    return result
+
+
+def facts(driver, params):
+    """Report every volume and snapshot held by the backend."""
+    gather = params.get('gather') or ['volumes', 'snapshots']
+    result = dict()
+    if 'volumes' in gather:
+        result['quarry_volumes'] = [
+            dict(id=v.id, size=v.size, parent=v.parent)
+            for v in driver.list_volumes()]
+    if 'snapshots' in gather:
+        result['quarry_snapshots'] = [
+            dict(id=s.id, volume_id=s.volume_id)
+            for s in driver.list_snapshots()]
+    return dict(changed=False, ansible_facts=result)
+
+
+def batch(func, driver, items, check_mode=False):
+    """
+    Run func for each item with the same driver and return a list of the
+    results.  The driver's connection is held for the whole batch.  A failing
+    item is reported in its result and does not stop the rest of the batch.
+    """
+    results = []
+    with driver.session():
+        for item in items:
+            try:
+                result = func(driver, item, check_mode=check_mode)
+            except Exception as e:
+                logging.exception("Failed to process %s", item)
+                result = dict(changed=False, failed=True, id=item.get('id'),
+                              msg=str(e))
+            results.append(result)
+    return results
+
+
+def _get_connector(params):
+    connector = dict()
+    for param in ('initiator',):
+        if param in params:
+            connector[param] = params[param]
+    return connector
+
+
+def connection(driver, params):
+    volume = quarry_common.Volume(params['volume_id'])
+    result = dict(changed=True, volume_id=params['volume_id'])
+
+    connector = _get_connector(params)
+    if params.get('state', 'present') == 'present':
+        ret = driver.initialize_connection(volume, connector)
+        result['connection_info'] = ret
+    elif params['state'] == 'absent':
+        driver.terminate_connection(volume, connector)
+    return result
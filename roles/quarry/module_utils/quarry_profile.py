@@ -0,0 +1,46 @@
+#
+#  Copyright 2017 Red Hat, Inc. and/or its affiliates.
+#
+# Licensed to you under the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.  See the files README and
+# LICENSE_GPL_v2 which accompany this distribution.
+#
+# Profiling of the driver portion of a quarry module.  The quarry server
+# sets QUARRY_PROFILE to the id of the request it is profiling in the task
+# environment and the module hands the pstats data back, base64 encoded, in
+# the quarry_profile key of its result for the server to write out.
+#
+
+import base64
+import cProfile
+import marshal
+import os
+
+
+class Profiler(object):
+
+    def __init__(self):
+        self.request_id = os.environ.get('QUARRY_PROFILE') or None
+        self._profile = None
+        if self.request_id is not None:
+            self._profile = cProfile.Profile()
+
+    def __enter__(self):
+        if self._profile is not None:
+            self._profile.enable()
+        return self
+
+    def __exit__(self, *exc_info):
+        if self._profile is not None:
+            self._profile.disable()
+
+    def finish(self, result):
+        if self._profile is not None:
+            # This is what pstats.Stats expects to find in a stats file
+            self._profile.create_stats()
+            data = marshal.dumps(self._profile.stats)
+            result['quarry_profile'] = dict(
+                request_id=self.request_id,
+                pstats=base64.b64encode(data).decode('ascii'))
+        return result
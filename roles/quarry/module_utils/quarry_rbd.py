@@ -9,6 +9,7 @@
 #
 # Copyright 2013 OpenStack Foundation
 
+import contextlib
 import copy
 import json
 import logging
@@ -21,7 +22,7 @@ from six.moves import urllib
 import subprocess
 import tempfile
 
-from ansible.module_utils import quarry_common
+from ansible.module_utils import quarry_common, quarry_trace
 
 
 CONFIG_DEFAULTS = {
@@ -109,6 +110,8 @@ class Driver(quarry_common.Driver):
         self._is_replication_enabled = False
         self._replication_targets = []
         self._target_names = []
+        # RADOS connections held open by session(), keyed by (pool, remote)
+        self._session = None
 
     #
     # New Quarry methods
@@ -132,6 +135,58 @@ class Driver(quarry_common.Driver):
                 except rbd.ImageNotFound:
                     pass
             return None
+
+    def list_volumes(self):
+        volumes = []
+        with RADOSClient(self) as client:
+            for name in self.rbd.RBD().list(client.ioctx):
+                volume_id = quarry_common.id_from_name(name, 'volume-')
+                if volume_id is None or name.endswith('.deleted'):
+                    continue
+                image = self.rbd.Image(client.ioctx, name, read_only=True)
+                try:
+                    size = image.size() / quarry_common.GB
+                    parent = self._get_parent_id(image)
+                finally:
+                    image.close()
+                volumes.append(quarry_common.Volume(volume_id, size=size,
+                                                    parent=parent))
+        return volumes
+
+    def list_snapshots(self):
+        snapshots = []
+        with RADOSClient(self) as client:
+            for name in self.rbd.RBD().list(client.ioctx):
+                if quarry_common.id_from_name(name, 'volume-') is None:
+                    continue
+                image = self.rbd.Image(client.ioctx, name, read_only=True)
+                try:
+                    snaps = list(image.list_snaps())
+                finally:
+                    image.close()
+                # Snapshots outlive their volume, which is then only renamed
+                if name.endswith('.deleted'):
+                    name = name[:-len('.deleted')]
+                for snap in snaps:
+                    snapshot_id = quarry_common.id_from_name(snap['name'],
+                                                             'snapshot-')
+                    if snapshot_id is not None:
+                        snapshots.append(quarry_common.Snapshot(
+                            snapshot_id, volume_name=name))
+        return snapshots
+
+    def _get_parent_id(self, image):
+        try:
+            pool, parent, parent_snap = image.parent_info()
+        except self.rbd.ImageNotFound:
+            return None
+        # Volumes created from a snapshot are cloned from that snapshot while
+        # cloned volumes use a private <volume>.clone_snap of their source.
+        snapshot_id = quarry_common.id_from_name(parent_snap, 'snapshot-')
+        if snapshot_id is not None:
+            return snapshot_id
+        return quarry_common.id_from_name(parent, 'volume-')
+
     #
     # New Quarry methods
     #
@@ -225,7 +280,7 @@ class Driver(quarry_common.Driver):
     @quarry_common.retry(quarry_common.VolumeBackendAPIException,
                          CONFIG_DEFAULTS['rados_connection_interval'],
                          CONFIG_DEFAULTS['rados_connection_retries'])
-    def _connect_to_rados(self, pool=None, remote=None, timeout=None):
+    def _open_rados(self, pool=None, remote=None, timeout=None):
 
         name, conf, user = self._get_config_tuple(remote)
 
@@ -252,8 +307,9 @@ class Driver(quarry_common.Driver):
                 client.conf_set('rados_mon_op_timeout', timeout)
                 client.conf_set('client_mount_timeout', timeout)
 
-            client.connect()
-            ioctx = client.open_ioctx(pool)
+            with quarry_trace.span('rados.connect', cluster=name, pool=pool):
+                client.connect()
+                ioctx = client.open_ioctx(pool)
             return client, ioctx
         except self.rados.Error:
             msg = "Error connecting to ceph cluster."
@@ -261,7 +317,31 @@ class Driver(quarry_common.Driver):
             client.shutdown()
             raise quarry_common.VolumeBackendAPIException(msg)
 
+    @contextlib.contextmanager
+    def session(self):
+        if self._session is not None:
+            yield
+            return
+        self._session = {}
+        try:
+            yield
+        finally:
+            session, self._session = self._session, None
+            for client, ioctx in session.values():
+                self._disconnect_from_rados(client, ioctx)
+
+    def _connect_to_rados(self, pool=None, remote=None, timeout=None):
+        if self._session is None:
+            return self._open_rados(pool, remote, timeout)
+        key = (pool, remote)
+        if key not in self._session:
+            self._session[key] = self._open_rados(pool, remote, timeout)
+        return self._session[key]
+
     def _disconnect_from_rados(self, client, ioctx):
+        if (self._session is not None and
+                (client, ioctx) in self._session.values()):
+            return  # Closed when the session ends
         # closing an ioctx cannot raise an exception
         ioctx.close()
         client.shutdown()
@@ -0,0 +1,113 @@
+#
+#  Copyright 2017 Red Hat, Inc. and/or its affiliates.
+#
+# Licensed to you under the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.  See the files README and
+# LICENSE_GPL_v2 which accompany this distribution.
+#
+# Spans of the work done by a quarry module for a traced quarry request.
+# The server passes its trace context in the module's trace option and the
+# spans recorded here (in OTLP JSON form) are handed back in the quarry_spans
+# key of the module result for the server to write to its trace file.  When
+# no trace is given nothing is recorded.
+#
+
+from contextlib import contextmanager
+import binascii
+import os
+import threading
+import time
+
+_local = threading.local()
+
+
+def start(trace, name):
+    """Start recording the spans of a module run under `trace`."""
+    _local.trace_id = None
+    if not trace:
+        return
+    _local.trace_id = trace['trace_id']
+    _local.spans = []
+    _local.stack = [trace['span_id']]
+    _local.root = (_new_id(), name, time.time())
+    _local.stack.append(_local.root[0])
+
+
+def active():
+    return getattr(_local, 'trace_id', None) is not None
+
+
+def finish(result, error=None):
+    """Close the module span and add the recorded spans to `result`."""
+    if not active():
+        return result
+    span_id, name, start_time = _local.root
+    _local.spans.append(_span(span_id, _local.stack[0], name, start_time,
+                              {}, error))
+    result['quarry_spans'] = _local.spans
+    _local.trace_id = None
+    return result
+
+
+@contextmanager
+def span(name, **attrs):
+    if not active():
+        yield
+        return
+    parent = _local.stack[-1]
+    span_id = _new_id()
+    _local.stack.append(span_id)
+    start_time = time.time()
+    error = None
+    try:
+        yield
+    except Exception as e:
+        error = e
+        raise
+    finally:
+        _local.stack.pop()
+        if active():
+            _local.spans.append(_span(span_id, parent, name, start_time,
+                                      attrs, error))
+
+
+def traced(driver):
+    """Record every call of a driver method as a span."""
+    if not active():
+        return driver
+    return _TracedDriver(driver)
+
+
+class _TracedDriver(object):
+
+    def __init__(self, driver):
+        self._driver = driver
+
+    def __getattr__(self, name):
+        attr = getattr(self._driver, name)
+        if name.startswith('_') or not callable(attr):
+            return attr
+
+        def call(*args, **kwargs):
+            with span('driver.%s' % name,
+                      driver=type(self._driver).__name__):
+                return attr(*args, **kwargs)
+        return call
+
+
+def _span(span_id, parent_id, name, start_time, attrs, error):
+    span = dict(traceId=_local.trace_id, spanId=span_id,
+                parentSpanId=parent_id, name=name, kind=1,
+                startTimeUnixNano=str(int(start_time * 1e9)),
+                endTimeUnixNano=str(int(time.time() * 1e9)),
+                attributes=[dict(key=k, value=dict(stringValue=str(v)))
+                            for k, v in sorted(attrs.items())
+                            if v is not None])
+    if error is not None:
+        span['status'] = dict(code=2, message=str(error))
+    return span
+
+
+def _new_id():
+    return binascii.hexlify(os.urandom(8)).decode('ascii')
@@ -39,7 +39,7 @@ import requests
 import string
 import six
 
-from ansible.module_utils import quarry_common
+from ansible.module_utils import quarry_common, quarry_trace
 
 
 DEFAULT_PROVISIONING_FACTOR = 20.0
@@ -140,11 +140,13 @@ class XtremIOClient(object):
             logging.debug('data: %s', data)
         logging.debug('%(type)s %(url)s', {'type': method, 'url': url})
         try:
-            response = requests.request(
-                method, url, params=params, data=json.dumps(data),
-                verify=self.verify,
-                auth=(self.configuration['san_login'],
-                      self.configuration['san_password']))
+            with quarry_trace.span('xtremio.req', method=method,
+                                   object_type=object_type):
+                response = requests.request(
+                    method, url, params=params, data=json.dumps(data),
+                    verify=self.verify,
+                    auth=(self.configuration['san_login'],
+                          self.configuration['san_password']))
         except requests.exceptions.RequestException as exc:
             msg = ('Exception: %s') % six.text_type(exc)
             raise quarry_common.VolumeDriverException(msg)
@@ -412,6 +414,32 @@ class Driver(quarry_common.Driver):
         except NotFound:
             return None
 
+    def list_volumes(self):
+        # Snapshots are volumes on the array as well so leave them out
+        snapshots = set(s['name'] for s in self._list('snapshots'))
+        volumes = []
+        for vol_obj in self._list('volumes'):
+            if vol_obj['name'] in snapshots:
+                continue
+            size = int(math.ceil(float(vol_obj['vol-size']) /
+                                 quarry_common.MB))
+            parent = None
+            if vol_obj.get('ancestor-vol-id'):
+                parent = vol_obj['ancestor-vol-id'][XTREMIO_OID_NAME]
+            volumes.append(quarry_common.Volume(vol_obj['name'], size=size,
+                                                parent=parent))
+        return volumes
+
+    def list_snapshots(self):
+        return [quarry_common.Snapshot(snap_obj['name'],
+                                       volume_id=snap_obj[
+                                           'created-from-volume'])
+                for snap_obj in self._list('snapshots')]
+
+    def _list(self, object_type):
+        # One request returns the properties of every object of the type
+        return self.client.req(object_type, data={'full': 1})[object_type]
+
     def _obj_from_result(self, res):
         typ, idx = res['links'][0]['href'].split('/')[-2:]
         return self.client.req(typ, idx=int(idx))['content']
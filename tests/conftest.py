@@ -0,0 +1,14 @@
+#
+#  Copyright 2017 Red Hat, Inc. and/or its affiliates.
+#
+# Licensed to you under the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.  See the files README and
+# LICENSE_GPL_v2 which accompany this distribution.
+#
+
+import os
+import sys
+
+# The server modules import each other as top level modules
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'quarry'))
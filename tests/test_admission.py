@@ -0,0 +1,156 @@
+#
+#  Copyright 2017 Red Hat, Inc. and/or its affiliates.
+#
+# Licensed to you under the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.  See the files README and
+# LICENSE_GPL_v2 which accompany this distribution.
+#
+
+import threading
+import time
+
+import pytest
+
+import admission
+import utils
+
+
+def _wait_for(condition):
+    deadline = time.time() + 5
+    while not condition() and time.time() < deadline:
+        time.sleep(0.001)
+    assert condition()
+
+
+class Waiter(object):
+    """Take a slot on a gate in another thread, recording when it got it."""
+
+    def __init__(self, gate, name, order, fast=False):
+        self.release = threading.Event()
+        self.thread = threading.Thread(target=self._run,
+                                       args=(gate, name, order, fast))
+        self.thread.daemon = True
+        waiting = gate.waiting
+        self.thread.start()
+        # Queue the waiters one at a time so that their order is known
+        _wait_for(lambda: gate.waiting > waiting or name in order)
+
+    def _run(self, gate, name, order, fast):
+        with gate.slot(fast):
+            order.append(name)
+            self.release.wait(5)
+
+    def finish(self):
+        self.release.set()
+        self.thread.join(5)
+
+
+def test_no_limit():
+    gate = admission.Gate('ceph')
+    with gate.slot():
+        with gate.slot():
+            assert gate.stats()['running'] == 2
+    assert gate.stats()['running'] == 0
+
+
+def test_limit_and_fifo_order():
+    gate = admission.Gate('ceph', limit=1)
+    order = []
+    first = Waiter(gate, 'first', order)
+    waiters = [Waiter(gate, i, order) for i in range(3)]
+    assert order == ['first']
+    assert gate.stats()['waiting'] == 3
+    first.finish()
+    for waiter in waiters:
+        waiter.finish()
+    assert order == ['first', 0, 1, 2]
+    stats = gate.stats()
+    assert stats['running'] == 0
+    assert stats['waiting'] == 0
+    assert stats['waited'] == 4
+
+
+def test_overflow_is_refused():
+    gate = admission.Gate('ceph', limit=1, queue_size=2)
+    order = []
+    running = Waiter(gate, 'running', order)
+    gate.check()
+    waiters = [Waiter(gate, i, order) for i in range(2)]
+    with pytest.raises(utils.Overloaded) as e:
+        gate.check()
+    assert e.value.retry_after >= 1
+    running.finish()
+    for waiter in waiters:
+        waiter.finish()
+    gate.check()
+
+
+def test_backlog_is_refused():
+    # Work queued before it reaches the gate counts as waiting
+    gate = admission.Gate('ceph', limit=2, queue_size=3)
+    gate.check(backlog=4)
+    with pytest.raises(utils.Overloaded):
+        gate.check(backlog=5)
+
+
+def test_backlog_without_limit():
+    gate = admission.Gate('ceph', queue_size=1)
+    gate.check(backlog=100)
+
+
+def test_retry_after_follows_wait_time():
+    gate = admission.Gate('ceph', limit=1, queue_size=1)
+    gate.waited = 2
+    gate.wait_time = 20.0
+    assert gate._retry_after() == 10
+
+
+def test_fast_lane_goes_first():
+    gate = admission.Gate('ceph', limit=1)
+    order = []
+    running = Waiter(gate, 'running', order)
+    slow = Waiter(gate, 'slow', order)
+    fast = Waiter(gate, 'fast', order, fast=True)
+    assert gate.stats()['waiting_fast'] == 1
+    running.finish()
+    fast.finish()
+    slow.finish()
+    assert order == ['running', 'fast', 'slow']
+
+
+def test_reserved_slots():
+    gate = admission.Gate('ceph', limit=2, reserved=1)
+    order = []
+    slow = [Waiter(gate, 'slow%i' % i, order) for i in range(2)]
+    # Only one slow operation may run, the other slot is for the fast lane
+    assert order == ['slow0']
+    fast = Waiter(gate, 'fast', order, fast=True)
+    assert order == ['slow0', 'fast']
+    assert gate.stats()['running_slow'] == 1
+    for waiter in [fast] + slow:
+        waiter.finish()
+    assert order == ['slow0', 'fast', 'slow1']
+
+
+def test_reserved_leaves_a_slot_for_slow_operations():
+    gate = admission.Gate('ceph', limit=2, reserved=5)
+    assert gate.reserved == 1
+
+
+def test_queue_size_per_lane():
+    gate = admission.Gate('ceph', limit=1, queue_size=1)
+    order = []
+    running = Waiter(gate, 'running', order)
+    slow = Waiter(gate, 'slow', order)
+    with pytest.raises(utils.Overloaded):
+        gate.check()
+    gate.check(fast=True)
+    for waiter in (running, slow):
+        waiter.finish()
+
+
+def test_fast_operations():
+    assert admission.is_fast('get_volume')
+    assert admission.is_fast('initialize_connection')
+    assert not admission.is_fast('create_volume')
@@ -0,0 +1,124 @@
+#
+#  Copyright 2017 Red Hat, Inc. and/or its affiliates.
+#
+# Licensed to you under the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.  See the files README and
+# LICENSE_GPL_v2 which accompany this distribution.
+#
+
+import os
+import textwrap
+import threading
+import time
+
+import pytest
+
+import ansible_pool
+import utils
+
+# Runs the real worker protocol loop with a runner which does not need
+# Ansible.  The playbook selects what the runner does.
+STUB_WORKER = textwrap.dedent("""
+    import os
+    import sys
+    import time
+
+    sys.path.insert(0, %(quarry_dir)r)
+    import ansible_worker
+
+
+    class StubRunner(object):
+
+        def run(self, volume_type, playbook=None, playbook_file=None,
+                extra_vars=None):
+            print("noise which must not reach the caller")
+            if playbook == 'crash':
+                os._exit(1)
+            if playbook == 'fail':
+                raise RuntimeError("play failed")
+            if playbook == 'hang':
+                time.sleep(60)
+            return dict(rc=0, plays=[], pid=os.getpid(),
+                        volume_type=volume_type, playbook_file=playbook_file,
+                        extra_vars=extra_vars)
+
+
+    ansible_worker.main(StubRunner)
+""")
+
+
+@pytest.fixture
+def stub_worker(tmpdir, monkeypatch):
+    quarry_dir = os.path.dirname(os.path.abspath(ansible_pool.__file__))
+    script = tmpdir.join('stub_worker.py')
+    script.write(STUB_WORKER % dict(quarry_dir=quarry_dir))
+    monkeypatch.setattr(ansible_pool.AnsibleWorker, 'script', str(script))
+
+
+@pytest.fixture
+def workers(stub_worker):
+    workers = ansible_pool.AnsiblePool(1)
+    yield workers
+    workers.stop()
+
+
+def test_request_response(workers):
+    extra_vars = dict(volume_id='vol1', name=u'caf\xe9')
+    with workers.worker() as worker:
+        pid = worker.proc.pid
+        report = worker.call('ceph', playbook='play', extra_vars=extra_vars)
+        assert report == dict(rc=0, plays=[], pid=pid, volume_type='ceph',
+                              playbook_file=None, extra_vars=extra_vars)
+        # Requests are framed one per line so the worker keeps serving
+        report = worker.call('netapp', playbook_file='/playbooks/p.yml')
+        assert report['pid'] == pid
+        assert report['volume_type'] == 'netapp'
+        assert report['playbook_file'] == '/playbooks/p.yml'
+        assert report['extra_vars'] == {}
+
+
+def test_runner_error(workers):
+    with workers.worker() as worker:
+        with pytest.raises(utils.WorkerError) as e:
+            worker.call('ceph', playbook='fail')
+        assert "play failed" in str(e.value)
+        # The worker survives errors raised by the runner
+        assert worker.call('ceph', playbook='play')['rc'] == 0
+
+
+def test_restart_after_crash(workers):
+    with workers.worker() as worker:
+        crashed = worker.proc.pid
+        with pytest.raises(utils.WorkerError):
+            worker.call('ceph', playbook='crash')
+    with workers.worker() as worker:
+        assert worker.alive()
+        assert worker.proc.pid != crashed
+        assert worker.call('ceph', playbook='play')['pid'] == worker.proc.pid
+
+
+def test_kill_running_call(workers):
+    errors = []
+
+    def call():
+        try:
+            worker.call('ceph', playbook='hang')
+        except utils.WorkerError as e:
+            errors.append(e)
+
+    with workers.worker() as worker:
+        killed = worker.proc.pid
+        t = threading.Thread(target=call)
+        t.start()
+        # Wait until the request has been written to the worker
+        time.sleep(0.5)
+        start = time.time()
+        worker.kill()
+        t.join(10)
+        assert not t.is_alive()
+        assert time.time() - start < 10
+        assert len(errors) == 1
+    with workers.worker() as worker:
+        assert worker.proc.pid != killed
+        assert worker.call('ceph', playbook='play')['rc'] == 0
@@ -0,0 +1,110 @@
+#
+#  Copyright 2017 Red Hat, Inc. and/or its affiliates.
+#
+# Licensed to you under the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.  See the files README and
+# LICENSE_GPL_v2 which accompany this distribution.
+#
+
+import pytest
+
+import batching
+import utils
+
+
+class FakeExecutor(object):
+
+    def __init__(self, fail=False):
+        self.fail = fail
+        self.batches = []
+
+    def run_batch(self, volume_type, operation, items, admit=True):
+        self.batches.append((volume_type, operation, items))
+        if self.fail:
+            raise RuntimeError("play failed")
+        return [utils.BatchItemError(volume_type, operation, item['id'],
+                                     "failed") if item.get('fail') else
+                dict(id=item['id']) for item in items]
+
+
+def _batcher(executor, window=60, max_size=3):
+    return batching.Batcher(executor, window, max_size=max_size, workers=1)
+
+
+def test_full_batch_runs_at_once():
+    executor = FakeExecutor()
+    batcher = _batcher(executor)
+    try:
+        futures = [batcher.submit('ceph', 'get_volume', dict(id=i))
+                   for i in range(3)]
+        assert [f.result(timeout=5) for f in futures] == [
+            dict(id=0), dict(id=1), dict(id=2)]
+        assert len(executor.batches) == 1
+    finally:
+        batcher.stop()
+
+
+def test_window_closes_batch():
+    executor = FakeExecutor()
+    batcher = _batcher(executor, window=0.01)
+    try:
+        future = batcher.submit('ceph', 'get_volume', dict(id=1))
+        assert future.result(timeout=5) == dict(id=1)
+    finally:
+        batcher.stop()
+
+
+def test_batches_per_type_and_operation():
+    executor = FakeExecutor()
+    batcher = _batcher(executor)
+    batcher.submit('ceph', 'get_volume', dict(id=1))
+    batcher.submit('ceph', 'delete_volume', dict(id=2))
+    batcher.submit('netapp', 'get_volume', dict(id=3))
+    batcher.stop()
+    assert sorted((vt, op, len(items))
+                  for vt, op, items in executor.batches) == [
+        ('ceph', 'delete_volume', 1), ('ceph', 'get_volume', 1),
+        ('netapp', 'get_volume', 1)]
+
+
+def test_item_failure():
+    batcher = _batcher(FakeExecutor())
+    try:
+        futures = [batcher.submit('ceph', 'get_volume', dict(id=1)),
+                   batcher.submit('ceph', 'get_volume', dict(id=2,
+                                                             fail=True)),
+                   batcher.submit('ceph', 'get_volume', dict(id=3))]
+        assert futures[0].result(timeout=5) == dict(id=1)
+        with pytest.raises(utils.BatchItemError):
+            futures[1].result(timeout=5)
+        assert futures[2].result(timeout=5) == dict(id=3)
+    finally:
+        batcher.stop()
+
+
+def test_batch_failure_fails_every_request():
+    batcher = _batcher(FakeExecutor(fail=True))
+    try:
+        futures = [batcher.submit('ceph', 'get_volume', dict(id=i))
+                   for i in range(3)]
+        for future in futures:
+            with pytest.raises(RuntimeError):
+                future.result(timeout=5)
+    finally:
+        batcher.stop()
+
+
+def test_cancel_pending_request():
+    executor = FakeExecutor()
+    batcher = _batcher(executor)
+    first = batcher.submit('ceph', 'get_volume', dict(id=1))
+    second = batcher.submit('ceph', 'get_volume', dict(id=2))
+    assert batcher.cancel(first)
+    with pytest.raises(utils.Cancelled):
+        first.result(timeout=5)
+    batcher.stop()
+    assert second.result(timeout=5) == dict(id=2)
+    assert executor.batches[0][2] == [dict(id=2)]
+    # Too late once the batch ran
+    assert not batcher.cancel(second)
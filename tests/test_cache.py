@@ -0,0 +1,90 @@
+#
+#  Copyright 2017 Red Hat, Inc. and/or its affiliates.
+#
+# Licensed to you under the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.  See the files README and
+# LICENSE_GPL_v2 which accompany this distribution.
+#
+
+import pytest
+
+import cache
+
+
+class Clock(object):
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(cache.time, 'time', clock)
+    return clock
+
+
+def test_expiry(clock):
+    c = cache.TTLCache(ttl=5)
+    c.put('a', 1)
+    clock.now += 4.9
+    assert c.get('a') == 1
+    clock.now += 0.1
+    assert c.get('a') is None
+
+
+def test_ttl_per_key(clock):
+    c = cache.TTLCache(ttl=5, ttls=dict(ceph=10))
+    c.put('a', 1, 'ceph')
+    c.put('b', 2, 'netapp')
+    clock.now += 6
+    assert c.get('a') == 1
+    assert c.get('b') is None
+
+
+def test_zero_ttl_disables_caching(clock):
+    c = cache.TTLCache(ttl=5, ttls=dict(ceph=0))
+    c.put('a', 1, 'ceph')
+    assert c.get('a') is None
+    assert c.stats()['size'] == 0
+
+
+def test_put_replaces(clock):
+    c = cache.TTLCache(ttl=5)
+    c.put('a', 1)
+    clock.now += 4
+    c.put('a', 2)
+    clock.now += 4
+    assert c.get('a') == 2
+
+
+def test_lru_eviction(clock):
+    c = cache.TTLCache(max_size=2, ttl=5)
+    c.put('a', 1)
+    c.put('b', 2)
+    assert c.get('a') == 1  # b is now the least recently used
+    c.put('c', 3)
+    assert c.get('b') is None
+    assert c.get('a') == 1
+    assert c.get('c') == 3
+    assert c.stats()['evictions'] == 1
+
+
+def test_invalidate(clock):
+    c = cache.TTLCache()
+    c.put('a', 1)
+    c.invalidate('a')
+    c.invalidate('missing')
+    assert c.get('a') is None
+
+
+def test_stats(clock):
+    c = cache.TTLCache()
+    c.put('a', 1)
+    c.get('a')
+    c.get('b')
+    assert c.stats() == dict(size=1, hits=1, misses=1, evictions=0)
@@ -0,0 +1,54 @@
+#
+#  Copyright 2017 Red Hat, Inc. and/or its affiliates.
+#
+# Licensed to you under the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.  See the files README and
+# LICENSE_GPL_v2 which accompany this distribution.
+#
+
+import pytest
+
+import config
+import utils
+
+BACKEND_VARS = """
+ansible_host: storage.example.com
+ansible_user: root
+backend: rbd
+backend_config:
+  pool: volumes
+"""
+
+
+@pytest.fixture
+def configs_dir(tmpdir, monkeypatch):
+    monkeypatch.setattr(config, 'configs_dir', str(tmpdir))
+    return tmpdir
+
+
+def test_validate_backend_vars(configs_dir):
+    configs_dir.join('ceph.yml').write(BACKEND_VARS)
+    config.validate_backend_vars('ceph')
+    assert config.backend_vars('ceph')['backend'] == 'rbd'
+
+
+@pytest.mark.parametrize('name', ['ansible_host', 'ansible_user', 'backend',
+                                  'backend_config'])
+def test_validate_backend_vars_missing(configs_dir, name):
+    lines = [l for l in BACKEND_VARS.splitlines()
+             if not l.startswith(name + ':')]
+    if name == 'backend_config':
+        lines.remove('  pool: volumes')
+    configs_dir.join('ceph.yml').write('\n'.join(lines))
+    with pytest.raises(utils.ConfigurationError) as e:
+        config.validate_backend_vars('ceph')
+    assert name in str(e.value)
+
+
+@pytest.mark.parametrize('content', [None, '', 'backend: [rbd'])
+def test_validate_backend_vars_unreadable(configs_dir, content):
+    if content is not None:
+        configs_dir.join('ceph.yml').write(content)
+    with pytest.raises(utils.ConfigurationError):
+        config.validate_backend_vars('ceph')
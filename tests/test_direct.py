@@ -0,0 +1,158 @@
+#
+#  Copyright 2017 Red Hat, Inc. and/or its affiliates.
+#
+# Licensed to you under the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.  See the files README and
+# LICENSE_GPL_v2 which accompany this distribution.
+#
+
+from contextlib import contextmanager
+
+import pytest
+
+import config
+import direct
+import execution
+import pool
+import utils
+
+pytest.importorskip('ansible.module_utils')
+
+
+class FakeDriver(object):
+    """A backend keeping its volumes in memory."""
+    volumes = {}
+
+    def __init__(self, config):
+        self.config = config
+        self.setup = False
+        self.sessions = 0
+        self.connected = False
+
+    def do_setup(self, context):
+        self.setup = True
+
+    @contextmanager
+    def session(self):
+        self.sessions += 1
+        self.connected = True
+        try:
+            yield
+        finally:
+            self.connected = False
+
+    def get_volume(self, volume):
+        assert self.setup
+        if self.sessions:
+            assert self.connected
+        if self.config.get('fail'):
+            raise RuntimeError("backend unreachable")
+        size = self.volumes.get(volume.id)
+        if size is None:
+            return None
+        volume.size = size
+        return volume
+
+    def create_volume(self, volume):
+        self.volumes[volume.id] = volume.size
+
+    def delete_volume(self, volume):
+        del self.volumes[volume.id]
+
+
+@pytest.fixture
+def backend(monkeypatch):
+    # The real backends need their client libraries; only the fake one is
+    # used here so quarry_ops and quarry_trace are imported on their own.
+    import ansible.module_utils
+    if config.module_utils_path not in ansible.module_utils.__path__:
+        monkeypatch.setattr(ansible.module_utils, '__path__',
+                            ansible.module_utils.__path__ +
+                            [config.module_utils_path])
+    from ansible.module_utils import quarry_ops, quarry_trace
+    monkeypatch.setattr(direct, '_modules', (dict(fake=FakeDriver),
+                                             quarry_ops, quarry_trace))
+    backend_vars = dict(backend='fake', backend_config={})
+    monkeypatch.setattr(config, 'backend_vars', lambda vt: backend_vars)
+    monkeypatch.setattr(FakeDriver, 'volumes', {})
+    return backend_vars
+
+
+@pytest.fixture
+def workers():
+    workers = pool.WorkerPool('direct', 1)
+    yield workers
+    workers.stop()
+
+
+def _run(workers, operation, **params):
+    return direct.DirectCaller('ceph', operation, params, workers).run()
+
+
+def test_volume_lifecycle(backend, workers):
+    ret = _run(workers, 'get_volume', volume_id='vol1', volume_size=0)
+    assert ret['state'] == 'absent'
+    ret = _run(workers, 'create_volume', volume_id='vol1', volume_size='2')
+    assert ret == dict(changed=True, id='vol1', size=2, state='present')
+    ret = _run(workers, 'get_volume', volume_id='vol1', volume_size=0)
+    assert ret['state'] == 'present'
+    assert ret['size'] == 2
+    ret = _run(workers, 'delete_volume', volume_id='vol1')
+    assert ret['state'] == 'absent'
+    assert FakeDriver.volumes == {}
+
+
+def test_driver_error(backend, workers):
+    backend['backend_config'] = dict(fail=True)
+    with pytest.raises(utils.DriverError) as e:
+        _run(workers, 'get_volume', volume_id='vol1')
+    assert "backend unreachable" in str(e.value)
+
+
+def test_cancelled_before_start(backend, workers):
+    caller = direct.DirectCaller('ceph', 'get_volume', dict(volume_id='vol1'),
+                                 workers)
+    caller.cancel()
+    with pytest.raises(utils.Cancelled):
+        caller.run()
+
+
+@pytest.mark.parametrize('backend_vars,is_direct', [
+    (dict(direct=True, ansible_host='storage.example.com'), True),
+    (dict(ansible_host='localhost'), True),
+    (dict(ansible_host='127.0.0.1'), True),
+    (dict(ansible_host='storage.example.com'), False),
+    (dict(), False),
+])
+def test_is_direct(monkeypatch, backend_vars, is_direct):
+    monkeypatch.setattr(config, 'backend_vars', lambda vt: backend_vars)
+    executor = execution.Executor(direct_execution=True, direct_workers=1)
+    try:
+        assert executor.is_direct('ceph') == is_direct
+        caller = executor._caller('ceph', 'get_volume', {})
+        assert isinstance(caller, direct.DirectCaller) == is_direct
+    finally:
+        executor.stop()
+
+
+def test_direct_execution_disabled(monkeypatch):
+    monkeypatch.setattr(config, 'backend_vars',
+                        lambda vt: dict(direct=True))
+    assert not execution.Executor().is_direct('ceph')
+
+
+def test_batch_holds_one_session(backend):
+    backends, quarry_ops, quarry_trace = direct._modules
+    driver = FakeDriver({})
+    driver.do_setup(None)
+    FakeDriver.volumes['vol2'] = 1
+    results = quarry_ops.batch(quarry_ops.volume, driver, [
+        dict(id='vol1', size=1, state='present'),
+        dict(id='vol2', state='absent'),
+        dict(id='vol3', state='absent', size=None),
+    ])
+    assert driver.sessions == 1
+    assert not driver.connected
+    assert [r['state'] for r in results] == ['present', 'absent', 'absent']
+    assert [r['changed'] for r in results] == [True, True, False]
@@ -0,0 +1,179 @@
+#
+#  Copyright 2017 Red Hat, Inc. and/or its affiliates.
+#
+# Licensed to you under the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.  See the files README and
+# LICENSE_GPL_v2 which accompany this distribution.
+#
+
+import threading
+import time
+
+import pytest
+
+import execution
+import pool
+import utils
+
+
+def _wait_for(condition):
+    deadline = time.time() + 5
+    while not condition() and time.time() < deadline:
+        time.sleep(0.001)
+    assert condition()
+
+
+class BlockingCaller(object):
+    """A caller which blocks in run() until released."""
+
+    def __init__(self, params, started, release, result=None, error=None):
+        self.volume_type = 'ceph'
+        self.operation = 'get_volume'
+        self.params = params
+        self.started = started
+        self.release = release
+        self.result = result
+        self.error = error
+        self.cancelled = False
+
+    def run(self):
+        self.started.append(self)
+        self.release.wait(5)
+        if self.cancelled:
+            raise utils.Cancelled("get_volume on ceph was cancelled")
+        if self.error is not None:
+            raise self.error
+        return self.result
+
+    def cancel(self):
+        self.cancelled = True
+        self.release.set()
+
+
+class Runner(object):
+    """Run a SharedCaller in another thread, keeping its outcome."""
+
+    def __init__(self, caller, flight):
+        self.shared = execution.SharedCaller(caller, flight)
+        self.result = self.error = None
+        self.thread = threading.Thread(target=self._run)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def _run(self):
+        try:
+            self.result = self.shared.run()
+        except Exception as e:
+            self.error = e
+
+    def join(self):
+        self.thread.join(5)
+        assert not self.thread.is_alive()
+
+
+@pytest.fixture
+def waiting(monkeypatch):
+    """Threads waiting on a call another thread is running."""
+    waiting = []
+
+    class Future(pool.Future):
+        def result(self, timeout=None):
+            waiting.append(threading.current_thread())
+            return super(Future, self).result(timeout)
+
+    monkeypatch.setattr(pool, 'Future', Future)
+    return waiting
+
+
+def _start(flight, waiting, callers):
+    """Start the first caller, then the others once it is running."""
+    leader = Runner(callers[0], flight)
+    _wait_for(lambda: callers[0].started)
+    followers = []
+    for caller in callers[1:]:
+        followers.append(Runner(caller, flight))
+        _wait_for(lambda: len(waiting) == len(followers))
+    return leader, followers
+
+
+def test_followers_share_result(waiting):
+    flight = pool.SingleFlight()
+    started = []
+    release = threading.Event()
+    result = dict(state='present')
+    callers = [BlockingCaller(dict(volume_id='vol1'), started, release,
+                              result=result) for i in range(3)]
+    leader, followers = _start(flight, waiting, callers)
+    release.set()
+    for runner in [leader] + followers:
+        runner.join()
+        assert runner.result is result
+    assert started == [callers[0]]
+
+
+def test_followers_share_exception(waiting):
+    flight = pool.SingleFlight()
+    started = []
+    release = threading.Event()
+    error = utils.DriverError("ceph", "get_volume", "backend unreachable")
+    callers = [BlockingCaller(dict(volume_id='vol1'), started, release,
+                              error=error) for i in range(3)]
+    leader, followers = _start(flight, waiting, callers)
+    release.set()
+    for runner in [leader] + followers:
+        runner.join()
+        assert runner.error is error
+    assert started == [callers[0]]
+
+
+def test_failed_call_is_not_shared_later(waiting):
+    flight = pool.SingleFlight()
+    started = []
+    release = threading.Event()
+    release.set()
+    failing = BlockingCaller(dict(volume_id='vol1'), started, release,
+                             error=RuntimeError("boom"))
+    with pytest.raises(RuntimeError):
+        execution.SharedCaller(failing, flight).run()
+    retry = BlockingCaller(dict(volume_id='vol1'), started, release,
+                           result='found')
+    assert execution.SharedCaller(retry, flight).run() == 'found'
+    assert started == [failing, retry]
+    assert waiting == [threading.current_thread()] * 2
+
+
+def test_different_params_are_not_shared(waiting):
+    flight = pool.SingleFlight()
+    started = []
+    release = threading.Event()
+    callers = [BlockingCaller(dict(volume_id=volume_id), started, release,
+                              result=volume_id)
+               for volume_id in ('vol1', 'vol2', 'vol3')]
+    runners = [Runner(caller, flight) for caller in callers]
+    # Every call runs on its own at the same time
+    _wait_for(lambda: len(started) == 3)
+    assert waiting == []
+    release.set()
+    for runner, volume_id in zip(runners, ('vol1', 'vol2', 'vol3')):
+        runner.join()
+        assert runner.result == volume_id
+
+
+def test_follower_runs_when_leader_cancelled(waiting):
+    flight = pool.SingleFlight()
+    started = []
+    leader_release = threading.Event()
+    follower_release = threading.Event()
+    first = BlockingCaller(dict(volume_id='vol1'), started, leader_release)
+    second = BlockingCaller(dict(volume_id='vol1'), started,
+                            follower_release, result='found')
+    leader, followers = _start(flight, waiting, [first, second])
+    leader.shared.cancel()
+    leader.join()
+    assert isinstance(leader.error, utils.Cancelled)
+    # The follower runs the call itself instead of failing
+    _wait_for(lambda: second in started)
+    follower_release.set()
+    followers[0].join()
+    assert followers[0].result == 'found'
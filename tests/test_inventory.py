@@ -0,0 +1,107 @@
+#
+#  Copyright 2017 Red Hat, Inc. and/or its affiliates.
+#
+# Licensed to you under the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.  See the files README and
+# LICENSE_GPL_v2 which accompany this distribution.
+#
+
+import threading
+
+import pytest
+
+import inventory
+
+
+class FakeExecutor(object):
+
+    def __init__(self):
+        self.calls = 0
+        self.fail = False
+        self.release = threading.Event()
+        self.release.set()
+        self.volumes = [dict(id='vol1', size=1)]
+        self.snapshots = [dict(id='snap1', volume_id='vol1')]
+
+    def run(self, volume_type, operation, params, admit=True):
+        # Refreshes are background work and are never refused
+        assert not admit
+        self.calls += 1
+        self.release.wait()
+        if self.fail:
+            raise RuntimeError("backend unreachable")
+        return dict(ansible_facts=dict(quarry_volumes=self.volumes,
+                                       quarry_snapshots=self.snapshots))
+
+
+@pytest.fixture
+def executor():
+    return FakeExecutor()
+
+
+def _inventory(executor, **kwargs):
+    return inventory.Inventory(executor, workers=1, **kwargs)
+
+
+def _settle(inv):
+    # Wait for the background refreshes started so far
+    inv._pool.submit(lambda: None).result(timeout=5)
+
+
+def test_get_never_waits(executor):
+    executor.release.clear()
+    inv = _inventory(executor)
+    try:
+        assert inv.get('ceph') is None
+        # A second request does not start another refresh
+        assert inv.get('ceph') is None
+        executor.release.set()
+        _settle(inv)
+        entry = inv.get('ceph')
+        assert sorted(entry.volumes) == ['vol1']
+        assert sorted(entry.snapshots) == ['snap1']
+        assert executor.calls == 1
+    finally:
+        executor.release.set()
+        inv.stop()
+
+
+def test_stale_listing_served_while_refreshing(executor):
+    inv = _inventory(executor, max_age=0, retry_interval=0)
+    try:
+        old = inv.refresh('ceph')
+        executor.release.clear()
+        executor.volumes = []
+        assert inv.get('ceph') is old
+        executor.release.set()
+        _settle(inv)
+        assert inv.cached('ceph').volumes == {}
+    finally:
+        executor.release.set()
+        inv.stop()
+
+
+def test_failed_refresh_keeps_listing(executor):
+    inv = _inventory(executor, max_age=0, retry_interval=0)
+    try:
+        old = inv.refresh('ceph')
+        executor.fail = True
+        assert inv.get('ceph') is old
+        _settle(inv)
+        assert inv.get('ceph') is old
+    finally:
+        inv.stop()
+
+
+def test_failed_refresh_is_retried_later(executor):
+    executor.fail = True
+    inv = _inventory(executor, retry_interval=60)
+    try:
+        assert inv.get('ceph') is None
+        _settle(inv)
+        assert inv.get('ceph') is None
+        _settle(inv)
+        assert executor.calls == 1
+    finally:
+        inv.stop()
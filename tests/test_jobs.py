@@ -0,0 +1,113 @@
+#
+#  Copyright 2017 Red Hat, Inc. and/or its affiliates.
+#
+# Licensed to you under the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.  See the files README and
+# LICENSE_GPL_v2 which accompany this distribution.
+#
+
+import threading
+
+import pytest
+
+import jobs
+
+
+@pytest.fixture
+def manager():
+    manager = jobs.JobManager(workers=2)
+    yield manager
+    manager.stop()
+
+
+def test_job_done(manager):
+    release = threading.Event()
+    job = manager.submit('volume', 'vol1', 'creating', 'available', 'error',
+                         release.wait, info=dict(size=1))
+    assert job.status == 'creating'
+    assert job.in_progress()
+    assert manager.get('volume', 'vol1') is job
+    release.set()
+    job.future.result(timeout=5)
+    assert job.status == 'available'
+    assert not job.in_progress()
+    assert job.info == dict(size=1)
+
+
+def test_job_error(manager):
+    def fail():
+        raise RuntimeError("boom")
+
+    job = manager.submit('volume', 'vol1', 'creating', 'available', 'error',
+                         fail)
+    job.future.result(timeout=5)
+    assert job.status == 'error'
+    assert job.error == "boom"
+
+
+def test_backlog(manager):
+    release = threading.Event()
+    # More jobs than workers, so some are still queued
+    single = [manager.submit('volume', 'vol%i' % i, 'creating', 'available',
+                             'error', release.wait,
+                             info=dict(volume_type='ceph'))
+              for i in range(3)]
+    batch = manager.submit_batch('volume', ['vol3', 'vol4'], 'creating',
+                                 'available', 'error',
+                                 lambda: release.wait() and [None, None],
+                                 info=[dict(volume_type='ceph')] * 2)
+    manager.submit('volume', 'vol5', 'creating', 'available', 'error',
+                   release.wait, info=dict(volume_type='netapp'))
+    # The batch runs as one operation
+    assert manager.backlog('ceph') == 4
+    assert manager.backlog('netapp') == 1
+    release.set()
+    for job in single + batch:
+        job.future.result(timeout=5)
+    assert manager.backlog('ceph') == 0
+
+
+def test_batch_results(manager):
+    def run(items):
+        return [RuntimeError("boom") if item == 'vol2' else None
+                for item in items]
+
+    ids = ['vol1', 'vol2', 'vol3']
+    batch = manager.submit_batch('volume', ids, 'creating', 'available',
+                                 'error', run, ids)
+    batch[0].future.result(timeout=5)
+    assert [job.status for job in batch] == ['available', 'error',
+                                             'available']
+    assert batch[1].error == "boom"
+
+
+def test_batch_failure_fails_every_job(manager):
+    def fail(items):
+        raise RuntimeError("boom")
+
+    ids = ['vol1', 'vol2']
+    batch = manager.submit_batch('volume', ids, 'deleting', 'deleted',
+                                 'error_deleting', fail, ids)
+    batch[0].future.result(timeout=5)
+    assert [job.status for job in batch] == ['error_deleting'] * 2
+
+
+def test_list_by_kind(manager):
+    manager.submit('volume', 'vol1', 'creating', 'available', 'error',
+                   lambda: None)
+    manager.submit('snapshot', 'snap1', 'creating', 'available', 'error',
+                   lambda: None)
+    assert [job.id for job in manager.list('volume')] == ['vol1']
+    assert [job.id for job in manager.list('snapshot')] == ['snap1']
+
+
+def test_finished_jobs_expire():
+    manager = jobs.JobManager(workers=1, retention=0)
+    try:
+        job = manager.submit('volume', 'vol1', 'creating', 'available',
+                             'error', lambda: None)
+        job.future.result(timeout=5)
+        assert manager.get('volume', 'vol1') is None
+    finally:
+        manager.stop()
@@ -0,0 +1,59 @@
+#
+#  Copyright 2017 Red Hat, Inc. and/or its affiliates.
+#
+# Licensed to you under the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.  See the files README and
+# LICENSE_GPL_v2 which accompany this distribution.
+#
+
+import locations
+
+
+def test_add_and_remove(tmpdir):
+    index = locations.LocationIndex(str(tmpdir.join('locations.json')))
+    index.add_volume('vol1', 'ceph', 1)
+    index.add_snapshot('snap1', 'ceph', 'vol1')
+    assert index.get_volume('vol1') == dict(id='vol1', volume_type='ceph',
+                                            size=1)
+    assert index.get_snapshot('snap1') == dict(id='snap1', volume_type='ceph',
+                                               volume_id='vol1')
+    index.remove_volume('vol1')
+    index.remove_snapshot('snap1')
+    assert index.get_volume('vol1') is None
+    assert index.get_snapshot('snap1') is None
+
+
+def test_persisted(tmpdir):
+    path = str(tmpdir.join('locations.json'))
+    index = locations.LocationIndex(path)
+    index.add_volume('vol1', 'ceph', 1)
+    index.add_volume('vol2', 'netapp', 2)
+    index.remove_volume('vol2')
+    index.add_snapshot('snap1', 'ceph', 'vol1')
+    index = locations.LocationIndex(path)
+    assert index.get_volume('vol1')['volume_type'] == 'ceph'
+    assert index.get_volume('vol2') is None
+    assert index.get_snapshot('snap1')['volume_id'] == 'vol1'
+
+
+def test_missing_directory_is_created(tmpdir):
+    path = str(tmpdir.join('sub', 'locations.json'))
+    locations.LocationIndex(path).add_volume('vol1', 'ceph')
+    assert locations.LocationIndex(path).get_volume('vol1') is not None
+
+
+def test_corrupt_index_is_ignored(tmpdir):
+    path = tmpdir.join('locations.json')
+    path.write('{not json')
+    index = locations.LocationIndex(str(path))
+    assert index.get_volume('vol1') is None
+    index.add_volume('vol1', 'ceph')
+    assert locations.LocationIndex(str(path)).get_volume('vol1') is not None
+
+
+def test_returned_entries_are_copies(tmpdir):
+    index = locations.LocationIndex(str(tmpdir.join('locations.json')))
+    index.add_volume('vol1', 'ceph', 1)
+    index.get_volume('vol1')['volume_type'] = 'netapp'
+    assert index.get_volume('vol1')['volume_type'] == 'ceph'
@@ -0,0 +1,98 @@
+#
+#  Copyright 2017 Red Hat, Inc. and/or its affiliates.
+#
+# Licensed to you under the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.  See the files README and
+# LICENSE_GPL_v2 which accompany this distribution.
+#
+
+import pytest
+
+import metrics
+import utils
+
+
+@pytest.fixture(autouse=True)
+def registry(monkeypatch):
+    monkeypatch.setattr(metrics, '_values', {})
+    monkeypatch.setattr(metrics, '_histograms', {})
+    monkeypatch.setattr(metrics, '_collectors', [])
+
+
+def _samples():
+    return [line for line in metrics.render().splitlines()
+            if not line.startswith('#')]
+
+
+def test_counter():
+    metrics.inc('quarry_rejected_total', volume_type='ceph')
+    metrics.inc('quarry_rejected_total', volume_type='ceph')
+    text = metrics.render()
+    assert '# TYPE quarry_rejected_total counter\n' in text
+    assert _samples() == ['quarry_rejected_total{volume_type="ceph"} 2']
+
+
+def test_gauge_goes_down():
+    metrics.inc('quarry_ansible_processes')
+    metrics.inc('quarry_ansible_processes', -1)
+    assert _samples() == ['quarry_ansible_processes 0']
+
+
+def test_histogram():
+    metrics.observe('quarry_batch_duration_seconds', 0.2, volume_type='ceph')
+    metrics.observe('quarry_batch_duration_seconds', 1000,
+                    volume_type='ceph')
+    samples = _samples()
+    assert ('quarry_batch_duration_seconds_bucket{volume_type="ceph",'
+            'le="0.1"} 0' in samples)
+    assert ('quarry_batch_duration_seconds_bucket{volume_type="ceph",'
+            'le="0.25"} 1' in samples)
+    assert ('quarry_batch_duration_seconds_bucket{volume_type="ceph",'
+            'le="600"} 1' in samples)
+    assert ('quarry_batch_duration_seconds_bucket{volume_type="ceph",'
+            'le="+Inf"} 2' in samples)
+    assert ('quarry_batch_duration_seconds_count{volume_type="ceph"} 2' in
+            samples)
+    assert ('quarry_batch_duration_seconds_sum{volume_type="ceph"} 1000.2' in
+            samples)
+
+
+def test_label_escaping():
+    metrics.inc('quarry_rejected_total', volume_type='a"b\\c\nd')
+    assert _samples() == [
+        'quarry_rejected_total{volume_type="a\\"b\\\\c\\nd"} 1']
+
+
+def test_collector():
+    metrics.add_collector(lambda: [
+        ('quarry_worker_queue_depth', 'gauge', "Queued calls",
+         [(dict(pool='jobs'), 3)])])
+    text = metrics.render()
+    assert '# HELP quarry_worker_queue_depth Queued calls\n' in text
+    assert 'quarry_worker_queue_depth{pool="jobs"} 3\n' in text
+
+
+class Caller(object):
+    volume_type = 'ceph'
+    operation = 'get_volume'
+    params = {}
+
+    def __init__(self, error=None):
+        self.error = error
+
+    def run(self):
+        if self.error is not None:
+            raise self.error
+        return 'result'
+
+
+def test_timed_caller_outcomes():
+    assert metrics.TimedCaller(Caller()).run() == 'result'
+    for error in (RuntimeError("boom"), utils.Cancelled("cancelled")):
+        with pytest.raises(type(error)):
+            metrics.TimedCaller(Caller(error)).run()
+    samples = _samples()
+    for outcome in ('success', 'error', 'cancelled'):
+        assert ('quarry_operations_total{operation="get_volume",'
+                'outcome="%s",volume_type="ceph"} 1' % outcome in samples)
@@ -0,0 +1,367 @@
+#
+#  Copyright 2017 Red Hat, Inc. and/or its affiliates.
+#
+# Licensed to you under the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.  See the files README and
+# LICENSE_GPL_v2 which accompany this distribution.
+#
+
+import json
+import os
+import sys
+import textwrap
+
+import pytest
+
+import config
+import playcaller
+import utils
+
+
+def _task(index, status='ok', host='localhost'):
+    return json.dumps(dict(type='task', index=index, task='task%i' % index,
+                           action='quarry_volume', host=host, status=status,
+                           duration=0.1))
+
+
+def _result(index, result, host='localhost'):
+    return json.dumps(dict(type='result', index=index, task='task%i' % index,
+                           host=host, status='ok', result=result))
+
+
+def _caller():
+    return playcaller.PlayCaller('ceph', 'get_volume', {})
+
+
+def test_records_skip_other_output():
+    out = '\n'.join([
+        'PLAY [localhost]',
+        _task(0),
+        '42',
+        '[1, 2]',
+        '"text"',
+        'null',
+        '{"no": "type"}',
+        _result(0, dict(state='present')),
+    ])
+    records = _caller()._records(out)
+    assert [r['type'] for r in records] == ['task', 'result']
+
+
+def test_result_of_last_quarry_task():
+    out = '\n'.join([
+        _task(0), _result(0, dict(size=1)),
+        _task(1), _result(1, dict(size=2)),
+    ])
+    caller = _caller()
+    assert caller._result_from_records(caller._records(out)) == dict(size=2)
+
+
+def test_no_result():
+    caller = _caller()
+    with pytest.raises(RuntimeError):
+        caller._result_from_records(caller._records(_task(0)))
+
+
+def test_more_than_one_host():
+    out = '\n'.join([_result(0, {}, host='a'), _result(0, {}, host='b')])
+    caller = _caller()
+    with pytest.raises(RuntimeError):
+        caller._result_from_records(caller._records(out))
+
+
+def _batch(*volume_ids):
+    return playcaller.BatchPlayCaller(
+        'ceph', 'delete_volume', [dict(volume_id=v) for v in volume_ids])
+
+
+def test_batch_split():
+    caller = _batch('vol1', 'vol2', 'vol3')
+    results = caller._split(dict(results=[
+        dict(item=dict(id='vol1'), state='absent'),
+        dict(item=dict(id='vol2'), failed=True, msg="busy"),
+        dict(state='absent'),
+    ]))
+    assert results[0] == dict(state='absent')
+    assert isinstance(results[1], playcaller.utils.BatchItemError)
+    assert results[1].item == 'vol2'
+    assert "busy" in str(results[1])
+    assert results[2] == dict(state='absent')
+
+
+def test_batch_module_failure_fails_every_item():
+    caller = _batch('vol1', 'vol2')
+    results = caller._split(dict(failed=True, msg="no driver"))
+    assert [r.item for r in results] == ['vol1', 'vol2']
+    assert all("no driver" in str(r) for r in results)
+
+
+def test_batch_result_count_mismatch():
+    with pytest.raises(RuntimeError):
+        _batch('vol1', 'vol2')._split(dict(results=[dict(state='absent')]))
+
+
+def test_batch_results_from_records():
+    caller = _batch('vol1', 'vol2')
+    out = '\n'.join([_task(0), _result(0, dict(results=[
+        dict(state='absent'), dict(state='absent')]))])
+    assert (caller._result_from_records(caller._records(out)) ==
+            [dict(state='absent')] * 2)
+
+
+@pytest.fixture
+def templates(tmpdir, monkeypatch):
+    pytest.importorskip('Cheetah.Template')
+    monkeypatch.setattr(playcaller.config, 'template_path', str(tmpdir))
+    monkeypatch.setattr(playcaller.PlayCaller, '_templates', {})
+    return tmpdir
+
+
+def test_render_template(templates):
+    templates.join('get_volume.t').write("volume: $volume_id\n")
+    caller = playcaller.PlayCaller('ceph', 'get_volume',
+                                   dict(volume_id='vol1'))
+    assert caller._render() == "volume: vol1\n"
+
+
+def test_template_compiled_once(templates):
+    templates.join('get_volume.t').write("volume: $volume_id\n")
+    first = playcaller.PlayCaller('ceph', 'get_volume',
+                                  dict(volume_id='vol1'))
+    second = playcaller.PlayCaller('netapp', 'get_volume',
+                                   dict(volume_id='vol2'))
+    template_class = first._template_class()
+    assert second._template_class() is template_class
+    # Each request still renders with its own parameters
+    assert second._render() == "volume: vol2\n"
+
+
+def test_template_recompiled_when_changed(templates):
+    template = templates.join('get_volume.t')
+    template.write("volume: $volume_id\n")
+    caller = playcaller.PlayCaller('ceph', 'get_volume',
+                                   dict(volume_id='vol1'))
+    template_class = caller._template_class()
+    template.write("id: $volume_id\n")
+    template.setmtime(template.mtime() + 10)
+    assert caller._template_class() is not template_class
+    assert caller._render() == "id: vol1\n"
+
+
+class FakeTask(object):
+
+    def __init__(self, name, action):
+        self.name = name
+        self.action = action
+
+    def get_name(self):
+        return self.name
+
+
+class FakeHost(object):
+
+    def get_name(self):
+        return 'localhost'
+
+
+class FakeResult(object):
+
+    def __init__(self, task, result):
+        self._task = task
+        self._host = FakeHost()
+        self._result = result
+
+
+class FakeDisplay(object):
+
+    def __init__(self):
+        self.lines = []
+
+    def display(self, msg, *args, **kwargs):
+        self.lines.append(msg)
+
+
+def _callback_output(*events):
+    """Output of the quarry stdout callback for (task, event, result)."""
+    pytest.importorskip('ansible.plugins.callback')
+    path = os.path.join(config.callback_plugins_path, 'quarry.py')
+    plugin = {}
+    with open(path) as f:
+        exec(compile(f.read(), path, 'exec'), plugin)
+    callback = plugin['CallbackModule']()
+    callback._display = FakeDisplay()
+    for task, event, result in events:
+        callback.v2_playbook_on_task_start(task, False)
+        getattr(callback, 'v2_runner_on_' + event)(FakeResult(task, result))
+    return '\n'.join(callback._display.lines) + '\n'
+
+
+SET_FACT = FakeTask('Find the backend', 'set_fact')
+GET_VOLUME = FakeTask('Get volume', 'quarry_volume')
+
+
+def test_callback_output():
+    out = _callback_output(
+        (SET_FACT, 'ok', dict(ansible_facts=dict(backend='rbd'))),
+        (GET_VOLUME, 'ok', dict(changed=False, id='vol1', size=2,
+                                state='present',
+                                invocation=dict(module_args={}))))
+    caller = _caller()
+    records = caller._records(out)
+    assert [(r['type'], r['index'], r['status']) for r in records] == [
+        ('task', 0, 'ok'), ('task', 1, 'ok'), ('result', 1, 'ok')]
+    assert caller._result_from_records(records) == dict(
+        changed=False, id='vol1', size=2, state='present')
+
+
+def test_callback_output_failed_task():
+    out = _callback_output(
+        (SET_FACT, 'ok', {}),
+        (GET_VOLUME, 'failed', dict(failed=True, msg="pool not found")))
+    records = _caller()._records(out)
+    assert records[-1]['status'] == 'failed'
+    assert records[-1]['result']['msg'] == "pool not found"
+
+
+def test_callback_output_truncated():
+    out = _callback_output(
+        (SET_FACT, 'ok', {}),
+        (GET_VOLUME, 'ok', dict(id='vol1', size=2, state='present')))
+    # Ansible was killed while printing the quarry task result
+    truncated = out[:out.rindex('"size"')]
+    caller = _caller()
+    records = caller._records(truncated)
+    assert [r['type'] for r in records] == ['task', 'task']
+    with pytest.raises(RuntimeError):
+        caller._result_from_records(records)
+
+
+# Stands in for ansible-playbook: keeps a copy of the playbook it was given
+# and prints canned callback output.
+FAKE_ANSIBLE = textwrap.dedent("""
+    import os
+    import sys
+
+    with open(sys.argv[1]) as f:
+        playbook = f.read()
+    with open(os.environ['FAKE_ANSIBLE_PLAYBOOK'], 'w') as f:
+        f.write(playbook)
+    with open(os.environ['FAKE_ANSIBLE_OUTPUT']) as f:
+        sys.stdout.write(f.read())
+    sys.exit(int(os.environ['FAKE_ANSIBLE_RC']))
+""")
+
+
+@pytest.fixture
+def fake_ansible(tmpdir, monkeypatch):
+    script = tmpdir.join('ansible-playbook')
+    script.write('#!%s\n%s' % (sys.executable, FAKE_ANSIBLE))
+    script.chmod(0o755)
+    monkeypatch.setenv('PATH', '%s%s%s' % (tmpdir, os.pathsep,
+                                           os.environ['PATH']))
+    monkeypatch.setenv('FAKE_ANSIBLE_PLAYBOOK', str(tmpdir.join('playbook')))
+    monkeypatch.setenv('FAKE_ANSIBLE_OUTPUT', str(tmpdir.join('output')))
+    monkeypatch.setenv('FAKE_ANSIBLE_RC', '0')
+    return tmpdir
+
+
+def test_streamed_playbook(templates, fake_ansible):
+    templates.join('get_volume.t').write("volume: $volume_id\n")
+    fake_ansible.join('output').write(_callback_output(
+        (GET_VOLUME, 'ok', dict(id='vol1', size=2, state='present'))))
+    caller = playcaller.PlayCaller('ceph', 'get_volume',
+                                   dict(volume_id='vol1'), stream=True)
+    assert caller.run() == dict(id='vol1', size=2, state='present')
+    assert fake_ansible.join('playbook').read() == "volume: vol1\n"
+
+
+def test_streamed_playbook_failed(templates, fake_ansible, monkeypatch):
+    templates.join('get_volume.t').write("volume: $volume_id\n")
+    fake_ansible.join('output').write(_callback_output(
+        (GET_VOLUME, 'failed', dict(failed=True, msg="pool not found"))))
+    monkeypatch.setenv('FAKE_ANSIBLE_RC', '2')
+    caller = playcaller.PlayCaller('ceph', 'get_volume',
+                                   dict(volume_id='vol1'), stream=True)
+    with pytest.raises(utils.AnsibleError) as e:
+        caller.run()
+    assert "pool not found" in str(e.value)
+
+
+class RecordingPopen(object):
+    """Records the ansible-playbook command line and prints canned output."""
+
+    def __init__(self, out):
+        self.out = out
+        self.pid = 1
+
+    def __call__(self, cmd, **kwargs):
+        self.cmd = cmd
+        self.env = kwargs['env']
+        return self
+
+    def communicate(self, data=None):
+        self.returncode = 0
+        return self.out, ''
+
+    def extra_vars(self):
+        assert self.cmd[2] == '--extra-vars'
+        return json.loads(self.cmd[3])
+
+
+OPERATIONS = ('get_volume', 'create_volume', 'delete_volume', 'get_snapshot',
+              'create_snapshot', 'delete_snapshot', 'get_inventory',
+              'initialize_connection', 'terminate_connection')
+
+
+@pytest.mark.parametrize('operation', OPERATIONS)
+def test_static_playbook_exists(operation):
+    caller = playcaller.PlayCaller('ceph', operation, {}, static=True)
+    path = caller._static_playbook()
+    assert path == os.path.join(config.template_path, operation + '.yml')
+    assert os.path.isfile(path)
+
+
+def test_static_extra_vars_leave_out_unset_params():
+    caller = playcaller.PlayCaller('ceph', 'create_volume',
+                                   dict(volume_id='vol1', volume_size=2,
+                                        parent_id=None), static=True)
+    assert caller._extra_vars() == dict(volume_id='vol1', volume_size=2)
+
+
+def test_static_run(monkeypatch):
+    popen = RecordingPopen(_result(0, dict(id='vol1', state='present')))
+    monkeypatch.setattr(playcaller.subprocess, 'Popen', popen)
+    caller = playcaller.PlayCaller('ceph', 'create_volume',
+                                   dict(volume_id='vol1', volume_size=2,
+                                        parent_id=None), static=True)
+    assert caller.run() == dict(id='vol1', state='present')
+    assert popen.cmd[:2] == ['ansible-playbook', caller._static_playbook()]
+    assert popen.extra_vars() == dict(volume_id='vol1', volume_size=2)
+    assert popen.env['QUARRY_VOLUME_TYPE'] == 'ceph'
+
+
+@pytest.mark.parametrize('operation', OPERATIONS)
+def test_fast_playbook_exists(operation):
+    caller = playcaller.PlayCaller('ceph', operation, {}, fast=True)
+    path = caller._static_playbook()
+    assert path == os.path.join(config.template_path, 'fast',
+                                operation + '.yml')
+    with open(path) as f:
+        playbook = f.read()
+    # The fast playbooks skip the quarry role and its fact gathering
+    assert 'roles:' not in playbook
+    assert 'gather_facts: no' in playbook
+
+
+def test_fast_run(monkeypatch):
+    monkeypatch.setattr(config, 'configs_dir', '/etc/quarry/config')
+    popen = RecordingPopen(_result(0, dict(id='vol1', state='present')))
+    monkeypatch.setattr(playcaller.subprocess, 'Popen', popen)
+    caller = playcaller.PlayCaller('ceph', 'get_volume',
+                                   dict(volume_id='vol1'), fast=True)
+    assert caller.static
+    assert caller.run() == dict(id='vol1', state='present')
+    assert popen.cmd[1] == caller._static_playbook()
+    assert popen.extra_vars() == dict(
+        volume_id='vol1', backend_vars_file='/etc/quarry/config/ceph.yml')
@@ -0,0 +1,157 @@
+#
+#  Copyright 2017 Red Hat, Inc. and/or its affiliates.
+#
+# Licensed to you under the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.  See the files README and
+# LICENSE_GPL_v2 which accompany this distribution.
+#
+
+import sys
+import threading
+import time
+
+import pytest
+
+import pool
+import utils
+
+
+def test_future_result():
+    future = pool.Future()
+    assert not future.done()
+    future.set_result(42)
+    assert future.done()
+    assert future.result() == 42
+    assert future.exception() is None
+
+
+def test_future_exception():
+    future = pool.Future()
+    try:
+        raise ValueError("boom")
+    except ValueError:
+        future.set_exception(sys.exc_info())
+    assert isinstance(future.exception(), ValueError)
+    with pytest.raises(ValueError):
+        future.result()
+
+
+def test_future_timeout():
+    with pytest.raises(utils.Timeout):
+        pool.Future().result(timeout=0.01)
+
+
+def test_future_callbacks():
+    future = pool.Future()
+    called = []
+    future.add_done_callback(called.append)
+    assert called == []
+    future.set_result(1)
+    assert called == [future]
+    # Added after completion, called right away
+    future.add_done_callback(called.append)
+    assert called == [future, future]
+
+
+def test_worker_pool_runs_calls():
+    workers = pool.WorkerPool('test', 2)
+    try:
+        futures = [workers.submit(lambda x, y=0: x + y, i, y=1)
+                   for i in range(10)]
+        assert [f.result(timeout=5) for f in futures] == list(range(1, 11))
+    finally:
+        workers.stop()
+
+
+def test_worker_pool_reports_errors():
+    def fail():
+        raise RuntimeError("boom")
+
+    workers = pool.WorkerPool('test', 1)
+    try:
+        future = workers.submit(fail)
+        with pytest.raises(RuntimeError):
+            future.result(timeout=5)
+    finally:
+        workers.stop()
+
+
+def test_worker_pool_fifo():
+    started = threading.Event()
+    release = threading.Event()
+    order = []
+
+    def block():
+        started.set()
+        release.wait()
+
+    workers = pool.WorkerPool('test', 1)
+    try:
+        workers.submit(block)
+        started.wait(5)
+        futures = [workers.submit(order.append, i) for i in range(5)]
+        assert workers.qsize() == 5
+        release.set()
+        for f in futures:
+            f.result(timeout=5)
+        assert order == list(range(5))
+    finally:
+        release.set()
+        workers.stop()
+
+
+def test_single_flight_shares_one_call(monkeypatch):
+    waiting = []
+
+    class Future(pool.Future):
+        def result(self, timeout=None):
+            waiting.append(threading.current_thread())
+            return super(Future, self).result(timeout)
+
+    monkeypatch.setattr(pool, 'Future', Future)
+    flight = pool.SingleFlight()
+    started = threading.Event()
+    release = threading.Event()
+    calls = []
+
+    def call(value):
+        calls.append(value)
+        started.set()
+        release.wait()
+        return value
+
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(
+        flight.do('key', call, 'value'))) for i in range(5)]
+    threads[0].start()
+    started.wait(5)
+    for t in threads[1:]:
+        t.start()
+    # Wait until the others are waiting for the call in flight
+    deadline = time.time() + 5
+    while len(waiting) < 4 and time.time() < deadline:
+        time.sleep(0.001)
+    release.set()
+    for t in threads:
+        t.join(5)
+    assert results == ['value'] * 5
+    assert calls == ['value']
+
+
+def test_single_flight_shares_errors():
+    flight = pool.SingleFlight()
+
+    def fail():
+        raise RuntimeError("boom")
+
+    with pytest.raises(RuntimeError):
+        flight.do('key', fail)
+    # The failed call is not remembered
+    assert flight.do('key', lambda: 1) == 1
+
+
+def test_single_flight_keys_are_independent():
+    flight = pool.SingleFlight()
+    assert flight.do('a', lambda: 1) == 1
+    assert flight.do('b', lambda: 2) == 2
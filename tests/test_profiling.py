@@ -0,0 +1,73 @@
+#
+#  Copyright 2017 Red Hat, Inc. and/or its affiliates.
+#
+# Licensed to you under the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.  See the files README and
+# LICENSE_GPL_v2 which accompany this distribution.
+#
+
+import base64
+import marshal
+import pstats
+
+import pytest
+
+import profiling
+
+
+@pytest.fixture
+def profile_dir(tmpdir, monkeypatch):
+    monkeypatch.setattr(profiling, '_directory', str(tmpdir))
+    monkeypatch.setattr(profiling, '_armed_requests', 0)
+    monkeypatch.setattr(profiling, '_armed_types', {})
+    return tmpdir
+
+
+def _files(profile_dir):
+    return sorted(p.basename for p in profile_dir.listdir())
+
+
+def test_repeated_operations_keep_every_profile(profile_dir):
+    for i in range(3):
+        with profiling.profile('req', 'create_volume.ceph'):
+            sum(range(100))
+    files = _files(profile_dir)
+    assert len(files) == 3
+    for name in files:
+        assert name.startswith('req.create_volume.ceph.')
+        assert name.endswith('.pstats')
+        pstats.Stats(str(profile_dir.join(name)))
+
+
+def test_saved_module_profiles_are_kept(profile_dir):
+    data = base64.b64encode(marshal.dumps({})).decode('ascii')
+    profiling.save('req', 'get_volume.ceph', data)
+    profiling.save('req', 'get_volume.ceph', data)
+    assert len(_files(profile_dir)) == 2
+
+
+def test_not_profiled(profile_dir):
+    with profiling.profile(None, 'get_volume.ceph'):
+        pass
+    assert _files(profile_dir) == []
+
+
+def test_armed_requests(profile_dir):
+    profiling.arm(2)
+    assert [profiling.take_request() for i in range(3)] == [True, True,
+                                                            False]
+
+
+def test_armed_volume_type(profile_dir):
+    profiling.arm(1, 'ceph')
+    assert profiling.for_operation('netapp') is None
+    assert profiling.for_operation('ceph') is not None
+    assert profiling.for_operation('ceph') is None
+    assert profiling.armed() == dict(requests=0, volume_types={})
+
+
+def test_request_profile_covers_its_operations(profile_dir):
+    with profiling.attach('req'):
+        assert profiling.for_operation('ceph') == 'req'
+    assert profiling.current() is None
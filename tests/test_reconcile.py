@@ -0,0 +1,112 @@
+#
+#  Copyright 2017 Red Hat, Inc. and/or its affiliates.
+#
+# Licensed to you under the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.  See the files README and
+# LICENSE_GPL_v2 which accompany this distribution.
+#
+
+import pytest
+
+import inventory
+import locations
+import reconcile
+
+
+class FakeInventory(object):
+
+    def __init__(self, volumes=(), snapshots=()):
+        self.volumes = dict((v['id'], v) for v in volumes)
+        self.snapshots = dict((s['id'], s) for s in snapshots)
+        self.during_refresh = None
+
+    def refresh(self, volume_type):
+        if self.during_refresh is not None:
+            self.during_refresh()
+        return inventory._Entry(self.volumes, self.snapshots)
+
+
+@pytest.fixture
+def index(tmpdir):
+    return locations.LocationIndex(str(tmpdir.join('locations.json')))
+
+
+def _reconcile(index, inv, volume_type='ceph'):
+    reconcile.Reconciler(inv, index, ['ceph', 'netapp']).reconcile(
+        volume_type)
+
+
+def test_adds_and_removes(index):
+    index.add_volume('gone', 'ceph', 1)
+    index.add_volume('resized', 'ceph', 1)
+    index.add_volume('other', 'netapp', 1)
+    index.add_snapshot('gone-snap', 'ceph', 'gone')
+    inv = FakeInventory(
+        volumes=[dict(id='resized', size=2), dict(id='new', size=3)],
+        snapshots=[dict(id='new-snap', volume_id='new')])
+    _reconcile(index, inv)
+    assert index.get_volume('gone') is None
+    assert index.get_volume('resized')['size'] == 2
+    assert index.get_volume('new') == dict(id='new', volume_type='ceph',
+                                           size=3)
+    assert index.get_snapshot('gone-snap') is None
+    assert index.get_snapshot('new-snap')['volume_id'] == 'new'
+    # Other volume types are not touched
+    assert index.get_volume('other') is not None
+
+
+def test_keeps_changes_made_while_listing(index):
+    index.add_volume('deleted', 'ceph', 1)
+    index.add_volume('missing', 'ceph', 1)
+
+    def change_index():
+        # This server creates and deletes volumes while the backend is
+        # being listed.
+        index.add_volume('created', 'ceph', 1)
+        index.remove_volume('deleted')
+        index.add_snapshot('created-snap', 'ceph', 'missing')
+
+    inv = FakeInventory(volumes=[dict(id='deleted', size=1)])
+    inv.during_refresh = change_index
+    _reconcile(index, inv)
+    # Listed before it was deleted, so not added back
+    assert index.get_volume('deleted') is None
+    # Created after the listing was taken, so not removed
+    assert index.get_volume('created') is not None
+    assert index.get_snapshot('created-snap') is not None
+    # Unchanged and not on the backend
+    assert index.get_volume('missing') is None
+
+
+def test_invalidates_lookups(index):
+    index.add_volume('gone', 'ceph', 1)
+    index.add_snapshot('gone-snap', 'ceph', 'gone')
+    inv = FakeInventory(volumes=[dict(id='new', size=1)],
+                        snapshots=[dict(id='new-snap', volume_id='new')])
+    invalidated = []
+    reconcile.Reconciler(inv, index, ['ceph'],
+                         invalidate=lambda *key: invalidated.append(key)
+                         ).reconcile('ceph')
+    assert sorted(invalidated) == [('snapshot', 'gone-snap'),
+                                   ('snapshot', 'new-snap'),
+                                   ('volume', 'gone'), ('volume', 'new')]
+
+
+def test_keeps_unchanged_lookups(index):
+    index.add_volume('same', 'ceph', 1)
+    index.add_volume('resized', 'ceph', 1)
+    index.add_volume('moved', 'netapp', 1)
+    index.add_snapshot('same-snap', 'ceph', 'same')
+    index.add_snapshot('rebased-snap', 'ceph', 'same')
+    inv = FakeInventory(
+        volumes=[dict(id='same', size=1), dict(id='resized', size=2),
+                 dict(id='moved', size=1)],
+        snapshots=[dict(id='same-snap', volume_id='same'),
+                   dict(id='rebased-snap', volume_id='resized')])
+    invalidated = []
+    reconcile.Reconciler(inv, index, ['ceph'],
+                         invalidate=lambda *key: invalidated.append(key)
+                         ).reconcile('ceph')
+    assert sorted(invalidated) == [('snapshot', 'rebased-snap'),
+                                   ('volume', 'moved'), ('volume', 'resized')]
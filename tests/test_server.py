@@ -0,0 +1,376 @@
+#
+#  Copyright 2017 Red Hat, Inc. and/or its affiliates.
+#
+# Licensed to you under the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.  See the files README and
+# LICENSE_GPL_v2 which accompany this distribution.
+#
+
+import threading
+
+import cherrypy
+import pytest
+from six.moves.urllib.parse import parse_qsl, urlparse
+
+import cache
+import execution
+import inventory
+import jobs
+import locations
+import pool
+import profiling
+import server
+import utils
+
+
+@pytest.fixture(autouse=True)
+def volume_types(monkeypatch):
+    monkeypatch.setattr(server, 'volume_types', lambda: ['ceph', 'netapp'])
+
+
+def _status(exc_info):
+    return exc_info.value.status
+
+
+@pytest.mark.parametrize('entry', [
+    None,
+    [],
+    dict(size=1),
+    dict(volume_type='nfs', size=1),
+    dict(volume_type='ceph'),
+    dict(volume_type='ceph', size='big'),
+    dict(volume_type='ceph', size=[1]),
+    dict(volume_type='ceph', size=0),
+])
+def test_new_volume_invalid(entry):
+    with pytest.raises(cherrypy.HTTPError) as e:
+        server._new_volume(entry)
+    assert _status(e) == 400
+
+
+def test_new_volume():
+    volume_type, params = server._new_volume(dict(volume_type='ceph',
+                                                  size='2'))
+    assert volume_type == 'ceph'
+    assert params['volume_size'] == 2
+    assert params['source_volid'] is None
+
+
+@pytest.mark.parametrize('req', [
+    None,
+    {},
+    dict(volumes=None),
+    dict(volumes={}),
+    dict(volumes=[]),
+    dict(volumes='vol1'),
+])
+def test_entries_invalid(req):
+    with pytest.raises(cherrypy.HTTPError) as e:
+        server._entries(req, 'volumes')
+    assert _status(e) == 400
+
+
+@pytest.mark.parametrize('entry', [None, 'vol1', {}, dict(volume_id='')])
+def test_new_snapshot_invalid(entry):
+    with pytest.raises(cherrypy.HTTPError) as e:
+        server._new_snapshot(entry)
+    assert _status(e) == 400
+
+
+@pytest.mark.parametrize('entry', [dict(volume_id=['vol1']),
+                                   dict(volume_id={})])
+def test_new_snapshot_invalid_volume_id(entry):
+    with pytest.raises(cherrypy.HTTPError) as e:
+        server._new_snapshot(entry)
+    assert _status(e) == 400
+
+
+@pytest.mark.parametrize('controller,key', [
+    (server.VolumeController, 'volume_ids'),
+    (server.SnapshotController, 'snapshot_ids'),
+])
+@pytest.mark.parametrize('body', [
+    None,
+    [],
+    'os-delete',
+    ['os-delete'],
+    {'os-delete': None},
+    {'os-delete': ['vol1']},
+    {'os-delete': {'ids': []}},
+    {'os-delete': {'ids': [{}]}},
+    {'os-delete': {'ids': [['vol1']]}},
+    {'os-delete': {'ids': [None]}},
+    {'os-delete': {'ids': [1]}},
+    {'os-delete': {'ids': ['']}},
+    {'os-delete': {'ids': ['vol1', 'vol1']}},
+])
+def test_bulk_delete_invalid(monkeypatch, controller, key, body):
+    if isinstance(body, dict) and isinstance(body['os-delete'], dict):
+        body = {'os-delete': {key: body['os-delete']['ids']}}
+    monkeypatch.setattr(cherrypy.request, 'method', 'POST')
+    monkeypatch.setattr(cherrypy.request, 'json', body, raising=False)
+    with pytest.raises(cherrypy.HTTPError) as e:
+        controller().bulk_action('v2', 'admin')
+    assert _status(e) == 400
+
+
+@pytest.mark.parametrize('controller', [server.VolumeController,
+                                        server.SnapshotController])
+@pytest.mark.parametrize('body', [None, [], 'volumes', ['volumes']])
+def test_create_invalid_body(monkeypatch, controller, body):
+    monkeypatch.setattr(cherrypy.request, 'method', 'POST')
+    monkeypatch.setattr(cherrypy.request, 'json', body, raising=False)
+    with pytest.raises(cherrypy.HTTPError) as e:
+        controller().collection('v2', 'admin')
+    assert _status(e) == 400
+
+
+@pytest.fixture
+def flood(monkeypatch):
+    release = threading.Event()
+    monkeypatch.setattr(server, 'executor', execution.Executor(
+        concurrency=1, queue_size=2))
+    job_manager = jobs.JobManager(workers=4)
+    monkeypatch.setattr(server, 'job_manager', job_manager)
+    # Creations never reach the backend and stay queued
+    monkeypatch.setattr(server, 'create_volume',
+                        lambda volume_type, params: release.wait(5))
+    monkeypatch.setattr(cherrypy.request, 'method', 'POST')
+    monkeypatch.setattr(cherrypy.request, 'json', dict(
+        volume=dict(volume_type='ceph', size=1)), raising=False)
+    yield
+    release.set()
+    job_manager.stop()
+
+
+def test_job_backlog_is_refused(flood):
+    controller = server.VolumeController()
+    # One running and queue_size waiting
+    for i in range(3):
+        controller.collection('v2', 'admin')
+    with pytest.raises(utils.Overloaded):
+        controller.collection('v2', 'admin')
+    # Other volume types are not held up
+    cherrypy.request.json = dict(volume=dict(volume_type='netapp', size=1))
+    controller.collection('v2', 'admin')
+
+
+class FakeInventory(object):
+
+    def __init__(self, entries):
+        self.entries = entries
+
+    def get(self, volume_type):
+        return self.entries.get(volume_type)
+
+
+class FakeJobs(object):
+
+    def list(self, kind):
+        return []
+
+
+@pytest.fixture
+def listings(monkeypatch):
+    monkeypatch.setattr(server, 'inventory_cache', FakeInventory(dict(
+        ceph=inventory._Entry(dict(vol1=dict(id='vol1', size=1)), {}))))
+    monkeypatch.setattr(server, 'job_manager', FakeJobs())
+
+
+def test_listing_waits_for_first_listing(listings):
+    with pytest.raises(utils.Overloaded) as e:
+        server._listing('volume')
+    assert 'netapp' in str(e.value)
+    assert e.value.retry_after == server.LISTING_RETRY_AFTER
+
+
+def test_listing_of_listed_type(listings):
+    assert server._listing('volume', 'ceph') == dict(vol1=dict(
+        id='vol1', size=1, volume_type='ceph', status='available'))
+    with pytest.raises(utils.Overloaded):
+        server._listing('volume', 'netapp')
+
+
+@pytest.fixture
+def request_params(monkeypatch):
+    # RoutesDispatcher puts the route variables into the request params
+    monkeypatch.setattr(cherrypy.request, 'params', dict(
+        api_ver='v2', tenant_id='admin', volume_type='ceph', limit='2'))
+    monkeypatch.setattr(cherrypy.request, 'query_string',
+                        'volume_type=ceph&limit=2')
+
+
+def _next_query(links):
+    assert [link['rel'] for link in links] == ['next']
+    return parse_qsl(urlparse(links[0]['href']).query)
+
+
+def test_paginate(request_params):
+    resources = dict((i, i.upper()) for i in ('c', 'a', 'e', 'b', 'd'))
+    page, links = server._paginate('volumes', resources, '2')
+    assert page == ['A', 'B']
+    assert _next_query(links) == [('volume_type', 'ceph'), ('limit', '2'),
+                                  ('marker', 'b')]
+    page, links = server._paginate('volumes', resources, '2', 'b')
+    assert page == ['C', 'D']
+    assert dict(_next_query(links))['marker'] == 'd'
+    page, links = server._paginate('volumes', resources, '2', 'd')
+    assert page == ['E']
+    assert links == []
+
+
+def test_paginate_without_limit():
+    page, links = server._paginate('volumes', dict(a=1, b=2), None, 'a')
+    assert page == [2]
+    assert links == []
+
+
+@pytest.mark.parametrize('limit,marker', [
+    ('x', None), ('0', None), ('-1', None), (None, 'z'),
+])
+def test_paginate_invalid(limit, marker):
+    with pytest.raises(cherrypy.HTTPError) as e:
+        server._paginate('volumes', dict(a=1), limit, marker)
+    assert _status(e) == 400
+
+
+@pytest.fixture
+def lookups(monkeypatch, tmpdir):
+    searches = []
+
+    def search(probes):
+        searches.append(probes)
+        return None
+
+    monkeypatch.setattr(server, 'location_index', locations.LocationIndex(
+        str(tmpdir.join('locations.json'))))
+    monkeypatch.setattr(server, 'lookup_cache', cache.TTLCache())
+    monkeypatch.setattr(server, 'negative_cache', cache.TTLCache())
+    monkeypatch.setattr(server, '_volume_probe', lambda vt, vid: vt)
+    monkeypatch.setattr(server, '_search', search)
+    return searches
+
+
+def test_unknown_volume_is_remembered(lookups):
+    for i in range(2):
+        with pytest.raises(cherrypy.HTTPError) as e:
+            server.find_volume('vol1')
+        assert _status(e) == 404
+    assert lookups == [['ceph', 'netapp']]
+
+
+def test_invalidate_forgets_unknown_volume(lookups):
+    with pytest.raises(cherrypy.HTTPError):
+        server.find_volume('vol1')
+    server._invalidate('volume', 'vol1')
+    with pytest.raises(cherrypy.HTTPError):
+        server.find_volume('vol1')
+    assert len(lookups) == 2
+
+
+def test_indexed_volume_ignores_negative_entry(lookups):
+    server.negative_cache.put(('volume', 'vol1'), True)
+    server.location_index.add_volume('vol1', 'ceph', 1)
+    res = server.find_volume('vol1', verify=False)
+    assert res.type == 'ceph'
+
+
+class Probe(object):
+    """A fake lookup on one volume type, which may block until cancelled."""
+
+    def __init__(self, volume_type, state='absent', error=None, block=False):
+        self.volume_type = volume_type
+        self.state = state
+        self.error = error
+        self.block = block
+        self.cancelled = threading.Event()
+
+    def run(self):
+        if self.block:
+            self.cancelled.wait(5)
+            raise utils.Cancelled("cancelled")
+        if self.error is not None:
+            raise self.error
+        return dict(state=self.state)
+
+    def cancel(self):
+        self.cancelled.set()
+
+
+@pytest.fixture(params=[False, True], ids=['sequential', 'parallel'])
+def search_pool(request, monkeypatch):
+    workers = pool.WorkerPool('search', 4) if request.param else None
+    monkeypatch.setattr(server, 'search_pool', workers)
+    yield workers
+    if workers is not None:
+        workers.stop()
+
+
+def test_search_finds_present(search_pool):
+    probes = [Probe('ceph'), Probe('netapp', state='present')]
+    res = server._search(probes)
+    assert res.type == 'netapp'
+    assert res.info == dict(state='present')
+
+
+def test_search_all_absent(search_pool):
+    assert server._search([Probe('ceph'), Probe('netapp')]) is None
+
+
+def test_search_error_is_not_absent(search_pool):
+    with pytest.raises(RuntimeError):
+        server._search([Probe('ceph'), Probe('netapp',
+                                             error=RuntimeError("boom"))])
+
+
+def test_search_found_despite_error(search_pool):
+    res = server._search([Probe('ceph', error=RuntimeError("boom")),
+                          Probe('netapp', state='present')])
+    assert res.type == 'netapp'
+
+
+def test_parallel_search_cancels_stragglers(monkeypatch):
+    workers = pool.WorkerPool('search', 2)
+    monkeypatch.setattr(server, 'search_pool', workers)
+    try:
+        straggler = Probe('ceph', block=True)
+        res = server._search([straggler, Probe('netapp', state='present')])
+        assert res.type == 'netapp'
+        assert straggler.cancelled.is_set()
+    finally:
+        workers.stop()
+
+
+@pytest.fixture
+def armed(tmpdir, monkeypatch):
+    monkeypatch.setattr(profiling, '_directory', str(tmpdir))
+    monkeypatch.setattr(profiling, '_armed_requests', 0)
+    monkeypatch.setattr(profiling, '_armed_types', {})
+    monkeypatch.setattr(profiling, 'begin', lambda request_id: None)
+    # _profiled() sets these, they are put back after the test
+    monkeypatch.setattr(cherrypy.request, 'hooks',
+                        cherrypy._cprequest.HookMap(['on_end_request']))
+    monkeypatch.setattr(cherrypy.request, 'path_info', '/')
+    monkeypatch.setattr(cherrypy.request, 'headers', {})
+    monkeypatch.setattr(cherrypy.response, 'headers', {})
+    profiling.arm(1)
+
+
+def _profiled(path, headers=None):
+    cherrypy.request.path_info = path
+    cherrypy.request.headers = headers or {}
+    cherrypy.response.headers = {}
+    server._start_request_profile()
+    return 'X-Quarry-Profile-Id' in cherrypy.response.headers
+
+
+def test_polling_keeps_armed_profile(armed):
+    assert not _profiled('/metrics')
+    assert not _profiled('/admin/profile')
+    assert profiling.armed()['requests'] == 1
+    # Asking for it still works
+    assert _profiled('/metrics', {'X-Quarry-Profile': '1'})
+    assert profiling.armed()['requests'] == 1
+    assert _profiled('/v2/admin/volumes')
+    assert profiling.armed()['requests'] == 0
@@ -0,0 +1,122 @@
+#
+#  Copyright 2017 Red Hat, Inc. and/or its affiliates.
+#
+# Licensed to you under the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.  See the files README and
+# LICENSE_GPL_v2 which accompany this distribution.
+#
+
+import json
+
+import pytest
+
+import playcaller
+import tracing
+import utils
+
+
+@pytest.fixture
+def trace_file(tmpdir, monkeypatch):
+    path = tmpdir.join('trace.json')
+    monkeypatch.setattr(tracing, '_path', str(path))
+    monkeypatch.setattr(tracing, '_local', tracing.threading.local())
+    return path
+
+
+def _spans(trace_file):
+    spans = []
+    for line in trace_file.readlines():
+        request = json.loads(line)
+        resource = request['resourceSpans'][0]
+        assert resource['resource']['attributes'] == [dict(
+            key='service.name', value=dict(stringValue='quarry'))]
+        spans.extend(resource['scopeSpans'][0]['spans'])
+    return spans
+
+
+def test_disabled(monkeypatch):
+    monkeypatch.setattr(tracing, '_path', None)
+    assert tracing.begin('request') is None
+    with tracing.span('work') as span:
+        assert span is None
+    assert tracing.context() is None
+
+
+def test_span_encoding(trace_file):
+    with tracing.span('request', trace_id='0' * 31 + '1', kind=2,
+                      method='GET', size=3, ratio=0.5, fast=True,
+                      missing=None):
+        with tracing.span('child'):
+            pass
+    child, root = _spans(trace_file)
+    assert root['traceId'] == '0' * 31 + '1'
+    assert root['kind'] == 2
+    assert 'parentSpanId' not in root
+    assert root['attributes'] == [
+        dict(key='fast', value=dict(boolValue=True)),
+        dict(key='method', value=dict(stringValue='GET')),
+        dict(key='ratio', value=dict(doubleValue=0.5)),
+        dict(key='size', value=dict(intValue='3')),
+    ]
+    assert len(root['spanId']) == 16
+    assert int(root['endTimeUnixNano']) >= int(root['startTimeUnixNano'])
+    assert child['traceId'] == root['traceId']
+    assert child['parentSpanId'] == root['spanId']
+    assert child['kind'] == 1
+    assert tracing.current() is None
+
+
+def test_invalid_trace_id_is_replaced(trace_file):
+    span = tracing.begin('request', trace_id='not-a-trace-id')
+    tracing.end(span)
+    assert len(span.trace_id) == 32
+    assert span.trace_id != 'not-a-trace-id'
+
+
+def test_error_status(trace_file):
+    with pytest.raises(RuntimeError):
+        with tracing.span('request'):
+            raise RuntimeError("boom")
+    span, = _spans(trace_file)
+    assert span['status'] == dict(code=2, message='boom')
+
+
+def test_context_and_attach(trace_file):
+    with tracing.span('request') as span:
+        assert tracing.context() == dict(trace_id=span.trace_id,
+                                         span_id=span.span_id)
+    with tracing.attach(span):
+        assert tracing.current() is span
+    assert tracing.current() is None
+
+
+class FakePopen(object):
+
+    def __init__(self, rc, out):
+        self.rc = rc
+        self.out = out
+        self.pid = 1
+
+    def __call__(self, cmd, **kwargs):
+        self.cmd = cmd
+        return self
+
+    def communicate(self, data=None):
+        self.returncode = self.rc
+        return self.out, ''
+
+
+def test_spans_of_failed_module_are_exported(trace_file, monkeypatch):
+    module_span = dict(traceId='1' * 32, spanId='2' * 16, name='module',
+                       kind=1, startTimeUnixNano='1', endTimeUnixNano='2',
+                       attributes=[])
+    out = json.dumps(dict(type='result', index=0, task='create', host='h',
+                          status='failed',
+                          result=dict(failed=True, msg="boom",
+                                      quarry_spans=[module_span])))
+    monkeypatch.setattr(playcaller.subprocess, 'Popen', FakePopen(2, out))
+    caller = playcaller.PlayCaller('ceph', 'create_volume', {})
+    with pytest.raises(utils.AnsibleError):
+        caller._run_ansible('create_volume.yml')
+    assert module_span in _spans(trace_file)